@@ -0,0 +1,94 @@
+"""
+InterstellarAge
+arrivals.py
+
+This module defines the `ArrivalBatch` class. Fleets that arrive during a
+phase of a turn (see "orders.py") are not resolved one at a time as their
+orders run. They are collected by the `Galaxy`'s `ArrivalBatch` and resolved
+together at the end of the phase: each `Planet` once, with every fleet that
+arrived there, and each `System` discovered once by each `Player` that
+reached or conquered it.
+"""
+
+# Import python modules
+from collections import OrderedDict
+
+# Import our modules
+import system as system_lib
+
+class ArrivalBatch(object):
+    """
+    Private Attributes:
+        _incoming (OrderedDict):
+            Maps the `unique` of every `Planet` that fleets arrived at to a
+            tuple of `(planet, fleets)`, where `fleets` maps each arriving
+            `Player` to a `list` of the sizes of its fleets.
+
+        _explorers (OrderedDict):
+            Maps `(system unique, player unique)` to `(system, player)` for
+            every fleet sent to a `System` rather than to one of its
+            `Planet`s. Those `Player`s discover the `System` whatever the
+            outcome of the fighting.
+    """
+
+    def __init__(self):
+        self._incoming = OrderedDict()
+        self._explorers = OrderedDict()
+
+    def __len__(self):
+        return len(self._incoming)
+
+    def add(self, destination, fleet_size, player):
+        """
+        Records a fleet arriving during the current phase.
+
+        Args:
+            destination (Planet or System):
+                Where the fleet arrives. A fleet sent to a `System` arrives at
+                its outermost `Planet`.
+
+            fleet_size (int):
+                The number of ships in the fleet.
+
+            player (Player):
+                The `Player` the fleet belongs to.
+        """
+
+        if isinstance(destination, system_lib.System):
+            key = (destination.unique, player.unique)
+            self._explorers[key] = (destination, player)
+            planet = destination.planets[-1]
+        else:
+            planet = destination
+
+        entry = self._incoming.get(planet.unique)
+        if entry is None:
+            entry = (planet, {})
+            self._incoming[planet.unique] = entry
+        entry[1].setdefault(player, []).append(fleet_size)
+
+    def resolve(self):
+        """
+        Resolves every fleet recorded since the last call and empties the
+        batch. Every `System` with an arrival is touched once, and each
+        `Player` discovers each `System` it reached or conquered a `Planet`
+        in once.
+        """
+
+        discoveries = OrderedDict(self._explorers)
+        touched = OrderedDict()
+        for (planet, fleets) in self._incoming.values():
+            system = planet.system()
+            touched[system.unique] = system
+            if planet.resolve_arrivals(fleets):
+                system.galaxy.income_changed(planet)
+                owner = [p for p in fleets if planet.owned_by(p)][0]
+                discoveries[(system.unique, owner.unique)] = (system, owner)
+
+        self._incoming = OrderedDict()
+        self._explorers = OrderedDict()
+
+        for system in touched.values():
+            system.touch()
+        for (system, player) in discoveries.values():
+            system.discover(player)
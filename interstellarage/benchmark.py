@@ -0,0 +1,954 @@
+"""
+InterstellarAge
+benchmark.py
+
+This module times the parts of the game that have to keep up as galaxies get
+bigger. Run it from this directory with the name of the benchmark to run:
+
+    python benchmark.py generation
+
+Running it with no arguments runs every benchmark. The random numbers are
+seeded with `BENCH_SEED` before each benchmark, so every run times the same
+galaxies and orders.
+
+The simulation benchmark also compares its times with the baselines in
+"benchmark_baselines.json". Add "--record" to replace the baselines with the
+times of this run, or "--check" to exit with an error if any time is more
+than `BENCH_REGRESSION_RATIO` times its baseline:
+
+    python benchmark.py simulation --check
+"""
+
+# Import python modules
+from array import array
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# NumPy is needed by the turn benchmark.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Import our modules
+import galaxy as galaxy_lib
+import galaxycache as galaxycache_lib
+import ledger as ledger_lib
+import orders as order_lib
+import planet as planet_lib
+import planettable as planettable_lib
+import galaxyfile as galaxyfile_lib
+import scheduler as scheduler_lib
+import simulation as simulation_lib
+import storage as storage_lib
+import system as system_lib
+import turnqueue as turnqueue_lib
+
+# Define constants.
+
+# The number of times each benchmark is run. The best time is reported.
+BENCH_REPEAT = 3
+
+# What the random numbers are seeded with before each benchmark.
+BENCH_SEED = 2014
+
+# The file the simulation benchmark's baselines are kept in, and how much
+# slower than its baseline a time may be before "--check" fails. Times within
+# `BENCH_REGRESSION_MIN` seconds of their baseline always pass, since the
+# shortest stages are mostly noise.
+BENCH_BASELINES_FILENAME = "benchmark_baselines.json"
+BENCH_REGRESSION_RATIO = 1.25
+BENCH_REGRESSION_MIN = 0.01
+
+# The grid sizes used by the generation benchmark, as multiples of the volume
+# of the default galaxy.
+GENERATION_SCALES = [1, 4, 16]
+
+# The grid size (as a multiple of the volume of the default galaxy) that the
+# region generation benchmark generates with pools of worker processes.
+REGIONS_SCALE = 16
+
+# The number of orders of each kind in the batch parsed by the order parsing
+# benchmark.
+ORDERS_PER_KIND = 250
+
+# The numbers of planets that the turn benchmark totals up income and fleets
+# for, and the number of planets in each of its systems.
+TURN_PLANET_COUNTS = [10000, 100000, 1000000]
+TURN_PLANETS_PER_SYSTEM = 5
+
+# The turn benchmark only builds `Planet` objects (to time walking them) for
+# up to this many planets, so that it does not run out of memory.
+TURN_MAX_OBJECT_PLANETS = 100000
+
+# The number of systems that change during each turn of the turn benchmark.
+TURN_CHANGED_SYSTEMS = 100
+
+# The number of games whose turns the resolver benchmark resolves at once.
+RESOLVER_GAMES = 100
+
+class BenchPlayer(object):
+    """
+    Stands in for a `Player` so that benchmarks do not need a database. Only
+    the parts of `Player` that the galaxy and order code use are here.
+    """
+
+    def __init__(self, unique, shortname, faction_code=0):
+        self.unique = unique
+        self.shortname = shortname
+        self.faction_code = faction_code
+        self.money = 0
+
+    def faction_shortname(self):
+        return self.shortname
+
+
+
+class BenchGame(object):
+    """
+    Stands in for a `Game` so that benchmarks do not need a database. Only the
+    parts of `Game` that the galaxy and order code use are here.
+    """
+
+    def __init__(self, players):
+        self.unique = 0
+        self.players = players
+        self.galaxy = None
+
+    def player_for_faction(self, faction_shortname):
+        for player in self.players:
+            if player.faction_shortname() == faction_shortname:
+                return player
+        return None
+
+    def player_for_unique(self, unique):
+        for player in self.players:
+            if player.unique == unique:
+                return player
+        return None
+
+
+
+class BenchObject(object):
+    """
+    Holds the attributes of a `Planet` or a `Colony` in an instance `dict`,
+    the way they were held before those classes used slots. The memory
+    benchmark uses it as its baseline.
+    """
+
+    pass
+
+
+
+def bench_game():
+    """
+    Returns:
+        A `BenchGame` with one `BenchPlayer` and a freshly generated `Galaxy`.
+    """
+
+    game = BenchGame([BenchPlayer(1, "ISCA")])
+    game.galaxy = galaxy_lib.Galaxy(game, generate=True)
+    return game
+
+
+
+def seed_random():
+    """
+    Seeds Python's and NumPy's random numbers with `BENCH_SEED`.
+    """
+
+    global BENCH_SEED
+
+    random.seed(BENCH_SEED)
+    if numpy is not None:
+        numpy.random.seed(BENCH_SEED)
+
+
+
+def best_time(function, repeat=BENCH_REPEAT):
+    """
+    Args:
+        function (function):
+            The function to time. It is called with no arguments.
+
+    Keyword Args:
+        repeat (int):
+            How many times to call `function`.
+
+    Returns:
+        A `float` -- the fastest of the `repeat` calls, in seconds.
+    """
+
+    times = []
+    for a in xrange(0, repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+
+
+def process_counts():
+    """
+    Returns:
+        A `list` of the numbers of processes to time parallel work with: the
+        powers of two up to the number of cores, then the number of cores.
+    """
+
+    cores = multiprocessing.cpu_count()
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+
+def bench_generation():
+    """
+    Compares the cell-by-cell scan of the galactic grid with the NumPy scan at
+    the default galaxy size and at larger multiples of its volume.
+    """
+
+    width = galaxy_lib.GALAXY_WIDTH
+    length = galaxy_lib.GALAXY_LENGTH
+    height = galaxy_lib.GALAXY_HEIGHT
+
+    print "Galaxy generation (grid scan)"
+    print "{0:>6} {1:>16} {2:>10} {3:>10} {4:>8}".format(
+        "scale", "grid", "loop (s)", "numpy (s)", "speedup")
+
+    for scale in GENERATION_SCALES:
+        # Grow the galaxy along its width and length so that the volume grows
+        # by `scale`. The sides stay odd so that (0, 0, 0) stays the center.
+        side = int(scale ** 0.5)
+        w = side * (width - 1) + 1
+        l = side * (length - 1) + 1
+        h = height
+
+        loop = lambda: galaxy_lib._scan_grid_loop(w, l, h)
+        vectorized = lambda: galaxy_lib._scan_grid_vectorized(w, l, h)
+        loop_time = best_time(loop)
+        vectorized_time = best_time(vectorized)
+
+        print "{0:>6} {1:>16} {2:>10.4f} {3:>10.4f} {4:>7.1f}x".format(
+            str(scale) + "x",
+            "{0}x{1}x{2}".format(w, l, h),
+            loop_time,
+            vectorized_time,
+            loop_time / vectorized_time
+        )
+
+
+
+def bench_regions():
+    """
+    Times generating the `System`s of a galaxy `REGIONS_SCALE` times the
+    volume of the default galaxy with pools of one worker process up to one
+    per core (see `galaxy.generated_systems`), and checks that every pool
+    generates exactly the same `System`s.
+    """
+
+    global BENCH_SEED
+    global REGIONS_SCALE
+
+    # Grow the galaxy along its width and length, as `bench_generation` does.
+    config = list(galaxy_lib.generation_config())
+    side = int(REGIONS_SCALE ** 0.5)
+    config[0] = side * (config[0] - 1) + 1
+    config[1] = side * (config[1] - 1) + 1
+    config = tuple(config)
+    regions = len(galaxy_lib.generation_regions(config))
+
+    title = "Region generation ({0}x{1}x{2}, {3} regions, {4} cores)"
+    print title.format(config[0], config[1], config[2], regions,
+                       multiprocessing.cpu_count())
+    print "{0:>10} {1:>10} {2:>10} {3:>8}".format(
+        "processes", "time (s)", "systems", "speedup")
+
+    first_time = None
+    first_records = None
+    for count in process_counts():
+        galaxycache_lib.clear_generated()
+        start = time.time()
+        systems = galaxy_lib.generated_systems(BENCH_SEED, config=config,
+                                               workers=count)
+        elapsed = time.time() - start
+
+        records = [(s.as_record(), d) for (s, d) in systems]
+        if first_records is None:
+            first_records = records
+            first_time = elapsed
+        elif records != first_records:
+            print "{0} processes generated different systems.".format(count)
+            return
+
+        print "{0:>10} {1:>10.2f} {2:>10} {3:>7.1f}x".format(
+            count, elapsed, len(systems), first_time / elapsed)
+    galaxycache_lib.clear_generated()
+
+
+
+def _scan_planet_for_unique(galaxy, unique):
+    """
+    PRIVATE FUNCTION
+
+    Finds a `Planet` by looking at every `Planet` in `galaxy`. This is how
+    `Galaxy.planet_for_unique` worked before it had a registry.
+    """
+
+    for system in galaxy.systems:
+        for planet in system.flat_planets():
+            if planet.unique == unique:
+                return planet
+    return None
+
+
+
+def _scan_system_for_unique(galaxy, unique):
+    """
+    PRIVATE FUNCTION
+
+    Finds a `System` by looking at every `System` in `galaxy`. This is how
+    `Galaxy.system_for_unique` worked before it had a registry.
+    """
+
+    for system in galaxy.systems:
+        if system.unique == unique:
+            return system
+    return None
+
+
+
+def _order_batch(game):
+    """
+    PRIVATE FUNCTION
+
+    Gives the only `Player` in `game` a fleet above random `Planet`s and
+    returns a `dict` of order `dict`s (in the format sent by the client) that
+    use those `Planet`s.
+    """
+
+    global ORDERS_PER_KIND
+
+    galaxy = game.galaxy
+    player = game.players[0]
+    planets = [p for s in galaxy.systems for p in s.flat_planets()]
+    owned = random.sample(planets, ORDERS_PER_KIND)
+    for planet in owned:
+        planet.owner_code = player.faction_code
+        planet.fleets = array('i', [1, 1, 1])
+
+    batch = {'move' : [], 'hyperspace' : [], 'build' : [], 'colonize' : []}
+    for planet in owned:
+        batch['move'].append({
+            'orderer' : player.unique,
+            'from_planet' : planet.unique,
+            'to_planet' : random.choice(planets).unique,
+            'fleet_number' : 0
+        })
+        batch['hyperspace'].append({
+            'orderer' : player.unique,
+            'from_planet' : planet.unique,
+            'to_system' : random.choice(galaxy.systems).unique,
+            'fleet_number' : 1
+        })
+        batch['build'].append({
+            'orderer' : player.unique,
+            'at_planet' : planet.unique,
+            'in_fleet' : 2,
+            'ships' : 1
+        })
+        batch['colonize'].append({
+            'orderer' : player.unique,
+            'planet' : planet.unique,
+            'upgrade_type' : order_lib.ORDER_UPGRADE_SPACE_TYPE,
+            'new_colony_name' : "Bench"
+        })
+    return batch
+
+
+
+def bench_order_parsing():
+    """
+    Times parsing a batch of orders with the unique ID registries against
+    parsing the same batch with the old linear scans.
+    """
+
+    game = bench_game()
+    galaxy = game.galaxy
+    batch = _order_batch(game)
+
+    parsers = [
+        ('move', order_lib.move_order_from_dict),
+        ('hyperspace', order_lib.hyperspace_order_from_dict),
+        ('build', order_lib.build_fleet_order_from_dict),
+        ('colonize', order_lib.upgrade_planet_order_from_dict)
+    ]
+
+    def parse():
+        for (kind, parser) in parsers:
+            for data in batch[kind]:
+                parser(data, game)
+
+    registry_time = best_time(parse)
+
+    # Swap the registry lookups for the old scans on this one galaxy.
+    galaxy.planet_for_unique = lambda u: _scan_planet_for_unique(galaxy, u)
+    galaxy.system_for_unique = lambda u: _scan_system_for_unique(galaxy, u)
+    scan_time = best_time(parse, repeat=1)
+
+    planets = len(galaxy._planets_by_unique)
+    orders = sum(len(batch[kind]) for kind in batch)
+    print "Order batch parsing ({0} orders, {1} systems, {2} planets)".format(
+        orders, len(galaxy.systems), planets)
+    print "{0:>12} {1:>10}".format("lookup", "time (s)")
+    print "{0:>12} {1:>10.4f}".format("scan", scan_time)
+    print "{0:>12} {1:>10.4f}".format("registry", registry_time)
+    print "speedup: {0:.1f}x".format(scan_time / registry_time)
+
+
+
+def _bench_systems(players, count):
+    """
+    PRIVATE FUNCTION
+
+    Returns a `list` of `System`s holding `count` `Planet`s (with uniques
+    from 1 to `count`) with random owners from `players`, colonies and
+    fleets.
+    """
+
+    global TURN_PLANETS_PER_SYSTEM
+
+    types = [
+        planet_lib.GasPlanet,
+        planet_lib.RockyPlanet,
+        planet_lib.HabitablePlanet
+    ]
+    owners = [player.faction_code for player in players] + [None]
+    colony = planet_lib.Colony("Bench")
+
+    systems = []
+    unique = 0
+    while unique < count:
+        system = system_lib.System("Bench")
+        system.unique = len(systems) + 1
+        for a in xrange(0, min(TURN_PLANETS_PER_SYSTEM, count - unique)):
+            unique += 1
+            planet = random.choice(types)()
+            planet.unique = unique
+            planet.parent = system
+            planet.owner_code = random.choice(owners)
+            ground = random.randint(0, planet.MAX_GROUND_COLONIES)
+            space = random.randint(0, planet.MAX_SPACE_COLONIES)
+            planet.ground_colonies = [colony] * ground
+            planet.space_colonies = [colony] * space
+            planet.fleets = array('i', [random.randint(0, 9) for b in
+                                        xrange(0, 3)])
+            system.planets.append(planet)
+        systems.append(system)
+    return systems
+
+
+
+def _random_table(count, factions):
+    """
+    PRIVATE FUNCTION
+
+    Returns a `PlanetTable` of `count` made-up `Planet`s (with uniques from 1
+    to `count`) owned at random by the first `factions` factions or by no
+    one.
+    """
+
+    global TURN_PLANETS_PER_SYSTEM
+
+    capacities = numpy.array([(0, 4), (4, 4), (8, 4)])
+    types = numpy.random.randint(0, len(capacities), count)
+    max_ground = capacities[types, 0]
+    max_space = capacities[types, 1]
+    random_upto = lambda high: (numpy.random.random(count) * (high + 1))
+
+    table = planettable_lib.PlanetTable(count)
+    table.unique[:] = numpy.arange(1, count + 1)
+    table.system[:] = table.unique // TURN_PLANETS_PER_SYSTEM + 1
+    table.owner[:] = numpy.random.randint(-1, factions, count)
+    table.max_ground_colonies[:] = max_ground
+    table.max_space_colonies[:] = max_space
+    table.ground_colonies[:] = random_upto(max_ground)
+    table.space_colonies[:] = random_upto(max_space)
+    table.fleets[:] = numpy.random.randint(0, 10, (count, 3))
+    return table
+
+
+
+def bench_turn():
+    """
+    Times totaling up the income and fleets of every faction at the end of a
+    turn, by walking every `Planet` object and with a `PlanetTable` in which
+    `TURN_CHANGED_SYSTEMS` `System`s changed during the turn. Also times
+    reading the income from an `IncomeLedger` after the `Planet`s of those
+    `System`s changed.
+    """
+
+    global TURN_CHANGED_SYSTEMS
+    global TURN_MAX_OBJECT_PLANETS
+    global TURN_PLANET_COUNTS
+    global TURN_PLANETS_PER_SYSTEM
+
+    if numpy is None:
+        print "The turn benchmark needs NumPy."
+        return
+
+    codes = [0, 1, 2, 3]
+    players = [BenchPlayer(c + 1, "P{0}".format(c), c) for c in codes]
+    game = BenchGame(players)
+
+    # The systems that change every turn. Their planets have the same uniques
+    # as the first rows of every table.
+    changed_planets = TURN_CHANGED_SYSTEMS * TURN_PLANETS_PER_SYSTEM
+    changed = _bench_systems(players, changed_planets)
+
+    print "End of turn income and fleet totals"
+    print "{0:>10} {1:>10} {2:>10} {3:>8} {4:>11}".format(
+        "planets", "walk (s)", "table (s)", "speedup", "ledger (s)")
+
+    for count in TURN_PLANET_COUNTS:
+        table = _random_table(count, len(codes))
+        ledger = ledger_lib.ledger_for_table(table)
+
+        def table_turn():
+            for system in changed:
+                table.mark(system)
+            table.income_by_faction()
+            table.fleets_by_faction()
+
+        def ledger_turn():
+            for system in changed:
+                for planet in system.flat_planets():
+                    ledger.update(planet)
+            ledger.income_by_faction()
+
+        table_time = best_time(table_turn)
+        ledger_time = best_time(ledger_turn)
+
+        if count > TURN_MAX_OBJECT_PLANETS:
+            print "{0:>10} {1:>10} {2:>10.4f} {3:>8} {4:>11.5f}".format(
+                count, "-", table_time, "-", ledger_time)
+            continue
+
+        galaxy = galaxy_lib.Galaxy(game)
+        galaxy.systems = _bench_systems(players, count)
+
+        def walk_turn():
+            galaxy._sum_by_faction(lambda p: p.economic_output())
+            galaxy._sum_by_faction(lambda p: p.strength())
+
+        walk_time = best_time(walk_turn)
+        print "{0:>10} {1:>10.4f} {2:>10.4f} {3:>7.1f}x {4:>11.5f}".format(
+            count, walk_time, table_time, walk_time / table_time, ledger_time)
+
+
+
+def _dict_planet(data):
+    """
+    PRIVATE FUNCTION
+
+    Returns a `BenchObject` holding what `planet_from_dict` made of `data`
+    before `Planet`s used slots: an instance `dict`, a `list` of fleets and
+    a copy of every string.
+    """
+
+    colony = lambda c: _dict_colony(c)
+
+    planet = BenchObject()
+    planet.unique = data['unique']
+    planet.name = data['name']
+    planet.moons = [_dict_planet(moon) for moon in data['moons']]
+    planet.parent = None
+    planet.space_colonies = [colony(c) for c in data['space_colonies']]
+    planet.ground_colonies = [colony(c) for c in data['ground_colonies']]
+    planet.owner_code = None
+    planet.fleets = data['fleets']
+    planet.orbit_distance = data['orbit_distance']
+    planet.orbit_period = data['orbit_period']
+    planet.size = data['size']
+    planet.texture = data['texture']
+    planet.rings = data['rings']
+    planet._next_assign = 0
+    planet._since_conquered = -1
+    return planet
+
+
+
+def _dict_colony(data):
+    """
+    PRIVATE FUNCTION
+
+    Returns a `BenchObject` holding what `colony_from_dict` made of `data`
+    before `Colony`s used slots.
+    """
+
+    colony = BenchObject()
+    colony.name = data['name']
+    return colony
+
+
+
+def _attributes(obj):
+    """
+    PRIVATE FUNCTION
+
+    Returns the `(name, value)` pairs of the attributes of `obj`, whether they
+    are kept in slots or in an instance `dict`.
+    """
+
+    if hasattr(obj, '__dict__'):
+        return obj.__dict__.items()
+
+    names = []
+    for cls in type(obj).__mro__:
+        names.extend(cls.__dict__.get('__slots__', ()))
+    return [(name, getattr(obj, name)) for name in names]
+
+
+
+def _planet_bytes(planet, seen):
+    """
+    PRIVATE FUNCTION
+
+    Returns the bytes of memory used by `planet`, its instance `dict` (if
+    any) and the values only it holds: its containers, colonies, numbers and
+    strings. Its moons, parent and owner are not counted. Objects whose ids
+    are in `seen` are not counted again, so strings that are shared between
+    `Planet`s are only counted once.
+    """
+
+    def value_bytes(value):
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
+
+        size = sys.getsizeof(value)
+        if isinstance(value, (list, tuple)):
+            size += sum(value_bytes(item) for item in value)
+        elif isinstance(value, (planet_lib.Colony, BenchObject)):
+            size += object_bytes(value)
+        return size
+
+    def object_bytes(obj):
+        size = 0
+        if hasattr(obj, '__dict__'):
+            size += sys.getsizeof(obj.__dict__)
+        for (name, value) in _attributes(obj):
+            if name in ('parent', 'owner'):
+                continue
+            elif name == 'moons':
+                size += sys.getsizeof(value)
+            else:
+                size += value_bytes(value)
+        return size
+
+    seen.add(id(planet))
+    return sys.getsizeof(planet) + object_bytes(planet)
+
+
+
+def _bytes_per_planet(planets):
+    """
+    PRIVATE FUNCTION
+
+    Returns the average number of bytes used by each of `planets`, as counted
+    by `_planet_bytes`.
+    """
+
+    seen = set()
+    total = sum(_planet_bytes(planet, seen) for planet in planets)
+    return total / float(len(planets))
+
+
+
+def bench_memory():
+    """
+    Compares the memory used by each `Planet` of a galaxy loaded from JSON
+    with the memory the same `Planet`s used before `Planet`s and `Colony`s
+    kept their attributes in slots.
+    """
+
+    game = bench_game()
+    data = json.loads(json.dumps(game.galaxy.as_list(discoveries=True)))
+    galaxy = galaxy_lib.galaxy_from_dict(data, game)
+
+    # Give some planets colonies so that colonies are measured too.
+    planets = [p for s in galaxy.systems for p in s.flat_planets()]
+    for planet in random.sample(planets, len(planets) // 10):
+        planet.space_colonies.append(planet_lib.Colony("Bench"))
+    data = json.loads(json.dumps(galaxy.as_list(discoveries=True)))
+
+    before = []
+    for system_data in data:
+        for planet in [_dict_planet(p) for p in system_data['planets']]:
+            before.append(planet)
+            before.extend(_flat_moons(planet))
+
+    galaxy = galaxy_lib.galaxy_from_dict(data, game)
+    after = [p for s in galaxy.systems for p in s.flat_planets()]
+
+    before_bytes = _bytes_per_planet(before)
+    after_bytes = _bytes_per_planet(after)
+    print "Memory per planet ({0} planets, loaded from JSON)".format(
+        len(after))
+    print "{0:>12} {1:>10}".format("layout", "bytes")
+    print "{0:>12} {1:>10.1f}".format("dict", before_bytes)
+    print "{0:>12} {1:>10.1f}".format("slots", after_bytes)
+    print "saved: {0:.1f}%".format(100 * (1 - after_bytes / before_bytes))
+
+
+
+def _flat_moons(planet):
+    """
+    PRIVATE FUNCTION
+
+    `Planet.flat_moons` for the `BenchObject`s made by `_dict_planet`.
+    """
+
+    moons = []
+    for moon in planet.moons:
+        moons.append(moon)
+        moons.extend(_flat_moons(moon))
+    return moons
+
+
+
+# The directory that the games of the resolver benchmark are saved in.
+_resolver_directory = None
+
+def _resolve_bench_turn(game_unique, turn):
+    """
+    PRIVATE FUNCTION
+
+    Resolves a turn of one of the resolver benchmark's games the way
+    `Game.resolve_turn` does, minus the database: loads the snapshot under
+    the game's lock, executes the orders, totals the income and writes a new
+    snapshot.
+    """
+
+    store = storage_lib.GameStore(game_unique, directory=_resolver_directory)
+    with store.lock():
+        game = BenchGame([BenchPlayer(1, "ISCA")])
+        game.galaxy = store.load_galaxy(game)
+        store.load_orders()
+        scheduler_lib.OrderScheduler().execute_turn(game.galaxy, turn)
+        game.galaxy.income_by_faction()
+        store.write_snapshot(game.galaxy, {})
+
+
+
+def bench_resolver():
+    """
+    Times resolving one turn of each of `RESOLVER_GAMES` games with a pool of
+    turn worker processes (see "turnqueue.py"), for pools of one process up
+    to one per core.
+    """
+
+    global RESOLVER_GAMES
+    global _resolver_directory
+
+    cores = multiprocessing.cpu_count()
+    counts = process_counts()
+
+    _resolver_directory = tempfile.mkdtemp() + "/"
+    try:
+        # Every game starts from a copy of the same snapshot.
+        game = bench_game()
+        first = storage_lib.GameStore(1, directory=_resolver_directory)
+        first.write_snapshot(game.galaxy, {})
+        for unique in xrange(2, RESOLVER_GAMES + 1):
+            store = storage_lib.GameStore(unique,
+                                          directory=_resolver_directory)
+            shutil.copy(first.galaxy_filename(), store.galaxy_filename())
+            shutil.copy(first.orders_filename(), store.orders_filename())
+
+        title = "Turn resolution ({0} games, {1} systems each, {2} cores)"
+        print title.format(RESOLVER_GAMES, len(game.galaxy.systems), cores)
+        print "{0:>10} {1:>10} {2:>10} {3:>8}".format(
+            "processes", "time (s)", "games/s", "speedup")
+
+        first_time = None
+        for (turn, count) in enumerate(counts):
+            queue_filename = _resolver_directory + "turns.sqlite"
+            if os.path.exists(queue_filename):
+                os.remove(queue_filename)
+            queue = turnqueue_lib.TurnQueue(queue_filename)
+            for unique in xrange(1, RESOLVER_GAMES + 1):
+                queue.enqueue(unique, turn)
+
+            pool = turnqueue_lib.TurnWorkerPool(
+                queue, _resolve_bench_turn, count=count, processes=True,
+                until_empty=True)
+            start = time.time()
+            pool.start()
+            pool.join()
+            elapsed = time.time() - start
+
+            done = [queue.status(unique, turn) for unique in
+                    xrange(1, RESOLVER_GAMES + 1)]
+            if done.count(turnqueue_lib.JOB_DONE) != RESOLVER_GAMES:
+                print "Some turns failed to resolve."
+                return
+
+            if first_time is None:
+                first_time = elapsed
+            print "{0:>10} {1:>10.2f} {2:>10.1f} {3:>7.1f}x".format(
+                count, elapsed, RESOLVER_GAMES / elapsed, first_time / elapsed)
+    finally:
+        shutil.rmtree(_resolver_directory)
+
+
+
+def _simulation_times():
+    """
+    PRIVATE FUNCTION
+
+    Times each stage of a simulated game with four players, each queuing
+    `ORDERS_PER_KIND` orders of every kind.
+
+    Returns:
+        A `dict` that maps the name of each stage to its best time in
+        seconds.
+    """
+
+    global BENCH_SEED
+
+    sim = simulation_lib.Simulation(faction_codes=(0, 1, 2, 3))
+    game = sim.game
+    times = {}
+
+    # Each run generates the same galaxy, first from scratch and then from
+    # the generation cache.
+    def generate():
+        galaxycache_lib.clear_generated()
+        galaxy_lib.Galaxy(game, generate=True, seed=BENCH_SEED)
+    times['generation'] = best_time(generate)
+    times['cached_generation'] = best_time(
+        lambda: galaxy_lib.Galaxy(game, generate=True, seed=BENCH_SEED))
+    sim.start(seed=BENCH_SEED)
+
+    # `_order_batch` gives the first player fleets above random planets.
+    batch = _order_batch(game)
+    sim.commit()
+    times['parsing'] = best_time(
+        lambda: order_lib.orders_from_dict(batch, game))
+
+    # Every run of the turn starts again from the same snapshot, with the
+    # orders replayed from the journal.
+    sim.submit(game.players[0], batch)
+    execution = []
+    for a in xrange(0, BENCH_REPEAT):
+        sim.reload()
+        start = time.time()
+        sim._scheduler.execute_turn(game.galaxy, game.on_turn)
+        simulation_lib.next_turn(game)
+        execution.append(time.time() - start)
+        game.on_turn -= 1
+    times['execution'] = min(execution)
+
+    times['serialization'] = best_time(
+        lambda: galaxyfile_lib.encode_galaxy(game.galaxy))
+
+    def load():
+        galaxy = sim.store.load_galaxy(game)
+        for system in galaxy.systems:
+            pass
+    times['load'] = best_time(load)
+    return times
+
+
+
+def bench_simulation(record=False, check=False):
+    """
+    Times generating a galaxy (with and without the generation cache),
+    parsing a batch of orders, executing them, serializing the galaxy and
+    loading it back, all in a `Simulation`, and compares the times with the
+    recorded baselines.
+
+    Keyword Args:
+        record (bool):
+            Whether to save the times as the new baselines.
+
+        check (bool):
+            Whether to exit with an error if any time is more than
+            `BENCH_REGRESSION_RATIO` times its baseline.
+    """
+
+    global BENCH_BASELINES_FILENAME
+    global BENCH_REGRESSION_MIN
+    global BENCH_REGRESSION_RATIO
+
+    stages = ['generation', 'cached_generation', 'parsing', 'execution',
+              'serialization', 'load']
+    times = _simulation_times()
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    filename = os.path.join(directory, BENCH_BASELINES_FILENAME)
+    baselines = {}
+    if os.path.exists(filename):
+        with open(filename) as baselines_file:
+            baselines = json.load(baselines_file)
+
+    print "Simulation stages (seed {0})".format(BENCH_SEED)
+    print "{0:>18} {1:>10} {2:>12} {3:>8}".format(
+        "stage", "time (s)", "baseline (s)", "ratio")
+    regressions = []
+    for stage in stages:
+        baseline = baselines.get(stage)
+        if baseline is None:
+            print "{0:>18} {1:>10.4f} {2:>12} {3:>8}".format(
+                stage, times[stage], "-", "-")
+            continue
+        ratio = times[stage] / baseline
+        slower = times[stage] - baseline > BENCH_REGRESSION_MIN
+        if ratio > BENCH_REGRESSION_RATIO and slower:
+            regressions.append(stage)
+        print "{0:>18} {1:>10.4f} {2:>12.4f} {3:>7.2f}x".format(
+            stage, times[stage], baseline, ratio)
+
+    if record:
+        with open(filename, 'w') as baselines_file:
+            json.dump(times, baselines_file, indent=4, sort_keys=True,
+                      separators=(",", ": "))
+            baselines_file.write("\n")
+        print "Recorded the baselines in {0}".format(BENCH_BASELINES_FILENAME)
+    elif regressions:
+        print "Slower than the baselines: {0}".format(", ".join(regressions))
+        if check:
+            sys.exit(1)
+
+
+
+BENCHMARKS = {
+    'generation' : bench_generation,
+    'memory' : bench_memory,
+    'orders' : bench_order_parsing,
+    'regions' : bench_regions,
+    'resolver' : bench_resolver,
+    'simulation' : bench_simulation,
+    'turn' : bench_turn
+}
+
+if __name__ == '__main__':
+    flags = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+    names = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    for name in names or sorted(BENCHMARKS.keys()):
+        seed_random()
+        if name == 'simulation':
+            bench_simulation(record="--record" in flags,
+                             check="--check" in flags)
+        else:
+            BENCHMARKS[name]()
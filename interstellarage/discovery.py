@@ -0,0 +1,264 @@
+"""
+InterstellarAge
+discovery.py
+
+This module defines the `DiscoveryMap` class, which records which `System`s
+each faction has discovered (and can see on the Galaxy Map) and in which of
+them it has discovered the `Planet`s. Each faction has two bitmaps over the
+indices of the `System`s in `Galaxy.systems`: bit `i` of a bitmap is set if
+the faction discovered `System` number `i`.
+
+Bits are stored most significant bit first in a `bytearray`, so bit `i` is
+`0x80 >> (i % 8)` in byte `i // 8`.
+"""
+
+# NumPy turns a bitmap into the list of its set bits in one pass. Without it,
+# the bits are found one byte at a time.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class DiscoveryMap(object):
+    """
+    Private Attributes:
+        _systems (dict):
+            Maps faction codes to the bitmap (`bytearray`) of the `System`s
+            that faction discovered.
+
+        _planets (dict):
+            Maps faction codes to the bitmap (`bytearray`) of the `System`s
+            whose `Planet`s that faction discovered.
+
+        _generations (dict):
+            Maps faction codes to the number of times that faction's bitmap
+            of `System`s changed.
+    """
+
+    def __init__(self):
+        self._systems = {}
+        self._planets = {}
+        self._generations = {}
+
+    def discover_system(self, faction_code, index):
+        """
+        Marks `System` number `index` as discovered by a faction.
+
+        Returns:
+            `True` if and only if the faction had not discovered it before.
+        """
+
+        if not _set_bit(self._systems, faction_code, index):
+            return False
+        self._bump(faction_code)
+        return True
+
+    def discover_planets(self, faction_code, index):
+        """
+        Marks the `Planet`s of `System` number `index` as discovered by a
+        faction.
+
+        Returns:
+            `True` if and only if the faction had not discovered them before.
+        """
+
+        return _set_bit(self._planets, faction_code, index)
+
+    def generation(self, faction_code):
+        """
+        Returns:
+            An `int` that changes every time a faction discovers another
+            `System`. Anything worked out from the `System`s a faction knows
+            can be kept for as long as this stays the same.
+        """
+
+        return self._generations.get(faction_code, 0)
+
+    def knows_system(self, faction_code, index):
+        """
+        Returns `True` if and only if a faction discovered `System` number
+        `index`.
+        """
+
+        return _bit(self._systems.get(faction_code), index)
+
+    def knows_planets(self, faction_code, index):
+        """
+        Returns `True` if and only if a faction discovered the `Planet`s of
+        `System` number `index`.
+        """
+
+        return _bit(self._planets.get(faction_code), index)
+
+    def systems_known_by(self, faction_code):
+        """
+        Returns:
+            The `list` of the indices of the `System`s that a faction
+            discovered, in increasing order.
+        """
+
+        return _set_bits(self._systems.get(faction_code))
+
+    def system_mask(self, index):
+        """
+        Returns:
+            An `int` with bit `faction_code` set for every faction that
+            discovered `System` number `index`.
+        """
+
+        return _faction_mask(self._systems, index)
+
+    def planets_mask(self, index):
+        """
+        Returns:
+            An `int` with bit `faction_code` set for every faction that
+            discovered the `Planet`s of `System` number `index`.
+        """
+
+        return _faction_mask(self._planets, index)
+
+    def set_bitmaps(self, faction_code, systems, planets):
+        """
+        Replaces the bitmaps of a faction.
+
+        Args:
+            faction_code (int):
+                The faction whose bitmaps these are.
+
+            systems (bytearray):
+                The bitmap of the `System`s the faction discovered.
+
+            planets (bytearray):
+                The bitmap of the `System`s whose `Planet`s the faction
+                discovered.
+        """
+
+        self._systems[faction_code] = systems
+        self._planets[faction_code] = planets
+        self._bump(faction_code)
+
+    def _bump(self, faction_code):
+        """
+        PRIVATE METHOD
+
+        Notes that the bitmap of `System`s of a faction changed.
+        """
+
+        self._generations[faction_code] = self.generation(faction_code) + 1
+
+
+
+def bitmaps_for_masks(masks, faction_codes):
+    """
+    Turns one faction mask per `System` (as returned by
+    `DiscoveryMap.system_mask`) into one bitmap per faction.
+
+    Args:
+        masks (list of int or array of uint8):
+            The faction mask of every `System`, in index order.
+
+        faction_codes (list of int):
+            The factions to make bitmaps for.
+
+    Returns:
+        A `dict` that maps each faction code to its bitmap (`bytearray`).
+    """
+
+    bitmaps = {}
+    if numpy is not None:
+        masks = numpy.asarray(masks, dtype=numpy.uint8)
+        for code in faction_codes:
+            bits = (masks >> code) & 1
+            bitmaps[code] = bytearray(numpy.packbits(bits).tostring())
+        return bitmaps
+
+    for code in faction_codes:
+        bitmap = bytearray((len(masks) + 7) // 8)
+        for (index, mask) in enumerate(masks):
+            if mask & (1 << code):
+                bitmap[index >> 3] |= 0x80 >> (index & 7)
+        bitmaps[code] = bitmap
+    return bitmaps
+
+
+
+def _set_bit(bitmaps, faction_code, index):
+    """
+    PRIVATE FUNCTION
+
+    Sets bit `index` of the bitmap of `faction_code` in `bitmaps`, growing the
+    bitmap if needed. Returns `True` if the bit was not set before.
+    """
+
+    bitmap = bitmaps.get(faction_code)
+    if bitmap is None:
+        bitmap = bytearray()
+        bitmaps[faction_code] = bitmap
+
+    byte = index >> 3
+    if byte >= len(bitmap):
+        bitmap.extend(bytearray(byte + 1 - len(bitmap)))
+
+    bit = 0x80 >> (index & 7)
+    if bitmap[byte] & bit:
+        return False
+    bitmap[byte] |= bit
+    return True
+
+
+
+def _bit(bitmap, index):
+    """
+    PRIVATE FUNCTION
+
+    Returns `True` if and only if bit `index` of `bitmap` (which may be
+    `None`) is set.
+    """
+
+    if bitmap is None:
+        return False
+    byte = index >> 3
+    return byte < len(bitmap) and bool(bitmap[byte] & (0x80 >> (index & 7)))
+
+
+
+def _set_bits(bitmap):
+    """
+    PRIVATE FUNCTION
+
+    Returns the `list` of the indices of the set bits of `bitmap` (which may
+    be `None`), in increasing order.
+    """
+
+    if not bitmap:
+        return []
+
+    if numpy is not None:
+        bits = numpy.unpackbits(numpy.frombuffer(bytes(bitmap),
+                                                 dtype=numpy.uint8))
+        return numpy.flatnonzero(bits).tolist()
+
+    indices = []
+    for (byte, value) in enumerate(bitmap):
+        if value == 0:
+            continue
+        for a in xrange(0, 8):
+            if value & (0x80 >> a):
+                indices.append(byte * 8 + a)
+    return indices
+
+
+
+def _faction_mask(bitmaps, index):
+    """
+    PRIVATE FUNCTION
+
+    Returns an `int` with bit `faction_code` set for every faction whose
+    bitmap in `bitmaps` has bit `index` set.
+    """
+
+    mask = 0
+    for (code, bitmap) in bitmaps.items():
+        if _bit(bitmap, index):
+            mask |= 1 << code
+    return mask
@@ -8,15 +8,38 @@ useful functions such as `generate_name`, which randomly creates a name.
 """
 
 # Import python modules
+import hashlib
 import random
 import json
+import multiprocessing
 import pickle
+from collections import OrderedDict
+
+# NumPy is used to scan the galactic grid during generation and to total up
+# income and fleets (see "planettable.py"). If it is not installed, then we
+# fall back to scanning the grid one cell at a time and walking every planet.
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Import our modules
+import arrivals as arrivals_lib
+import discovery as discovery_lib
+import galaxycache as galaxycache_lib
+import galaxystream as galaxystream_lib
+import jumpmatrix as jumpmatrix_lib
+import ledger as ledger_lib
+import maplod as maplod_lib
+import planet as planet_lib
+import planettable as planettable_lib
+import routes as routes_lib
 import system as system_lib
+import spatial as spatial_lib
+import viewcache as viewcache_lib
 
 # Import Flask
-from flask import request
+from flask import request, Response, stream_with_context
 
 # This is so we can bind URLs
 from interstellarage import app
@@ -41,6 +64,24 @@ GALAXY_LENGTH = 101
 GALAXY_WIDTH = 101
 GALAXY_HEIGHT = 21
 
+# Every galaxy is generated from a seed. New seeds are picked between zero and
+# `GALAXY_SEED_MAX` so that they fit in a database column.
+GALAXY_SEED_MAX = 2 ** 31 - 1
+
+# The galactic grid is generated in regions of this many grid spaces along the
+# x-axis. Each region draws its random numbers from its own stream, seeded by
+# `region_seed`, so a region comes out the same however the others are made.
+GALAXY_REGION_WIDTH = 10
+
+# The number of processes that generate the regions of a galaxy at once, or
+# zero for one per core. A region comes out the same in any process, so this
+# only changes how long generation takes. Starting the processes and sending
+# the regions back costs about as much as generating a galaxy of the default
+# size, so grids with fewer than `GALAXY_PARALLEL_MIN_CELLS` cells are
+# generated in one process.
+GALAXY_GENERATION_WORKERS = 0
+GALAXY_PARALLEL_MIN_CELLS = 500000
+
 # The chance that a solar system won't have a name randomly generated from
 # syllables.
 CHANCE_SYSTEM_NAME = 0.5
@@ -71,13 +112,65 @@ class Galaxy(object):
     `Planet`s, which are the whole purpose behind the game.
 
     Attributes:
-        game (Game):
-            The game associated with this `Galaxy`.
+        game_unique (int):
+            The unique of the `Game` associated with this `Galaxy`.
+
+        faction_codes (list of int):
+            The faction codes of the `Player`s of that `Game`.
 
         systems (list of System):
             The `System`s in this `Galaxy`.
 
+        version (int):
+            Goes up by one every time a `System` in this `Galaxy` changes. It
+            is equal to the highest `System.version` in this `Galaxy`.
+
+        seed (int):
+            The seed this `Galaxy` was generated from, or `None` if it was not
+            generated (but loaded, for instance).
+
     Private Attributes:
+        _by_version (OrderedDict):
+            Maps the `unique` of every `System` in this `Galaxy` to that
+            `System`, ordered from the least to the most recently changed
+            `System`.
+
+        _by_version_sorted (boolean):
+            `False` if a `System` was added out of version order and
+            `_by_version` has to be sorted before it is used.
+
+        _planets_by_unique (dict):
+            Maps the `unique` of every `Planet` in this `Galaxy` to that
+            `Planet`.
+
+        _systems_by_unique (dict):
+            Maps the `unique` of every `System` in this `Galaxy` to that
+            `System`.
+
+        _spatial_index (SpatialIndex):
+            Files the `System`s in `systems` by position so that the `System`s
+            near a position can be found without looking at all of them.
+
+        _planet_table (PlanetTable or None):
+            The numbers of every `Planet` in NumPy columns, once they are
+            needed. Thrown away when a `System` is added.
+
+        _ledger (IncomeLedger or None):
+            The income of every faction, once it is needed. Thrown away when a
+            `System` is added.
+
+        _arrivals (ArrivalBatch):
+            The fleets that arrived during the current phase of the turn and
+            have not been resolved yet.
+
+        _discovery (DiscoveryMap):
+            Which `System`s (and the `Planet`s of which `System`s) each
+            faction has discovered, by `System.index`.
+
+        _route_planners (dict):
+            Maps faction codes to the `RoutePlanner` last made for that
+            faction.
+
         _planet_unique_counter (int):
             This attribute is incremented every time a new planet is created in
             this `Galaxy`. This way, every `Planet` is assigned a unique `int`
@@ -89,13 +182,26 @@ class Galaxy(object):
             in its `unique` field.
     """
 
-    game = None
+    game_unique = None
+    faction_codes = []
     systems = []
-
+    version = 0
+    seed = None
+
+    _by_version = None
+    _by_version_sorted = True
+    _planets_by_unique = {}
+    _systems_by_unique = {}
+    _spatial_index = None
+    _planet_table = None
+    _ledger = None
+    _arrivals = None
+    _discovery = None
+    _route_planners = {}
     _planet_unique_counter = 0
     _system_unique_counter = 0
 
-    def __init__(self, game, generate=False):
+    def __init__(self, game, generate=False, seed=None):
         """
         Not only is this the constructor for the `Galaxy` class, this also will
         generate a random `Galaxy` if and only if the correct and precise
@@ -104,19 +210,38 @@ class Galaxy(object):
 
         Args:
             game (Game):
-                The `Game` which this `Galaxy` will be used for.
+                The `Game` which this `Galaxy` will be used for. Only its
+                unique and the faction codes of its `Player`s are kept: a
+                `Galaxy` does not hold on to database objects, so the cached
+                one can be shared by requests (see "galaxycache.py").
 
         Keyword Args:
             generate (boolean):
                 Set to `True` if this `Galaxy` is to be generated at random.
 
+            seed (int):
+                What to generate this `Galaxy` from. The same seed always gives
+                the same `Galaxy` (as long as `generation_config` is the same).
+                A new seed is picked if none is given.
+
         Note:
             It is the responsibility of the caller of this constructor to save
             this galaxy to disk.
         """
 
         # Assign attributes.
-        self.game = game
+        self.game_unique = game.unique
+        self.faction_codes = sorted(p.faction_code for p in game.players)
+        self.systems = []
+        self._by_version = OrderedDict()
+        self._planets_by_unique = {}
+        self._systems_by_unique = {}
+        self._spatial_index = spatial_lib.SpatialIndex()
+        self._planet_table = None
+        self._ledger = None
+        self._arrivals = arrivals_lib.ArrivalBatch()
+        self._discovery = discovery_lib.DiscoveryMap()
+        self._route_planners = {}
 
         # Escape gase.
         if not generate:
@@ -124,13 +249,10 @@ class Galaxy(object):
 
         # Declare global variables.
         global GALAXY_START_JSON
-        global GALAXY_DEFAULT_RANGE
-
-        global GALAXY_LENGTH
-        global GALAXY_WIDTH
-        global GALAXY_HEIGHT
 
-        global STARS_PER_CUBIC_LY
+        if seed is None:
+            seed = new_seed()
+        self.seed = seed
 
         # Open the JSON
         import os
@@ -146,7 +268,6 @@ class Galaxy(object):
             self._system_unique_counter += 1
             system_obj = system_lib.system_from_dict(system, game)
             system_obj.unique = self._system_unique_counter
-            system_obj.galaxy = self
 
             # Assign the planets of this system unique identifiers
             system_planets = system_obj.flat_planets()
@@ -154,47 +275,46 @@ class Galaxy(object):
                 self._planet_unique_counter += 1
                 planet.unique = self._planet_unique_counter
 
-            self.systems.append(system_obj)
-
-        # The dimensions of the galaxy.
-        adj_dim = lambda x: (x - 1) / 2
-        abs_sum = lambda x, y, z: abs(x) + abs(y) + abs(z)
-        width = irange(-adj_dim(GALAXY_WIDTH), adj_dim(GALAXY_WIDTH))
-        length = irange(-adj_dim(GALAXY_LENGTH), adj_dim(GALAXY_LENGTH))
-        height = irange(-adj_dim(GALAXY_HEIGHT), adj_dim(GALAXY_HEIGHT))
-
-        positions = [(x, y, z) for x in width for y in length for z in height]
-        gdr = GALAXY_DEFAULT_RANGE
-        in_default_range = lambda x, y, z: (abs_sum(x, y, z) <= gdr)
-        in_discover_range = lambda x, y, z: (abs_sum(x, y, z) <= gdr + 4)
-
-        # Loop through the galatic grid. For the positions outside the range of
-        # default systems, randomly create new ones.
-        generated = 0
-        for (x, y, z) in positions:
-            if in_default_range(x, y, z):
-                continue
-            elif coinflip(STARS_PER_CUBIC_LY):
-                generated += 1
-                self._system_unique_counter += 1
-                new_sys = self._create_system(x, y, z)
-                new_sys.unique = self._system_unique_counter
-
-                if in_discover_range(x, y, z):
-                    new_sys.discovered_by = set(game.players)
-
-                # Assign the new planets unique identifiers.
-                new_sys_planets = new_sys.flat_planets()
-                for planet in new_sys_planets:
-                    self._planet_unique_counter += 1
-                    planet.unique = self._planet_unique_counter
-
-                self.systems.append(new_sys)
+            self._add_system(system_obj)
+            discoveries = system_lib.discoveries_from_dict(system, game)
+            self._record_discoveries(system_obj, *discoveries)
+
+        # Add the systems generated outside the range of the default systems.
+        # They are numbered after the default systems, in region order.
+        generated = generated_systems(seed)
+        for (new_sys, discoverable) in generated:
+            self._add_generated_system(new_sys)
+
+            if discoverable:
+                for code in self.faction_codes:
+                    self._discovery.discover_system(code, new_sys.index)
 
         # Save to disk
-        print "Generated {0} systems".format(str(generated))
+        print "Generated {0} systems".format(str(len(generated)))
 
-    def as_list(self, for_player=None, for_user=None, discoveries=False):
+    def close(self):
+        """
+        Lets go of the files this `Galaxy` was read from, if it holds any
+        open. A `Galaxy` built in memory holds none. Called by the galaxy
+        cache when it lets go of this `Galaxy`.
+        """
+
+        pass
+
+    def __contains__(self, other):
+        """
+        Returns `True` if and only if `other` is a `Planet` or `System` in
+        this `Galaxy`.
+        """
+
+        if isinstance(other, planet_lib.Planet):
+            return self._planets_by_unique.get(other.unique) is other
+        elif isinstance(other, system_lib.System):
+            return self._systems_by_unique.get(other.unique) is other
+        else:
+            return False
+
+    def as_list(self, for_player=None, discoveries=False):
         """
         Keyword Args:
             for_player (Player):
@@ -202,10 +322,6 @@ class Galaxy(object):
                 `for_player` should be set to said end user's `Player` object
                 for the current game.
 
-            for_user (User):
-                If no `Player` object is readily available, then `for_user` may
-                be used instead.
-
             discoveries (boolean):
                 Set to `False` by default. Set to `True` if information about
                 the factions that have discovered the systems is to be included
@@ -217,20 +333,6 @@ class Galaxy(object):
             written to a JSON file.
         """
 
-        # If we were supplied a User instead of a Player, get the player for
-        # that user.
-        if for_user is not None:
-            for_player = self.game.player_for_user(for_user)
-
-        # This helper function returns "True" if the player in question can
-        # plot hyperspace routes to the system. If no player is provided, then
-        # the system is always visible.
-        def can_see_system(s):
-            if for_player is None:
-                return True
-            else:
-                return for_player in s.discovered_by
-
         # This helper function returns "True" if the player in question can
         # send fleets to specific planets in the system. If no player is
         # provided, then the planets are always visible.
@@ -238,12 +340,17 @@ class Galaxy(object):
             if for_player is None:
                 return True
             else:
-                return for_player in s.planets_discovered_by
+                return s.planets_discovered(for_player)
+
+        # Only the systems that the player can plot hyperspace routes to are
+        # returned. If no player is provided, then every system is visible.
+        if for_player is None:
+            systems = self.systems
+        else:
+            systems = self.visible_systems(for_player)
 
         return_systems = []
-        for system in self.systems:
-            if not can_see_system(system):
-                continue
+        for system in systems:
             system_dict = system.as_dict(
                 hide_planets=(not can_see_planets(system)),
                 include_discoveries=discoveries
@@ -252,6 +359,15 @@ class Galaxy(object):
 
         return return_systems
 
+    def discovery_map(self):
+        """
+        Returns:
+            The `DiscoveryMap` that records which `System`s each faction has
+            discovered in this `Galaxy`.
+        """
+
+        return self._discovery
+
     def planet_for_unique(self, unique):
         """
         Args:
@@ -262,12 +378,119 @@ class Galaxy(object):
             one or `None` if no such `Planet` was found.
         """
 
-        for system in self.systems:
-            all_planets = system.flat_planets()
-            for planet in all_planets:
-                if planet.unique == unique:
-                    return planet
-        return None
+        return self._planets_by_unique.get(unique)
+
+    def fleet_arrives(self, destination, fleet_size, player):
+        """
+        Records a fleet arriving at `destination` (a `Planet` or `System` in
+        this `Galaxy`). It is resolved, along with every other fleet arriving
+        during the same phase, by `resolve_arrivals`.
+
+        Args:
+            destination (Planet or System):
+                Where the fleet arrives.
+
+            fleet_size (int):
+                The number of ships in the fleet.
+
+            player (Player):
+                The `Player` the fleet belongs to.
+        """
+
+        self._arrivals.add(destination, fleet_size, player)
+
+    def resolve_arrivals(self):
+        """
+        Resolves every fleet recorded by `fleet_arrives` since the last call.
+        Called by the `OrderScheduler` at the end of every phase.
+        """
+
+        if len(self._arrivals) > 0:
+            self._arrivals.resolve()
+
+    def fleets_by_faction(self):
+        """
+        Returns:
+            A `dict` that maps faction codes to the number of ships in the
+            fleets above the `Planet`s owned by that faction.
+        """
+
+        table = self.planet_table()
+        if table is not None:
+            return table.fleets_by_faction()
+        return self._sum_by_faction(lambda planet: planet.strength())
+
+    def income_by_faction(self):
+        """
+        Returns:
+            A `dict` that maps faction codes to the money that the `Planet`s
+            owned by that faction make this turn. Read from the income ledger
+            (see "ledger.py").
+        """
+
+        if self._ledger is None:
+            self._ledger = ledger_lib.ledger_for_galaxy(self)
+        elif ledger_lib.LEDGER_VERIFY:
+            self._ledger.verify(self)
+        return self._ledger.income_by_faction()
+
+    def income_changed(self, planet):
+        """
+        Tells the income ledger that `planet` changed hands or that its
+        colonies changed.
+
+        Args:
+            planet (Planet):
+                The `Planet` in this `Galaxy` that changed.
+        """
+
+        if self._ledger is not None:
+            self._ledger.update(planet)
+
+    def route_planner(self, player):
+        """
+        Args:
+            player (Player):
+
+        Returns:
+            The `RoutePlanner` for the fleets of `player`'s faction. The same
+            planner is returned until the faction discovers another `System`.
+        """
+
+        code = player.faction_code
+        planner = self._route_planners.get(code)
+        if planner is None or \
+           planner.generation != self.discovery_map().generation(code):
+            planner = routes_lib.RoutePlanner(self, player)
+            self._route_planners[code] = planner
+        return planner
+
+    def factions_for_mask(self, mask):
+        """
+        Args:
+            mask (int):
+                A faction mask, as returned by `DiscoveryMap.system_mask`.
+
+        Returns:
+            The `set` of the faction codes in `faction_codes` whose bits are
+            set in `mask`.
+        """
+
+        return set(c for c in self.faction_codes if mask & (1 << c))
+
+    def planet_table(self):
+        """
+        Returns:
+            The `PlanetTable` of this `Galaxy`, or `None` if NumPy is not
+            installed. The table is made the first time it is asked for and
+            is kept up to date by `touch` from then on.
+        """
+
+        if numpy is None:
+            return None
+        if self._planet_table is None:
+            self._planet_table = self._make_planet_table()
+        return self._planet_table
 
     def system_at_position(self, x, y, z):
         """
@@ -286,11 +509,33 @@ class Galaxy(object):
             coordinates match the given ones.
         """
 
-        pos = (x, y, z)
-        for system in self.systems:
-            if system.position == pos:
-                return True
-        return False
+        return self._spatial_index.at((x, y, z)) is not None
+
+    def systems_changed_since(self, version):
+        """
+        Args:
+            version (int):
+                A past value of `version`.
+
+        Returns:
+            The `list` of `System`s in this `Galaxy` that have changed since
+            this `Galaxy` was at `version`, from the most to the least recently
+            changed. Only the changed `System`s are looked at.
+        """
+
+        if not self._by_version_sorted:
+            ordered = sorted(self._by_version.values(),
+                             key=lambda s: s.version)
+            self._by_version = OrderedDict((s.unique, s) for s in ordered)
+            self._by_version_sorted = True
+
+        to_return = []
+        for unique in reversed(self._by_version):
+            system = self._by_version[unique]
+            if system.version <= version:
+                break
+            to_return.append(system)
+        return to_return
 
     def system_for_unique(self, unique):
         """
@@ -302,10 +547,7 @@ class Galaxy(object):
             `None` if no such `System` in this `Galaxy` exists.
         """
 
-        for system in self.systems:
-            if system.unique == unique:
-                return system
-        return None
+        return self._systems_by_unique.get(unique)
 
     def systems_near_system(self, near_system, distance):
         """
@@ -321,47 +563,180 @@ class Galaxy(object):
             include `near_system`.
         """
 
-        return_systems = []
-        for system in self.systems:
-            if system == near_system:
-                continue
-            elif system.grid_distance(near_system) <= distance:
-                return_systems.append(system)
-        return return_systems
+        nearby = self._spatial_index.within(near_system.position, distance)
+        return [system for system in nearby if system != near_system]
+
+    def systems_owned_by(self, player):
+        """
+        Args:
+            player (Player):
+
+        Returns:
+            The `list` of `System`s in this `Galaxy` in which `player`'s
+            faction owns at least one `Planet`, in the order of `systems`.
+            Found with the `PlanetTable` when NumPy is installed.
+        """
+
+        code = player.faction_code
+        table = self.planet_table()
+        if table is None:
+            return [system for system in self.systems
+                    if any(planet.owner_code == code
+                           for planet in system.flat_planets())]
+
+        table.refresh()
+        uniques = numpy.unique(table.system[table.owner == code]).tolist()
+        owned = [self.system_for_unique(unique) for unique in uniques]
+        return sorted(owned, key=lambda system: system.index)
+
+    def visible_systems(self, player):
+        """
+        Args:
+            player (Player):
+
+        Returns:
+            The `list` of `System`s in this `Galaxy` that `player` has
+            discovered, in the order of `systems`. Only those `System`s are
+            looked at.
+        """
+
+        known = self.discovery_map().systems_known_by(player.faction_code)
+        return [self.systems[index] for index in known]
 
     def get_json_filename(self):
         """
         Returns the location of this Galaxy's JSON file on the filesystem.
         """
 
-        return "{0}.galaxy.json".format(str(self.game.unique))
+        return "{0}.galaxy.json".format(str(self.game_unique))
 
-    def _create_system(self, x, y, z):
+    def touch(self, system):
         """
-        PRIVATE METHOD
+        Marks `system` as changed by giving it the next version number of this
+        `Galaxy`. Cached views use the version numbers to tell which `System`s
+        they have to serialize again.
 
         Args:
-            x (int):
-                The x-coordinate of where we want to make the new `System`.
+            system (System):
+                The `System` in this `Galaxy` that changed.
+        """
 
-            y (int):
-                Ditto.
+        self.version += 1
+        system.version = self.version
+        if self._planet_table is not None:
+            self._planet_table.mark(system)
 
-            z (int):
-                Ditto.
+        # Move the system to the most recently changed end.
+        del self._by_version[system.unique]
+        self._by_version[system.unique] = system
 
-        Returns:
-            A new `System`.
+    def _add_system(self, system):
+        """
+        PRIVATE METHOD
+
+        Adds `system` to this `Galaxy`. Every `System` in this `Galaxy` must
+        be added with this method so that `systems`, the spatial index and
+        the unique ID registries agree with each other.
+
+        Args:
+            system (System):
+                The `System` to add. Its `position` and `unique` and the
+                `unique`s of its `Planet`s must already be set.
         """
 
-        # Generate a name for the system.
-        system_name = random_name(system=True)
-        scheme = random.choice([1, 2]) # TODO
-        system = system_lib.generate_system(system_name, scheme)
-        system.position = (x, y, z)
         system.galaxy = self
-        assert system is not None
-        return system
+        system.index = len(self.systems)
+        self.systems.append(system)
+        self._planet_table = None
+        self._ledger = None
+        if system.version < self.version:
+            self._by_version_sorted = False
+        self.version = max(self.version, system.version)
+        self._by_version[system.unique] = system
+        self._spatial_index.add(system)
+        self._systems_by_unique[system.unique] = system
+        for planet in system.flat_planets():
+            self._register_planet(planet)
+
+    def _record_discoveries(self, system, discovered_by,
+                            planets_discovered_by):
+        """
+        PRIVATE METHOD
+
+        Records that the `Player`s in `discovered_by` discovered `system` and
+        that the `Player`s in `planets_discovered_by` discovered its
+        `Planet`s. `system` must already have been added to this `Galaxy`.
+        """
+
+        for player in discovered_by:
+            self._discovery.discover_system(player.faction_code, system.index)
+        for player in planets_discovered_by:
+            self._discovery.discover_planets(player.faction_code,
+                                             system.index)
+
+    def _make_planet_table(self):
+        """
+        PRIVATE METHOD
+
+        Returns a new `PlanetTable` of every `Planet` in this `Galaxy`.
+        """
+
+        return planettable_lib.table_for_systems(self.systems)
+
+    def _sum_by_faction(self, value):
+        """
+        PRIVATE METHOD
+
+        Walks every owned `Planet` and returns a `dict` that maps faction codes
+        to the sum of `value(planet)` over the `Planet`s that faction owns.
+        Used when NumPy is not installed.
+        """
+
+        sums = {}
+        for system in self.systems:
+            for planet in system.flat_planets():
+                code = planet.owner_code
+                if code is None:
+                    continue
+                sums[code] = sums.get(code, 0) + value(planet)
+        return sums
+
+    def _register_planet(self, planet):
+        """
+        PRIVATE METHOD
+
+        Records `planet` in the unique ID registry so that `planet_for_unique`
+        can find it. Call this for any `Planet` that joins a `System` after
+        the `System` was added to this `Galaxy`.
+
+        Args:
+            planet (Planet):
+                The `Planet` to record. Its `unique` must already be set.
+        """
+
+        self._planets_by_unique[planet.unique] = planet
+
+    def _add_generated_system(self, system):
+        """
+        PRIVATE METHOD
+
+        Assigns a newly generated `System` and its `Planet`s the next unique
+        identifiers and adds it to this `Galaxy`.
+
+        Args:
+            system (System):
+                A `System` made by `generate_region`.
+        """
+
+        self._system_unique_counter += 1
+        system.unique = self._system_unique_counter
+
+        # Assign the new planets unique identifiers.
+        for planet in system.flat_planets():
+            self._planet_unique_counter += 1
+            planet.unique = self._planet_unique_counter
+
+        self._add_system(system)
 
 
 
@@ -380,19 +755,393 @@ def galaxy_from_dict(data, game):
         The `Galaxy` that was parsed from the given `dict` and `Game`.
     """
 
-    systems = []
+    galaxy = Galaxy(game)
     for system_dict in data:
         system = system_lib.system_from_dict(system_dict, game)
-        systems.append(system)
+        galaxy._add_system(system)
+        discoveries = system_lib.discoveries_from_dict(system_dict, game)
+        galaxy._record_discoveries(system, *discoveries)
 
-    # Create the galaxy and return it.
-    galaxy = Galaxy(game)
-    galaxy.systems = systems
+    # We're done here.
     return galaxy
 
 
 
-def random_name(system=False):
+def new_seed():
+    """
+    Returns a new seed (`int`) to generate a `Galaxy` from, picked with the
+    `random` module.
+    """
+
+    global GALAXY_SEED_MAX
+    return random.randint(0, GALAXY_SEED_MAX)
+
+
+
+def region_seed(seed, region):
+    """
+    Returns the seed (`int`) of the random numbers that the region numbered
+    `region` (see `generation_regions`) of the `Galaxy` generated from `seed`
+    is made with. Worked out with SHA-1, so that the seeds of neighbouring
+    regions are unrelated and are the same on every platform.
+    """
+
+    digest = hashlib.sha1("{0}:{1}".format(seed, region)).hexdigest()
+    return int(digest[:16], 16)
+
+
+
+def generation_config():
+    """
+    Returns a `tuple` of the constants that decide which `System`s are
+    generated from a seed: the grid's width, length and height, the range of
+    the default systems, the density of stars and the width of a region. A
+    `Galaxy` can be generated again from its seed and this tuple alone.
+    """
+
+    global GALAXY_WIDTH
+    global GALAXY_LENGTH
+    global GALAXY_HEIGHT
+    global GALAXY_DEFAULT_RANGE
+    global STARS_PER_CUBIC_LY
+    global GALAXY_REGION_WIDTH
+
+    return (GALAXY_WIDTH, GALAXY_LENGTH, GALAXY_HEIGHT, GALAXY_DEFAULT_RANGE,
+            STARS_PER_CUBIC_LY, GALAXY_REGION_WIDTH)
+
+
+
+def generation_regions(config):
+    """
+    Splits the galactic grid of `config` (see `generation_config`) into
+    regions along the x-axis.
+
+    Returns:
+        A `list` of `(first, last)` tuples, the x-coordinates of the first and
+        last grid spaces of each region, from west to east.
+    """
+
+    width = config[0]
+    region_width = config[5]
+    west = -((width - 1) / 2)
+    east = (width - 1) / 2
+    return [(first, min(first + region_width - 1, east))
+            for first in xrange(west, east + 1, region_width)]
+
+
+
+def generate_region(seed, region, config):
+    """
+    Generates the `System`s of one region of the galactic grid. Only `seed`,
+    `region` and `config` decide what is generated.
+
+    Args:
+        seed (int):
+            The seed of the `Galaxy`.
+
+        region (int):
+            The number of the region (an index into `generation_regions`).
+
+        config (tuple):
+            What `generation_config` returns.
+
+    Returns:
+        A `list` of `(system, discoverable)` tuples in (x, then y, then z)
+        order. The `System`s do not have `unique`s yet. `discoverable` is
+        `True` if every `Player` discovers the `System` at the start of the
+        game.
+    """
+
+    (width, length, height) = config[0:3]
+    x_bounds = generation_regions(config)[region]
+    rng = random.Random(region_seed(seed, region))
+    if numpy is not None:
+        cells = _scan_grid_vectorized(width, length, height, rng=rng,
+                                      x_bounds=x_bounds)
+    else:
+        cells = _scan_grid_loop(width, length, height, rng=rng,
+                                x_bounds=x_bounds)
+    return [(_generate_system(x, y, z, rng), discoverable)
+            for ((x, y, z), discoverable) in cells]
+
+
+
+def generated_systems(seed, config=None, workers=None):
+    """
+    Generates every `System` of the `Galaxy` made from `seed` outside of the
+    default systems, region by region. The `System`s generated from the same
+    seed and config are cached (see "galaxycache.py"), so that identical
+    galaxies are only generated once per process.
+
+    The regions are shared out between a pool of worker processes, which send
+    back their `System`s as records (see `System.as_record`). The regions are
+    merged in order however many workers there are, so the result is the same
+    as generating them one after another in this process.
+
+    Args:
+        seed (int):
+            The seed of the `Galaxy`.
+
+    Keyword Args:
+        config (tuple):
+            What `generation_config` returns; that by default.
+
+        workers (int):
+            The number of worker processes, or zero for one per core. By
+            default, `GALAXY_GENERATION_WORKERS` for large grids and one for
+            the others. With one worker, every region is generated in this
+            process.
+
+    Returns:
+        A `list` of `(system, discoverable)` tuples like `generate_region`
+        returns, for every region in order. The `System`s are new objects
+        that the caller may change.
+    """
+
+    if config is None:
+        config = generation_config()
+
+    from_record = system_lib.system_from_record
+    records = galaxycache_lib.get_generated(seed, config)
+    if records is not None:
+        return [(from_record(record), discoverable)
+                for (record, discoverable) in records]
+
+    regions = range(0, len(generation_regions(config)))
+    workers = _generation_workers(workers, config)
+    if workers == 1:
+        systems = []
+        for region in regions:
+            systems.extend(generate_region(seed, region, config))
+        records = [(system.as_record(), discoverable)
+                   for (system, discoverable) in systems]
+    else:
+        # `map` hands out one region at a time, so that a worker that gets
+        # the sparse regions around the default systems takes on more of
+        # them, and returns the results in region order.
+        pool = multiprocessing.Pool(workers)
+        try:
+            jobs = [(seed, region, config) for region in regions]
+            results = pool.map(_region_records, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        records = [r for region_records in results for r in region_records]
+        systems = [(from_record(record), discoverable)
+                   for (record, discoverable) in records]
+
+    galaxycache_lib.put_generated(seed, config, records)
+    return systems
+
+
+
+def _generation_workers(workers, config):
+    """
+    PRIVATE FUNCTION
+
+    Returns the number of worker processes (`int`) to generate the regions of
+    `config` with, given the `workers` asked for (see `generated_systems`).
+    """
+
+    global GALAXY_GENERATION_WORKERS
+    global GALAXY_PARALLEL_MIN_CELLS
+
+    (width, length, height) = config[0:3]
+    if workers is None and width * length * height < GALAXY_PARALLEL_MIN_CELLS:
+        workers = 1
+    elif workers is None:
+        workers = GALAXY_GENERATION_WORKERS
+    if workers <= 0:
+        workers = multiprocessing.cpu_count()
+
+    # A daemonic process (such as a worker of another pool) may not start
+    # processes of its own.
+    if multiprocessing.current_process().daemon:
+        workers = 1
+    return max(1, min(workers, len(generation_regions(config))))
+
+
+
+def _region_records(job):
+    """
+    PRIVATE FUNCTION
+
+    Runs in a worker process of `generated_systems`. Generates one region and
+    returns it as records, which pickle much faster than `System`s.
+
+    Args:
+        job (tuple):
+            The `(seed, region, config)` arguments of `generate_region`.
+
+    Returns:
+        A `list` of `(record, discoverable)` tuples, where `record` is what
+        `System.as_record` returns.
+    """
+
+    (seed, region, config) = job
+    systems = generate_region(seed, region, config)
+    return [(system.as_record(), discoverable)
+            for (system, discoverable) in systems]
+
+
+
+def _generate_system(x, y, z, rng):
+    """
+    PRIVATE FUNCTION
+
+    Generates a `System` at `(x, y, z)`, drawing its random numbers from `rng`
+    (a `random.Random`).
+
+    Returns:
+        The new `System`. It does not have a `unique` yet.
+    """
+
+    # Generate a name for the system.
+    system_name = random_name(system=True, rng=rng)
+    scheme = rng.choice([1, 2]) # TODO
+    system = system_lib.generate_system(system_name, scheme, rng=rng)
+    assert system is not None
+    system.position = (x, y, z)
+    return system
+
+
+
+def _scan_grid_loop(width, length, height, rng=None, x_bounds=None):
+    """
+    PRIVATE FUNCTION
+
+    Walks every cell of a `width` by `length` by `height` galactic grid and
+    flips a coin for each cell outside of `GALAXY_DEFAULT_RANGE` to decide
+    whether a `System` should be generated there.
+
+    Args:
+        width (int):
+            The number of grid spaces along the x-axis. Should be odd.
+
+        length (int):
+            Ditto, but for the y-axis.
+
+        height (int):
+            Ditto, but for the z-axis.
+
+    Keyword Args:
+        rng (Random):
+            What the coins are flipped with. The `random` module by default.
+
+        x_bounds (tuple):
+            The x-coordinates of the first and last grid spaces to scan, if
+            only part of the grid is to be scanned.
+
+    Returns:
+        A `list` of `((x, y, z), discoverable)` tuples, one for every cell
+        where a `System` should be generated. `discoverable` is `True` if the
+        cell is close enough to the default systems to be discovered by every
+        `Player` at the start of the game.
+    """
+
+    # Declare global variables.
+    global GALAXY_DEFAULT_RANGE
+    global STARS_PER_CUBIC_LY
+
+    # The dimensions of the galaxy.
+    adj_dim = lambda x: (x - 1) / 2
+    abs_sum = lambda x, y, z: abs(x) + abs(y) + abs(z)
+    if x_bounds is None:
+        x_bounds = (-adj_dim(width), adj_dim(width))
+    xs = irange(x_bounds[0], x_bounds[1])
+    ys = irange(-adj_dim(length), adj_dim(length))
+    zs = irange(-adj_dim(height), adj_dim(height))
+
+    positions = [(x, y, z) for x in xs for y in ys for z in zs]
+    gdr = GALAXY_DEFAULT_RANGE
+    in_default_range = lambda x, y, z: (abs_sum(x, y, z) <= gdr)
+    in_discover_range = lambda x, y, z: (abs_sum(x, y, z) <= gdr + 4)
+
+    # A coin is flipped for every cell, even those of the default systems, so
+    # that the same numbers are drawn as by `_scan_grid_vectorized`.
+    cells = []
+    for (x, y, z) in positions:
+        heads = coinflip(STARS_PER_CUBIC_LY, rng=rng)
+        if heads and not in_default_range(x, y, z):
+            cells.append(((x, y, z), in_discover_range(x, y, z)))
+    return cells
+
+
+
+def _scan_grid_vectorized(width, length, height, rng=None, x_bounds=None):
+    """
+    PRIVATE FUNCTION
+
+    Does the same job as `_scan_grid_loop`, but with NumPy: the coins for the
+    whole grid are flipped in one batch and the default and discovery ranges
+    are applied as masks over the grid's grid distances from the center.
+
+    NumPy's random numbers come from the same Mersenne Twister as Python's,
+    so the batch is drawn from a copy of `rng`'s state and `rng` is then moved
+    past it. Given the same `rng`, both scans flip the same coins.
+
+    Args:
+        width (int):
+            The number of grid spaces along the x-axis. Should be odd.
+
+        length (int):
+            Ditto, but for the y-axis.
+
+        height (int):
+            Ditto, but for the z-axis.
+
+    Keyword Args:
+        rng (Random):
+            See `_scan_grid_loop`.
+
+        x_bounds (tuple):
+            See `_scan_grid_loop`.
+
+    Returns:
+        The same kind of `list` that `_scan_grid_loop` returns, in the same
+        (x, then y, then z) order.
+    """
+
+    # Declare global variables.
+    global GALAXY_DEFAULT_RANGE
+    global STARS_PER_CUBIC_LY
+
+    # The coordinates along each axis, shaped so that they broadcast against
+    # each other into the full grid.
+    if rng is None:
+        rng = random
+    if x_bounds is None:
+        x_bounds = (-((width - 1) / 2), (width - 1) / 2)
+    xs = numpy.arange(x_bounds[0], x_bounds[1] + 1)
+    ys = numpy.arange(length) - (length - 1) / 2
+    zs = numpy.arange(height) - (height - 1) / 2
+    distance = (numpy.abs(xs)[:, None, None] +
+                numpy.abs(ys)[None, :, None] +
+                numpy.abs(zs)[None, None, :])
+
+    # Flip every coin at once, then throw away the cells that are taken by
+    # the default systems.
+    state = rng.getstate()
+    stream = numpy.random.RandomState()
+    stream.set_state(('MT19937', numpy.array(state[1][:-1], numpy.uint32),
+                      state[1][-1]))
+    heads = stream.random_sample(distance.shape) <= STARS_PER_CUBIC_LY
+    (_, key, position) = stream.get_state()[0:3]
+    rng.setstate((state[0], tuple(key.tolist()) + (int(position),),
+                  state[2]))
+    mask = heads & (distance > GALAXY_DEFAULT_RANGE)
+
+    # Pull out the surviving cells.
+    indices = numpy.nonzero(mask)
+    discoverable = distance[indices] <= GALAXY_DEFAULT_RANGE + 4
+    positions = zip(xs[indices[0]].tolist(),
+                    ys[indices[1]].tolist(),
+                    zs[indices[2]].tolist())
+    return zip(positions, discoverable.tolist())
+
+
+
+def random_name(system=False, rng=None):
     """
     Generates a name. These names can be used for planets or solar systems.
     Names more suited for solar systems can be generated if `system` is set to
@@ -404,6 +1153,10 @@ def random_name(system=False):
             as "Epsilon Cygni" or "Tau Theta" in the name generation process.
             Set to `False` by default.
 
+        rng (Random):
+            Where the random numbers are drawn from. The `random` module by
+            default.
+
     Returns:
         `str` -- a randomly generated name.
     """
@@ -418,27 +1171,30 @@ def random_name(system=False):
     global NAME_MAX_WORDS
     global NAME_MIN_WORDS
 
+    if rng is None:
+        rng = random
+
     # We'll return this.
     name = ""
 
     # Decide just how exactly we're going to name this system.
     if system:
-        dice = random.random()
+        dice = rng.random()
         if dice <= CHANCE_SYSTEM_NAME:
             system = False
 
     # If we're going with syllables...
     if not system:
-        sylls = random.randrange(NAME_MIN_SYLLABLES, NAME_MAX_SYLLABLES)
+        sylls = rng.randrange(NAME_MIN_SYLLABLES, NAME_MAX_SYLLABLES)
         for a in xrange(0, sylls):
-            name += random.choice(SYLLABLES)
+            name += rng.choice(SYLLABLES)
 
     # If we're going with system naming...
     else:
         pool = GREEK + BAYER
-        words = random.randrange(NAME_MIN_WORDS, NAME_MAX_WORDS)
+        words = rng.randrange(NAME_MIN_WORDS, NAME_MAX_WORDS)
         for a in xrange(0, words):
-            name += random.choice(pool)
+            name += rng.choice(pool)
             name += " "
         # Lop off the last space.
         name = name[:-1]
@@ -462,8 +1218,150 @@ def web_entire_galaxy():
 
     Returns:
         A JSON `str` including the JSON for the galaxy in the "galaxy" field,
-        the amount of money the player has in the "money" field, and the game's
-        turn number in the "turn" field.
+        the amount of money the player has in the "money" field, the game's
+        turn number in the "turn" field, and the galaxy's version in the
+        "version" field.
+    """
+
+    # Get the current user.
+    from interstellarage import current_user
+    user = current_user()
+    if user is None:
+        return "Not logged in", 400
+
+    # Get the desired game
+    import game as game_lib
+    game_unique = int(request.form['game'])
+    game = game_lib.find(unique=game_unique)
+    if game is None:
+        return "Invalid game", 400
+    elif user not in game:
+        return "You are not part of this game", 400
+
+    # Return the galaxy as JSON. The galaxy itself comes out of the view
+    # cache already encoded, so it is spliced into the rest of the response.
+    player = game.player_for_user(user)
+    galaxy_json = viewcache_lib.galaxy_json(game.galaxy, player)
+    return _galaxy_response(galaxy_json, game, player)
+
+
+
+@app.route('/game/galaxy/stream', methods=['POST'])
+def web_stream_galaxy():
+    """
+    Like `web_entire_galaxy`, but streams the galaxy one spatial chunk at a
+    time (see "galaxystream.py") so the client can draw each chunk as soon as
+    it arrives. The chunks around the player's home systems come first.
+
+    Request Fields:
+        game (int):
+            The unique id for the game that is being played.
+
+        lod (str):
+            Optional. If given, each chunk is sent as the map projection of
+            its `System`s (see "maplod.py") instead of their full JSON.
+
+    Returns:
+        A streamed response with one JSON object per line. The first line has
+        the same fields as the response of `web_entire_galaxy` with an empty
+        "galaxy" list. Each following line has the key of a chunk in its
+        "chunk" field and the `System`s in that chunk in its "galaxy" field,
+        or their map projection in its "map" field if "lod" was given.
+        The last line is `{"done": true}`. Changes made while the galaxy is
+        streamed are picked up by polling `web_galaxy_changes` with the
+        "version" from the first line.
+    """
+
+    # Get the current user.
+    from interstellarage import current_user
+    user = current_user()
+    if user is None:
+        return "Not logged in", 400
+
+    # Get the desired game
+    import game as game_lib
+    game_unique = int(request.form['game'])
+    game = game_lib.find(unique=game_unique)
+    if game is None:
+        return "Invalid game", 400
+    elif user not in game:
+        return "You are not part of this game", 400
+
+    player = game.player_for_user(user)
+    galaxy = game.galaxy
+    if 'lod' in request.form:
+        (field, encode) = ("map", maplod_lib.systems_json)
+    else:
+        (field, encode) = ("galaxy", viewcache_lib.systems_json)
+
+    def generate():
+        yield _galaxy_response("[]", game, player) + "\n"
+        for (key, systems) in galaxystream_lib.visible_chunks(galaxy, player):
+            yield '{{"chunk": {0}, "{1}": {2}}}\n'.format(
+                json.dumps(list(key)), field, encode(galaxy, player, systems))
+        yield '{"done": true}\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+
+@app.route('/game/galaxy/map', methods=['POST'])
+def web_galaxy_map():
+    """
+    Like `web_entire_galaxy`, but sends the compact map projection of the
+    `System`s the player can see (see "maplod.py") instead of their full
+    JSON. The projection is cached until the galaxy changes.
+
+    Request Fields:
+        game (int):
+            The unique id for the game that is being played.
+
+    Returns:
+        A JSON `str` with the same fields as the response of
+        `web_entire_galaxy`, except that the "galaxy" field is replaced by a
+        "map" field holding the object returned by
+        `maplod.MapViewCache.systems_json`.
+    """
+
+    # Get the current user.
+    from interstellarage import current_user
+    user = current_user()
+    if user is None:
+        return "Not logged in", 400
+
+    # Get the desired game
+    import game as game_lib
+    game_unique = int(request.form['game'])
+    game = game_lib.find(unique=game_unique)
+    if game is None:
+        return "Invalid game", 400
+    elif user not in game:
+        return "You are not part of this game", 400
+
+    player = game.player_for_user(user)
+    map_json = maplod_lib.map_json(game.galaxy, player)
+    return _galaxy_response(map_json, game, player, field="map")
+
+
+
+@app.route('/game/galaxy/system', methods=['POST'])
+def web_system_detail():
+    """
+    This function is called when the client opens a `System` that it only has
+    the map projection of. It sends the full `System`, with its `Planet`s if
+    the player has discovered them, from the view cache.
+
+    Request Fields:
+        game (int):
+            The unique id for the game that is being played.
+
+        system (int):
+            The unique id of the `System`.
+
+    Returns:
+        A JSON `str` with the `System` (as in the "galaxy" field of
+        `web_entire_galaxy`) in its "system" field.
     """
 
     # Get the current user.
@@ -481,9 +1379,190 @@ def web_entire_galaxy():
     elif user not in game:
         return "You are not part of this game", 400
 
-    # Return the galaxy as JSON
-    return json.dumps({
-        'galaxy' : game.galaxy.as_list(for_user=user),
-        'turn' : game.on_turn,
-        'money' : game.player_for_user(user).money
-    })
+    player = game.player_for_user(user)
+    system = game.galaxy.system_for_unique(int(request.form['system']))
+    if system is None:
+        return "Invalid system", 400
+    system_json = viewcache_lib.system_json(game.galaxy, player, system)
+    if system_json is None:
+        return "You have not discovered that system", 400
+    return '{{"system": {0}}}'.format(system_json)
+
+
+
+@app.route('/game/galaxy/changes', methods=['POST'])
+def web_galaxy_changes():
+    """
+    This function is called when the client already has the galaxy and only
+    needs what changed since it last heard from the server. Only the `System`s
+    that changed (including `System`s that were just discovered) are sent, so
+    the cost of this call depends on how much changed and not on the size of
+    the galaxy.
+
+    Request Fields:
+        game (int):
+            The unique id for the game that is being played.
+
+        version (int):
+            The "version" field of the last response the client got from this
+            function or from `web_entire_galaxy`.
+
+    Returns:
+        A JSON `str` with the same fields as `web_entire_galaxy`, except that
+        the "galaxy" field only has the `System`s that changed since
+        `version`. The client should replace its copies of those `System`s
+        and remember the new "version".
+    """
+
+    # Get the current user.
+    from interstellarage import current_user
+    user = current_user()
+    if user is None:
+        return "Not logged in", 400
+
+    # Get the desired game
+    import game as game_lib
+    game_unique = int(request.form['game'])
+    game = game_lib.find(unique=game_unique)
+    if game is None:
+        return "Invalid game", 400
+    elif user not in game:
+        return "You are not part of this game", 400
+    since = int(request.form['version'])
+
+    # Return the changed systems as JSON.
+    player = game.player_for_user(user)
+    galaxy_json = viewcache_lib.changes_json(game.galaxy, player, since)
+    return _galaxy_response(galaxy_json, game, player)
+
+
+
+@app.route('/game/galaxy/etas', methods=['POST'])
+def web_hyperspace_etas():
+    """
+    This function is called when the client is plotting a hyperspace jump and
+    wants to know how long the jump to each of many `System`s would take. All
+    of the ETAs are worked out with one route search.
+
+    Request Fields:
+        game (int):
+            The unique id for the game that is being played.
+
+        from_planet (int):
+            The unique id of the `Planet` the fleet would depart from. It must
+            be owned by the current user.
+
+        systems (str):
+            A JSON list of the unique ids of the candidate `System`s.
+
+    Returns:
+        A JSON `str` of an object that maps the unique id of every candidate
+        `System` that the player has discovered to the number of turns the
+        quickest route there takes.
+    """
+
+    # Get the current user.
+    from interstellarage import current_user
+    user = current_user()
+    if user is None:
+        return "Not logged in", 400
+
+    # Get the desired game
+    import game as game_lib
+    game_unique = int(request.form['game'])
+    game = game_lib.find(unique=game_unique)
+    if game is None:
+        return "Invalid game", 400
+    elif user not in game:
+        return "You are not part of this game", 400
+
+    # Find the departure planet and the candidate systems.
+    player = game.player_for_user(user)
+    galaxy = game.galaxy
+    from_planet = galaxy.planet_for_unique(int(request.form['from_planet']))
+    if from_planet is None or not from_planet.owned_by(player):
+        return "You do not own that planet", 400
+    systems = []
+    for unique in json.loads(request.form['systems']):
+        system = galaxy.system_for_unique(int(unique))
+        if system is not None and system.discovered(player):
+            systems.append(system)
+
+    planner = galaxy.route_planner(player)
+    etas = planner.etas(from_planet.system(), systems)
+    return json.dumps(dict((s.unique, eta) for (s, eta) in zip(systems, etas)))
+
+
+
+@app.route('/game/galaxy/jumps', methods=['POST'])
+def web_jump_matrix():
+    """
+    This function is called when the client needs the distances from the
+    `System`s the player can send fleets from to every `System` it can see,
+    for example to show them while the player looks over the Galaxy Map. The
+    whole matrix is sent in one response and is cached until the turn ends.
+
+    Request Fields:
+        game (int):
+            The unique id for the game that is being played.
+
+        sources (str):
+            Optional. A JSON list of the unique ids of the `System`s to
+            measure from. By default, the `System`s in which the player owns a
+            `Planet` are used.
+
+    Returns:
+        A JSON `str` of the object returned by `jumpmatrix.jump_matrix`.
+        `System`s in "sources" that the player has not discovered are left
+        out.
+    """
+
+    # Get the current user.
+    from interstellarage import current_user
+    user = current_user()
+    if user is None:
+        return "Not logged in", 400
+
+    # Get the desired game
+    import game as game_lib
+    game_unique = int(request.form['game'])
+    game = game_lib.find(unique=game_unique)
+    if game is None:
+        return "Invalid game", 400
+    elif user not in game:
+        return "You are not part of this game", 400
+
+    # Find the systems to measure from.
+    player = game.player_for_user(user)
+    galaxy = game.galaxy
+    if 'sources' in request.form:
+        sources = []
+        for unique in json.loads(request.form['sources']):
+            system = galaxy.system_for_unique(int(unique))
+            if system is not None and system.discovered(player):
+                sources.append(system)
+    else:
+        sources = galaxy.systems_owned_by(player)
+
+    return jumpmatrix_lib.matrix_json(game, player, sources)
+
+
+
+def _galaxy_response(galaxy_json, game, player, field="galaxy"):
+    """
+    PRIVATE FUNCTION
+
+    Builds the body of a response to the client with the already encoded
+    `System`s `galaxy_json` in the `field` field ("galaxy" by default) and the
+    current turn, the money of `player` and the galaxy's version in the other
+    fields.
+    """
+
+    body = '{{"{0}": {1}, "turn": {2}, "money": {3}, "version": {4}}}'
+    return body.format(
+        field,
+        galaxy_json,
+        json.dumps(game.on_turn),
+        json.dumps(player.money),
+        json.dumps(game.galaxy.version)
+    )
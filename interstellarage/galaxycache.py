@@ -0,0 +1,270 @@
+"""
+InterstellarAge
+galaxycache.py
+
+Loading a `Game` from the database does not load its `Galaxy`; the `Galaxy`
+is loaded the first time `Game.galaxy` is used. This module keeps the most
+recently used `Galaxy`s of this process in memory so that a `Galaxy` that has
+not changed on disk since it was last loaded does not have to be loaded again.
+
+A cached `Galaxy` is keyed by its `Game`'s unique and by the version of its
+file on disk, so a `Galaxy` that another process saved since is never served.
+The cache is bounded by an estimate of the memory its `Galaxy`s use.
+
+Every request for a `Game` gets the same cached `Galaxy`, so a `Galaxy` keeps
+no database objects (its `Planet`s keep the faction codes of their owners)
+and is never changed once it is cached. Resolving a turn works on a `Galaxy`
+of its own, which replaces the cached one when the turn is saved.
+
+Generating a `Galaxy` only depends on its seed and on the generation
+constants (see `galaxy.generation_config`), so this module also keeps the
+`System`s generated for the most recently used seeds. A `Game` started with
+the seed of another `Game` gets `System`s rebuilt from them instead of
+generating them again. They are kept as records (see `System.as_record`),
+which take much less memory than the `System`s themselves.
+"""
+
+# Import python modules
+from collections import OrderedDict
+
+# Define constants.
+
+# Roughly how many bytes of memory the cached `Galaxy`s may use in total.
+GALAXY_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Rough costs (in bytes) of one built `System` and of one built `Planet`,
+# including the containers they own. Used to estimate the size of a `Galaxy`.
+SYSTEM_BYTES = 2048
+PLANET_BYTES = 1536
+
+# Roughly how many bytes of memory the cached records of generated `System`s
+# may use in total, and rough costs (in bytes) of the record of one `System`
+# and of one of its `Planet`s.
+GENERATION_CACHE_MAX_BYTES = 128 * 1024 * 1024
+SYSTEM_RECORD_BYTES = 384
+PLANET_RECORD_BYTES = 512
+
+class GalaxyCache(object):
+    """
+    A least recently used cache of `Galaxy`s. A `Galaxy` is closed (see
+    `Galaxy.close`) when the cache lets go of it.
+
+    Private Attributes:
+        _entries (OrderedDict):
+            Maps a `Game` unique to a tuple of `(version, galaxy, size)`.
+            Ordered from least to most recently used.
+
+        _max_bytes (int):
+            The most memory (estimated) that the cached `Galaxy`s may use.
+    """
+
+    def __init__(self, max_bytes=GALAXY_CACHE_MAX_BYTES):
+        self._entries = OrderedDict()
+        self._max_bytes = max_bytes
+
+    def get(self, game_unique, version):
+        """
+        Args:
+            game_unique (int):
+                The unique of the `Game` whose `Galaxy` we want.
+
+            version:
+                The version of the `Galaxy`'s file on disk (see
+                `GameStore.galaxy_file_version`).
+
+        Returns:
+            The cached `Galaxy` or `None` if there is no `Galaxy` cached for
+            that `Game` at that version.
+        """
+
+        entry = self._entries.pop(game_unique, None)
+        if entry is None:
+            return None
+        elif entry[0] != version:
+            entry[1].close()
+            return None
+
+        # Mark the entry as the most recently used.
+        self._entries[game_unique] = entry
+        return entry[1]
+
+    def put(self, game_unique, version, galaxy):
+        """
+        Caches `galaxy` as the `Galaxy` of the `Game` whose unique is
+        `game_unique` at the on-disk version `version`, then evicts the least
+        recently used `Galaxy`s until the cache fits in its memory bound.
+        """
+
+        entry = self._entries.pop(game_unique, None)
+        if entry is not None and entry[1] is not galaxy:
+            entry[1].close()
+        self._entries[game_unique] = (version, galaxy, _estimated_size(galaxy))
+        self._evict()
+
+    def _evict(self):
+        """
+        PRIVATE METHOD
+
+        Throws away the least recently used `Galaxy`s until the estimated size
+        of the cache is within its bound. The most recently used `Galaxy` is
+        always kept.
+        """
+
+        # The sizes of lazily loaded galaxies grow as they are used, so they
+        # are estimated again here.
+        total = 0
+        for (game_unique, entry) in self._entries.items():
+            size = _estimated_size(entry[1])
+            self._entries[game_unique] = (entry[0], entry[1], size)
+            total += size
+
+        while total > self._max_bytes and len(self._entries) > 1:
+            (game_unique, entry) = self._entries.popitem(last=False)
+            entry[1].close()
+            total -= entry[2]
+
+
+
+class GenerationCache(object):
+    """
+    A least recently used cache of the records of the `System`s generated
+    from a seed and a generation config.
+
+    Private Attributes:
+        _entries (OrderedDict):
+            Maps a `(seed, config)` tuple to a tuple of `(records, size)`:
+            the `list` of `(record, discoverable)` tuples generated from them
+            and its estimated size. Ordered from least to most recently used.
+
+        _max_bytes (int):
+            The most memory (estimated) that the cached records may use.
+
+        _bytes (int):
+            The estimated memory that the cached records use now.
+    """
+
+    def __init__(self, max_bytes=GENERATION_CACHE_MAX_BYTES):
+        self._entries = OrderedDict()
+        self._max_bytes = max_bytes
+        self._bytes = 0
+
+    def get(self, seed, config):
+        """
+        Returns:
+            The `list` of `(record, discoverable)` tuples generated from
+            `seed` and `config`, or `None` if they are not cached. The records
+            must not be changed.
+        """
+
+        entry = self._entries.pop((seed, config), None)
+        if entry is None:
+            return None
+
+        # Mark the entry as the most recently used.
+        self._entries[(seed, config)] = entry
+        return entry[0]
+
+    def put(self, seed, config, records):
+        """
+        Caches `records`, the `list` of `(record, discoverable)` tuples
+        generated from `seed` and `config`, then evicts the least recently
+        used entries until the cache fits in its bound. The records must not
+        be changed afterwards.
+        """
+
+        global SYSTEM_RECORD_BYTES
+        global PLANET_RECORD_BYTES
+
+        # Generated planets have no moons, so only the planets of each system
+        # are counted. Planets are the last field of a system's record.
+        planets = sum(len(record[-1]) for (record, d) in records)
+        size = (len(records) * SYSTEM_RECORD_BYTES +
+                planets * PLANET_RECORD_BYTES)
+
+        entry = self._entries.pop((seed, config), None)
+        if entry is not None:
+            self._bytes -= entry[1]
+        self._entries[(seed, config)] = (records, size)
+        self._bytes += size
+        while self._bytes > self._max_bytes and len(self._entries) > 1:
+            (key, evicted) = self._entries.popitem(last=False)
+            self._bytes -= evicted[1]
+
+    def clear(self):
+        """
+        Throws away every entry.
+        """
+
+        self._entries.clear()
+        self._bytes = 0
+
+
+
+def _estimated_size(galaxy):
+    """
+    PRIVATE FUNCTION
+
+    Returns roughly how many bytes of memory `galaxy` uses.
+    """
+
+    global SYSTEM_BYTES
+    global PLANET_BYTES
+
+    systems = len(galaxy._systems_by_unique)
+    planets = len(galaxy._planets_by_unique)
+    return systems * SYSTEM_BYTES + planets * PLANET_BYTES
+
+
+
+# The cache used by this process.
+_cache = GalaxyCache()
+
+def get(game_unique, version):
+    """
+    Returns the `Galaxy` cached for a `Game` at an on-disk version, or `None`.
+    See `GalaxyCache.get`.
+    """
+
+    return _cache.get(game_unique, version)
+
+
+
+def put(game_unique, version, galaxy):
+    """
+    Caches the `Galaxy` of a `Game` at an on-disk version. See
+    `GalaxyCache.put`.
+    """
+
+    _cache.put(game_unique, version, galaxy)
+
+
+
+# The cache of generated `System`s used by this process.
+_generation_cache = GenerationCache()
+
+def get_generated(seed, config):
+    """
+    Returns the records of the `System`s cached for a seed and generation
+    config, or `None`. See `GenerationCache.get`.
+    """
+
+    return _generation_cache.get(seed, config)
+
+
+
+def put_generated(seed, config, records):
+    """
+    Caches the records of the `System`s generated from a seed and generation
+    config. See `GenerationCache.put`.
+    """
+
+    _generation_cache.put(seed, config, records)
+
+
+
+def clear_generated():
+    """
+    Empties the cache of generated `System`s. See `GenerationCache.clear`.
+    """
+
+    _generation_cache.clear()
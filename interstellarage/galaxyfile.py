@@ -0,0 +1,776 @@
+"""
+InterstellarAge
+galaxyfile.py
+
+This module defines the binary file format that `Galaxy` snapshots are saved
+in and the `LazyGalaxy` class, which reads a `Galaxy` out of such a file
+without building any `System` or `Planet` until it is asked for.
+
+A galaxy file is laid out as:
+
+    1) a header (`HEADER_FORMAT`) with the number of records in each of the
+       sections below and the offset of each section,
+    2) one fixed-width record per `System` (`SYSTEM_FORMAT`),
+    3) one fixed-width record per `Planet`, moons included (`PLANET_FORMAT`),
+    4) the children table: `Planet` indices (`INDEX_FORMAT`). A `System` or a
+       `Planet` points at the run of this table that lists its planets or
+       moons,
+    5) the colony table: string indices (`INDEX_FORMAT`). A `Planet` points at
+       the run of this table that names its space colonies and then its
+       ground colonies,
+    6) the string table: an `(offset, length)` pair (`STRING_FORMAT`) per
+       string, then the UTF-8 bytes of every string. Names, textures and
+       spectral classes are stored once here no matter how often they are
+       used.
+
+All numbers are little-endian.
+"""
+
+# Import python modules
+from array import array
+import mmap
+import struct
+
+# NumPy reads the planet records straight into a `PlanetTable`. It is only
+# needed for that.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Import our modules
+import discovery as discovery_lib
+import galaxy as galaxy_lib
+import planet as planet_lib
+import planettable as planettable_lib
+import system as system_lib
+
+# Define constants.
+GALAXY_FILE_MAGIC = "IAGX"
+GALAXY_FILE_FORMAT_VERSION = 1
+
+# magic, format version, reserved, galaxy version, system count, planet count,
+# children count, colony count, string count, then the offsets of the system,
+# planet, children, colony, string and string data sections.
+HEADER_FORMAT = "<4sHHIIIIIIIIIIII"
+
+# unique, version, x, y, z, star size, spectral class string, name string,
+# discovered by mask, planets discovered by mask, children start, children
+# count.
+SYSTEM_FORMAT = "<iIhhhdIIBBII"
+
+# unique, system index, name string, texture string, type code, owner faction
+# code, the three fleets, orbit distance, orbit period, size, rings string,
+# moons start, moons count, colonies start, space colony count, ground colony
+# count.
+PLANET_FORMAT = "<iIIIBbiiidddIIIIHH"
+
+# The fields of `PLANET_FORMAT` as a NumPy record type, for reading the whole
+# planet section at once.
+PLANET_FIELDS = [
+    ('unique', '<i4'),
+    ('system_index', '<u4'),
+    ('name', '<u4'),
+    ('texture', '<u4'),
+    ('type_code', 'u1'),
+    ('owner', 'i1'),
+    ('fleets', '<i4', (3,)),
+    ('orbit_distance', '<f8'),
+    ('orbit_period', '<f8'),
+    ('size', '<f8'),
+    ('rings', '<u4'),
+    ('moons_start', '<u4'),
+    ('moons_count', '<u4'),
+    ('colonies_start', '<u4'),
+    ('space_count', '<u2'),
+    ('ground_count', '<u2')
+]
+
+INDEX_FORMAT = "<I"
+STRING_FORMAT = "<II"
+
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+SYSTEM_SIZE = struct.calcsize(SYSTEM_FORMAT)
+PLANET_SIZE = struct.calcsize(PLANET_FORMAT)
+INDEX_SIZE = struct.calcsize(INDEX_FORMAT)
+STRING_SIZE = struct.calcsize(STRING_FORMAT)
+
+# Where the two discovery masks start within a system record.
+DISCOVERY_OFFSET = struct.calcsize(SYSTEM_FORMAT[:9])
+
+# Stored in place of a string index when there is no string (for example, a
+# `Planet` without rings).
+NO_STRING = 0xFFFFFFFF
+
+# Stored in place of a faction code when a `Planet` has no owner.
+NO_OWNER = -1
+
+# The planet classes, in the order of their type codes.
+PLANET_TYPES = [
+    planet_lib.GasPlanet,
+    planet_lib.RockyPlanet,
+    planet_lib.HabitablePlanet
+]
+
+def encode_galaxy(galaxy):
+    """
+    Args:
+        galaxy (Galaxy):
+            The `Galaxy` to encode.
+
+    Returns:
+        A `str` holding `galaxy` in the galaxy file format.
+    """
+
+    strings = _StringTable()
+    planets = []
+    children = []
+    colonies = []
+
+    # Number the planets depth first. Each planet's moons get their run of the
+    # children table after the moons themselves have been numbered.
+    def add_planet(planet, system_index):
+        index = len(planets)
+        planets.append(None)
+        moon_indices = [add_planet(m, system_index) for m in planet.moons]
+        moons_start = len(children)
+        children.extend(moon_indices)
+        planets[index] = (planet, system_index, moons_start, len(moon_indices))
+        return index
+
+    discovery = galaxy.discovery_map()
+    system_chunks = []
+    for (system_index, system) in enumerate(galaxy.systems):
+        planet_indices = [add_planet(p, system_index) for p in system.planets]
+        children_start = len(children)
+        children.extend(planet_indices)
+
+        (x, y, z) = system.position
+        system_chunks.append(struct.pack(
+            SYSTEM_FORMAT,
+            system.unique,
+            system.version,
+            x, y, z,
+            system.star_size,
+            strings.index(system.star_spectral_class),
+            strings.index(system.name),
+            discovery.system_mask(system_index),
+            discovery.planets_mask(system_index),
+            children_start,
+            len(planet_indices)
+        ))
+
+    planet_chunks = []
+    for (planet, system_index, moons_start, moons_count) in planets:
+        colonies_start = len(colonies)
+        for colony in planet.space_colonies + planet.ground_colonies:
+            colonies.append(strings.index(colony.name))
+
+        if planet.owner_code is None:
+            owner = NO_OWNER
+        else:
+            owner = planet.owner_code
+
+        fleets = list(planet.fleets)
+        planet_chunks.append(struct.pack(
+            PLANET_FORMAT,
+            planet.unique,
+            system_index,
+            strings.index(planet.name),
+            strings.index(planet.texture),
+            PLANET_TYPES.index(planet.__class__),
+            owner,
+            fleets[0], fleets[1], fleets[2],
+            planet.orbit_distance,
+            planet.orbit_period,
+            planet.size,
+            strings.index(planet.rings),
+            moons_start,
+            moons_count,
+            colonies_start,
+            len(planet.space_colonies),
+            len(planet.ground_colonies)
+        ))
+
+    (string_entries, string_data) = strings.encode()
+
+    # Lay out the sections one after another.
+    systems_offset = HEADER_SIZE
+    planets_offset = systems_offset + SYSTEM_SIZE * len(system_chunks)
+    children_offset = planets_offset + PLANET_SIZE * len(planet_chunks)
+    colonies_offset = children_offset + INDEX_SIZE * len(children)
+    strings_offset = colonies_offset + INDEX_SIZE * len(colonies)
+    string_data_offset = strings_offset + STRING_SIZE * len(string_entries)
+
+    header = struct.pack(
+        HEADER_FORMAT,
+        GALAXY_FILE_MAGIC,
+        GALAXY_FILE_FORMAT_VERSION,
+        0,
+        galaxy.version,
+        len(system_chunks),
+        len(planet_chunks),
+        len(children),
+        len(colonies),
+        len(string_entries),
+        systems_offset,
+        planets_offset,
+        children_offset,
+        colonies_offset,
+        strings_offset,
+        string_data_offset
+    )
+
+    chunks = [header]
+    chunks.extend(system_chunks)
+    chunks.extend(planet_chunks)
+    chunks.extend(struct.pack(INDEX_FORMAT, i) for i in children)
+    chunks.extend(struct.pack(INDEX_FORMAT, i) for i in colonies)
+    chunks.extend(struct.pack(STRING_FORMAT, offset, length)
+                  for (offset, length) in string_entries)
+    chunks.append(string_data)
+    return "".join(chunks)
+
+
+
+class LazyGalaxy(galaxy_lib.Galaxy):
+    """
+    A `Galaxy` read out of a galaxy file. Opening one only reads the file's
+    header. A `System` (and its `Planet`s) is built from its record the first
+    time it is asked for and kept from then on.
+
+    Looking a `System` or `Planet` up by unique and asking for the `System`s
+    that changed since a version only build the `System`s they return.
+    Iterating over `systems`, serializing the whole `Galaxy` or searching it
+    by position builds every `System`.
+
+    Private Attributes:
+        _map (mmap or str):
+            The galaxy file mapped into memory, or the `str` the galaxy was
+            read from (or copied to by `close`).
+
+        _header (tuple):
+            The unpacked header of the galaxy file.
+
+        _strings (dict):
+            Maps string indices to the strings read so far.
+
+        _system_index_for_unique (dict or None):
+            Maps `System` uniques to record indices. Read from the file the
+            first time it is needed.
+
+        _planet_system_for_unique (dict or None):
+            Maps `Planet` uniques to the record index of their `System`. Read
+            from the file the first time it is needed.
+
+        _spatial_complete (boolean):
+            `True` once every `System` has been built and is in the spatial
+            index.
+    """
+
+    def __init__(self, game, filename=None, data=None):
+        """
+        Args:
+            game (Game):
+                The `Game` which this `Galaxy` will be used for.
+
+        Keyword Args:
+            filename (str):
+                The path of the galaxy file to read.
+
+            data (str):
+                The contents of a galaxy file, to read instead of a file.
+        """
+
+        super(LazyGalaxy, self).__init__(game)
+
+        if data is None:
+            # The map keeps a descriptor of its own, so the file is closed
+            # straight away.
+            with open(filename, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            filename = "<galaxy data>"
+            self._map = data
+        self._header = struct.unpack_from(HEADER_FORMAT, self._map, 0)
+        if self._header[0] != GALAXY_FILE_MAGIC:
+            raise Exception("{0} is not a galaxy file".format(filename))
+        if self._header[1] != GALAXY_FILE_FORMAT_VERSION:
+            raise Exception("Unknown galaxy file format {0}".format(
+                self._header[1]))
+
+        self.version = self._header[3]
+        self.systems = _LazySystemList(self, self._header[4])
+        self._by_version = None
+        self._strings = {}
+        self._system_index_for_unique = None
+        self._planet_system_for_unique = None
+        self._discovery = None
+        self._spatial_complete = False
+
+    def close(self):
+        """
+        Lets go of the galaxy file. A request may still be using this
+        `Galaxy` after the galaxy cache let go of it, so the file is copied
+        into memory first and the `Galaxy` goes on working. The map itself is
+        closed once nothing reads from it any more (NumPy arrays read from it
+        may still point into it), which, unlike this `Galaxy`, does not have
+        to wait for the garbage collector.
+        """
+
+        if isinstance(self._map, mmap.mmap):
+            self._map = self._map[:]
+
+    def discovery_map(self):
+        # The discovery masks of every system record are read the first time
+        # any discovery is needed.
+        if self._discovery is None:
+            self._discovery = self._read_discovery_map()
+        return self._discovery
+
+    def planet_for_unique(self, unique):
+        planet = self._planets_by_unique.get(unique)
+        if planet is not None:
+            return planet
+
+        # Build the system that the planet is in, which registers the planet.
+        if self._planet_system_for_unique is None:
+            self._read_planet_uniques()
+        system_index = self._planet_system_for_unique.get(unique)
+        if system_index is None:
+            return None
+        self.systems[system_index]
+        return self._planets_by_unique.get(unique)
+
+    def system_for_unique(self, unique):
+        system = self._systems_by_unique.get(unique)
+        if system is not None:
+            return system
+
+        if self._system_index_for_unique is None:
+            self._read_system_uniques()
+        index = self._system_index_for_unique.get(unique)
+        if index is None:
+            return None
+        return self.systems[index]
+
+    def system_at_position(self, x, y, z):
+        self._complete_spatial_index()
+        return super(LazyGalaxy, self).system_at_position(x, y, z)
+
+    def systems_near_system(self, near_system, distance):
+        self._complete_spatial_index()
+        return super(LazyGalaxy, self).systems_near_system(near_system,
+                                                           distance)
+
+    def systems_changed_since(self, version):
+        if version >= self.version:
+            return []
+        self._read_version_order()
+        return super(LazyGalaxy, self).systems_changed_since(version)
+
+    def touch(self, system):
+        self._read_version_order()
+        super(LazyGalaxy, self).touch(system)
+
+    def _add_system(self, system):
+        system.galaxy = self
+        system.index = len(self.systems)
+        self.systems.append(system)
+        self._planet_table = None
+        self._ledger = None
+        self._register_system(system)
+        if self._by_version is not None:
+            self._by_version[system.unique] = system
+
+    def _make_planet_table(self):
+        """
+        PRIVATE METHOD
+
+        Reads every planet record of the file into a new `PlanetTable`
+        without building any `System`s.
+        """
+
+        global PLANET_FIELDS
+        global PLANET_TYPES
+
+        planet_count = self._header[5]
+        records = numpy.frombuffer(
+            self._map,
+            dtype=numpy.dtype(PLANET_FIELDS),
+            count=planet_count,
+            offset=self._header[10]
+        )
+        records = records[numpy.argsort(records['unique'], kind='mergesort')]
+
+        # Only the unique column of the system records is needed.
+        rest = 'V{0}'.format(SYSTEM_SIZE - 4)
+        system_uniques = numpy.frombuffer(
+            self._map,
+            dtype=numpy.dtype([('unique', '<i4'), ('rest', rest)]),
+            count=self._header[4],
+            offset=self._header[9]
+        )['unique']
+
+        capacities = numpy.array([(t.MAX_GROUND_COLONIES, t.MAX_SPACE_COLONIES)
+                                  for t in PLANET_TYPES])
+
+        table = planettable_lib.PlanetTable(planet_count)
+        table.unique[:] = records['unique']
+        table.system[:] = system_uniques[records['system_index']]
+        table.owner[:] = records['owner']
+        table.ground_colonies[:] = records['ground_count']
+        table.space_colonies[:] = records['space_count']
+        table.max_ground_colonies[:] = capacities[records['type_code'], 0]
+        table.max_space_colonies[:] = capacities[records['type_code'], 1]
+        table.fleets[:] = records['fleets']
+
+        # The Systems that were built may have changed since the file was
+        # written.
+        for system in self._systems_by_unique.values():
+            table.mark(system)
+        return table
+
+    def _register_system(self, system):
+        """
+        PRIVATE METHOD
+
+        Records a `System` that was just built (or added) in the registries
+        and, once the spatial index is complete, in the spatial index.
+        """
+
+        self._systems_by_unique[system.unique] = system
+        for planet in system.flat_planets():
+            self._register_planet(planet)
+        if self._spatial_complete:
+            self._spatial_index.add(system)
+
+    def _complete_spatial_index(self):
+        """
+        PRIVATE METHOD
+
+        Builds every `System` and files it in the spatial index.
+        """
+
+        if self._spatial_complete:
+            return
+        for system in self.systems:
+            self._spatial_index.add(system)
+        self._spatial_complete = True
+
+    def _read_version_order(self):
+        """
+        PRIVATE METHOD
+
+        Fills `_by_version` from the version column of the file. The `System`s
+        themselves are only built when they are reached.
+        """
+
+        if self._by_version is not None:
+            return
+
+        systems_offset = self._header[9]
+        versions = {}
+        for index in xrange(0, self._header[4]):
+            offset = systems_offset + index * SYSTEM_SIZE
+            (unique, version) = struct.unpack_from("<iI", self._map, offset)
+            versions[unique] = version
+
+        # Systems that were built and then changed are newer than the file.
+        for (unique, system) in self._systems_by_unique.items():
+            versions[unique] = system.version
+
+        order = sorted((v, u) for (u, v) in versions.items())
+        self._by_version = _LazyVersionOrder(self)
+        for (version, unique) in order:
+            self._by_version[unique] = None
+        self._by_version_sorted = True
+
+    def _read_discovery_map(self):
+        """
+        PRIVATE METHOD
+
+        Returns a new `DiscoveryMap` made from the two discovery mask columns
+        of the file.
+        """
+
+        global DISCOVERY_OFFSET
+        global SYSTEM_SIZE
+
+        count = self._header[4]
+        offset = self._header[9]
+        tail = SYSTEM_SIZE - DISCOVERY_OFFSET - 2
+        if numpy is not None:
+            records = numpy.frombuffer(
+                self._map,
+                dtype=numpy.dtype([
+                    ('head', 'V{0}'.format(DISCOVERY_OFFSET)),
+                    ('discovered', 'u1'),
+                    ('planets_discovered', 'u1'),
+                    ('tail', 'V{0}'.format(tail))
+                ]),
+                count=count,
+                offset=offset
+            )
+            discovered = records['discovered']
+            planets_discovered = records['planets_discovered']
+        else:
+            discovered = []
+            planets_discovered = []
+            for index in xrange(0, count):
+                (mask, planets_mask) = struct.unpack_from(
+                    "<BB", self._map,
+                    offset + index * SYSTEM_SIZE + DISCOVERY_OFFSET)
+                discovered.append(mask)
+                planets_discovered.append(planets_mask)
+
+        codes = self.faction_codes
+        systems = discovery_lib.bitmaps_for_masks(discovered, codes)
+        planets = discovery_lib.bitmaps_for_masks(planets_discovered, codes)
+        discovery = discovery_lib.DiscoveryMap()
+        for code in codes:
+            discovery.set_bitmaps(code, systems[code], planets[code])
+        return discovery
+
+    def _read_system_uniques(self):
+        """
+        PRIVATE METHOD
+
+        Fills `_system_index_for_unique` from the unique column of the file.
+        """
+
+        systems_offset = self._header[9]
+        self._system_index_for_unique = {}
+        for index in xrange(0, self._header[4]):
+            offset = systems_offset + index * SYSTEM_SIZE
+            (unique,) = struct.unpack_from("<i", self._map, offset)
+            self._system_index_for_unique[unique] = index
+
+    def _read_planet_uniques(self):
+        """
+        PRIVATE METHOD
+
+        Fills `_planet_system_for_unique` from the unique and system index
+        columns of the file.
+        """
+
+        planets_offset = self._header[10]
+        self._planet_system_for_unique = {}
+        for index in xrange(0, self._header[5]):
+            offset = planets_offset + index * PLANET_SIZE
+            (unique, system_index) = struct.unpack_from("<iI", self._map,
+                                                        offset)
+            self._planet_system_for_unique[unique] = system_index
+
+    def _build_system(self, index):
+        """
+        PRIVATE METHOD
+
+        Returns a new `System` (with its `Planet`s) built from system record
+        number `index`.
+        """
+
+        offset = self._header[9] + index * SYSTEM_SIZE
+        (unique, version, x, y, z, star_size, spectral_class, name,
+         discovered, planets_discovered, children_start,
+         children_count) = struct.unpack_from(SYSTEM_FORMAT, self._map, offset)
+
+        system = system_lib.System(
+            self._string(name),
+            star_spectral_class=self._string(spectral_class)
+        )
+        system.unique = unique
+        system.version = version
+        system.position = (x, y, z)
+        system.star_size = star_size
+        system.index = index
+        system.planets = [self._build_planet(i, system)
+                          for i in self._children(children_start,
+                                                  children_count)]
+        system.galaxy = self
+        return system
+
+    def _build_planet(self, index, parent):
+        """
+        PRIVATE METHOD
+
+        Returns a new `Planet` (with its moons) built from planet record
+        number `index`, orbiting `parent`.
+        """
+
+        offset = self._header[10] + index * PLANET_SIZE
+        (unique, system_index, name, texture, type_code, owner, fleet_0,
+         fleet_1, fleet_2, orbit_distance, orbit_period, size, rings,
+         moons_start, moons_count, colonies_start, space_count,
+         ground_count) = struct.unpack_from(PLANET_FORMAT, self._map, offset)
+
+        planet = PLANET_TYPES[type_code]()
+        planet.unique = unique
+        planet.name = self._string(name)
+        planet.parent = parent
+        planet.fleets = array('i', [fleet_0, fleet_1, fleet_2])
+        planet.orbit_distance = orbit_distance
+        planet.orbit_period = orbit_period
+        planet.size = size
+        planet.texture = planet_lib.intern_string(self._string(texture))
+        planet.rings = planet_lib.intern_string(self._string(rings))
+        planet.owner_code = None if owner == NO_OWNER else owner
+
+        colony_names = [self._string(i) for i in self._colony_names(
+            colonies_start, space_count + ground_count)]
+        colonies = [planet_lib.Colony(n) for n in colony_names]
+        planet.space_colonies = colonies[:space_count]
+        planet.ground_colonies = colonies[space_count:]
+
+        planet.moons = [self._build_planet(i, planet)
+                        for i in self._children(moons_start, moons_count)]
+        return planet
+
+    def _children(self, start, count):
+        """
+        PRIVATE METHOD
+
+        Returns the `count` planet indices at `start` in the children table.
+        """
+
+        offset = self._header[11] + start * INDEX_SIZE
+        return struct.unpack_from("<{0}I".format(count), self._map, offset)
+
+    def _colony_names(self, start, count):
+        """
+        PRIVATE METHOD
+
+        Returns the `count` string indices at `start` in the colony table.
+        """
+
+        offset = self._header[12] + start * INDEX_SIZE
+        return struct.unpack_from("<{0}I".format(count), self._map, offset)
+
+    def _string(self, index):
+        """
+        PRIVATE METHOD
+
+        Returns string number `index` of the string table, or `None` for
+        `NO_STRING`.
+        """
+
+        if index == NO_STRING:
+            return None
+        string = self._strings.get(index)
+        if string is None:
+            entry_offset = self._header[13] + index * STRING_SIZE
+            (offset, length) = struct.unpack_from(STRING_FORMAT, self._map,
+                                                  entry_offset)
+            start = self._header[14] + offset
+            string = self._map[start:start + length].decode('utf-8')
+            self._strings[index] = string
+        return string
+
+
+
+class _LazySystemList(object):
+    """
+    PRIVATE CLASS
+
+    Stands in for `Galaxy.systems` in a `LazyGalaxy`. Looks like a `list` of
+    `System`s, but builds each `System` the first time it is used.
+    """
+
+    def __init__(self, galaxy, count):
+        self._galaxy = galaxy
+        self._built = [None] * count
+
+    def __len__(self):
+        return len(self._built)
+
+    def __getitem__(self, index):
+        system = self._built[index]
+        if system is None:
+            if index < 0:
+                index += len(self._built)
+            system = self._galaxy._build_system(index)
+            self._built[index] = system
+            self._galaxy._register_system(system)
+        return system
+
+    def __iter__(self):
+        for index in xrange(0, len(self._built)):
+            yield self[index]
+
+    def append(self, system):
+        self._built.append(system)
+
+
+
+class _LazyVersionOrder(object):
+    """
+    PRIVATE CLASS
+
+    Stands in for `Galaxy._by_version` in a `LazyGalaxy`. Keeps the order of
+    the `System` uniques, but looks the `System`s themselves up (building them
+    if needed) only when they are read.
+    """
+
+    def __init__(self, galaxy):
+        from collections import OrderedDict
+        self._galaxy = galaxy
+        self._order = OrderedDict()
+
+    def __setitem__(self, unique, system):
+        self._order[unique] = None
+
+    def __delitem__(self, unique):
+        del self._order[unique]
+
+    def __getitem__(self, unique):
+        return self._galaxy.system_for_unique(unique)
+
+    def __reversed__(self):
+        return reversed(self._order)
+
+    def __iter__(self):
+        return iter(self._order)
+
+
+
+class _StringTable(object):
+    """
+    PRIVATE CLASS
+
+    Collects the strings of a galaxy file, storing each distinct string once.
+    """
+
+    def __init__(self):
+        self._indices = {}
+        self._strings = []
+
+    def index(self, string):
+        """
+        Returns the index of `string` in the table, adding it if needed.
+        Returns `NO_STRING` for `None`.
+        """
+
+        if string is None:
+            return NO_STRING
+        if isinstance(string, unicode):
+            string = string.encode('utf-8')
+        index = self._indices.get(string)
+        if index is None:
+            index = len(self._strings)
+            self._indices[string] = index
+            self._strings.append(string)
+        return index
+
+    def encode(self):
+        """
+        Returns a tuple of the `(offset, length)` entries of the strings and
+        the `str` of all of their bytes.
+        """
+
+        entries = []
+        offset = 0
+        for string in self._strings:
+            entries.append((offset, len(string)))
+            offset += len(string)
+        return (entries, "".join(self._strings))
+
@@ -0,0 +1,68 @@
+"""
+InterstellarAge
+galaxystream.py
+
+A big galaxy takes a long time to serialize and send in one piece, and the
+client cannot draw any of it until all of it has arrived. This module splits
+the `System`s a `Player` can see into chunks, cubes of the galactic grid
+`STREAM_CHUNK_SIZE` grid spaces on a side, so that they can be streamed one
+chunk at a time. The chunks around the `Player`'s home `System`s come first,
+so the part of the Galaxy Map the `Player` looks at first is drawn first.
+"""
+
+# Define constants.
+
+# The length (in grid spaces) of each side of the cubes that the galaxy is
+# streamed in.
+STREAM_CHUNK_SIZE = 16
+
+def chunk_key(position):
+    """
+    Args:
+        position ( (int, int, int) ):
+
+    Returns:
+        The `(i, j, k)` key of the chunk that contains `position`.
+    """
+
+    global STREAM_CHUNK_SIZE
+
+    size = STREAM_CHUNK_SIZE
+    return (position[0] // size, position[1] // size, position[2] // size)
+
+
+
+def visible_chunks(galaxy, player):
+    """
+    Splits the `System`s in `galaxy` that `player` can see into chunks.
+
+    Args:
+        galaxy (Galaxy):
+            The `Galaxy` to split.
+
+        player (Player):
+            The `Player` the chunks will be sent to.
+
+    Returns:
+        A `list` of `(key, systems)` tuples, one per chunk with at least one
+        visible `System` in it. The chunks are ordered by how far they are
+        from the nearest chunk with a `System` in which `player` owns a
+        `Planet` (or from the center of the galaxy if there is no such
+        `System`), nearest first.
+    """
+
+    chunks = {}
+    for system in galaxy.visible_systems(player):
+        chunks.setdefault(chunk_key(system.position), []).append(system)
+
+    homes = set(chunk_key(s.position) for s in
+                galaxy.systems_owned_by(player))
+    if not homes:
+        homes.add(chunk_key((0, 0, 0)))
+
+    def distance_from_home(key):
+        return min(abs(key[0] - home[0]) + abs(key[1] - home[1]) +
+                   abs(key[2] - home[2]) for home in homes)
+
+    keys = sorted(chunks, key=lambda key: (distance_from_home(key), key))
+    return [(key, chunks[key]) for key in keys]
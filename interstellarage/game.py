@@ -8,7 +8,7 @@ from datetime import datetime
 import json
 
 # Import Flask
-from flask import Blueprint, request
+from flask import Blueprint, Response, request
 
 # Import SQLAlchemy
 from sqlalchemy import event
@@ -21,6 +21,12 @@ from other import irange
 import player as player_lib
 import galaxy as galaxy_lib
 import orders as order_lib
+import scheduler as scheduler_lib
+import storage as storage_lib
+import galaxycache as galaxycache_lib
+import turnqueue as turnqueue_lib
+import pubsub as pubsub_lib
+import simulation as simulation_lib
 
 # Define global variables.
 GAME_MIN_PLAYERS = 1
@@ -32,9 +38,31 @@ MAX_NAME_LENGTH = 40
 MIN_JOINCODE_LENGTH = 1
 MAX_JOINCODE_LENGTH = 40
 
+# What a game is doing about its current turn. See `Game.turn_status`.
+TURN_WAITING = "waiting"
+TURN_RESOLVING = "resolving"
+TURN_FAILED = "failed"
+
+# The longest (in seconds) that a request to "/game/turn/status" waits for a
+# turn to be resolved before answering.
+TURN_STATUS_MAX_WAIT = 25
+
+# How long (in milliseconds) a client waits before it reconnects to
+# "/game/events/<id>" after losing the connection.
+EVENTS_RETRY = 3000
+
 game_pages = Blueprint('game_pages', __name__)
 
 
+class TurnResolvingError(Exception):
+    """
+    Raised when orders are submitted for a turn that is being resolved.
+    """
+
+    pass
+
+
+
 class Game(db.Model):
     """
     Attributes:
@@ -42,6 +70,22 @@ class Game(db.Model):
         name (str): The name of the `Game`.
         started_when (datetime): The date and time the game was started.
         on_turn (int): The current turn number.
+        seed (int): What the `Galaxy` was generated from, or `None` before
+            the game starts. Generating a `Galaxy` with the same seed gives
+            the `Galaxy` as it was at the start of the game. Kept with the
+            snapshot (see "storage.py") rather than in the database.
+        galaxy (Galaxy): The `Galaxy` of a started `Game`. Loaded the first
+            time it is used.
+        orders (list of Order): The queued orders. Loaded the first time they
+            are used.
+
+    Private Attributes:
+        _galaxy (Galaxy): The `Galaxy`, once loaded.
+        _scheduler (OrderScheduler): Holds the queued orders, once loaded.
+        _store (GameStore): Reads and writes this `Game`'s snapshot and
+            journal.
+        _submitted (set of int): The uniques of the `Player`s who have
+            submitted orders since the last turn ended.
     """
 
     __tablename__ = 'game'
@@ -55,8 +99,10 @@ class Game(db.Model):
     started = db.Column(db.Boolean)
     join_code = db.Column(db.String(40))
 
-    galaxy = None
-    orders = []
+    _galaxy = None
+    _scheduler = None
+    _store = None
+    _submitted = None
 
     def __init__ (self, name, join_code):
         """
@@ -110,93 +156,178 @@ class Game(db.Model):
         """
         Called after a `Game` object has been loaded from the SQL database.
 
-        This method loads the `Game`'s `Galaxy` and any queued `Order`s from
-        the JSON files.
+        Nothing is read from disk here: most pages that load a `Game` (such as
+        the list of a `User`'s games) never use its `Galaxy` or orders. They
+        are loaded the first time `galaxy` or `orders` is used.
         """
 
-        # If we have not started this game, then we do not need to parse the
-        # galaxy or orders.
-        if not self.started:
-            return
+        self._galaxy = None
+        self._scheduler = None
+        self._store = None
+        self._submitted = None
+
+    @property
+    def seed(self):
+        return self._get_store().seed()
+
+    @property
+    def galaxy(self):
+        if self._galaxy is None and self.started:
+            self._load_galaxy()
+        return self._galaxy
 
-        # Find out where the "data" directory is.
-        import os
-        current_directory = os.path.dirname(__file__)
-        data_directory = current_directory+"/data/"
-
-        # Filenames to open.
-        galaxy_filename = "{0}.galaxy.json".format(str(self.unique))
-        orders_filename = "{0}.orders.json".format(str(self.unique))
-        galaxy_filename = data_directory + galaxy_filename
-        orders_filename = data_directory + orders_filename
-
-        # Parse the Galaxy.
-        galaxy_file = open(galaxy_filename)
-        galaxy_dict = json.loads(galaxy_file.read())
-        galaxy_file.close()
-        self.galaxy = galaxy_lib.galaxy_from_dict(galaxy_dict, self)
-
-        # Parse the orders.
-        orders_file = open(orders_filename)
-        orders_dict = json.loads(orders_file.read())
-        orders_file.close()
-        for order in orders_dict['move']:
-            parser = order_lib.move_order_from_dict
-            as_dict = parser(order, self)
-            self.orders.append(as_dict)
-        for order in orders_dict['hyperspace']:
-            parser = order_lib.hyperspace_order_from_dict
-            as_dict = parser(order, self)
-            self.orders.append(as_dict)
-        for order in orders_dict['build']:
-            parser = order_lib.build_fleet_order_from_dict
-            as_dict = parser(order, self)
-            self.orders.append(as_dict)
-        for order in orders_dict['colonize']:
-            parser = order_lib.upgrade_planet_order_from_dict
-            as_dict = parser(order, self)
-            self.orders.append(as_dict)
-
-    def queue_orders(self, orders):
+    @galaxy.setter
+    def galaxy(self, value):
+        self._galaxy = value
+
+    @property
+    def orders(self):
+        return self._get_scheduler().orders()
+
+    @orders.setter
+    def orders(self, value):
+        self._scheduler = scheduler_lib.OrderScheduler(value)
+
+    def queue_orders(self, orders, player):
         """
-        TODO
+        Queues the orders submitted by `player`. If every `Player` has now
+        submitted orders, the turn is put in the turn queue to be resolved in
+        the background (see "turnqueue.py" and `resolve_turn`).
+
+        Args:
+            orders (list of Order):
+                The orders that `player` submitted.
+
+            player (Player):
+                The `Player` who submitted the orders.
+
+        Returns:
+            `True` if the turn is now being resolved, `False` if some
+            `Player`s have yet to submit their orders.
+
+        Raises:
+            TurnResolvingError: The turn is already being resolved, or was
+                resolved since the orders were given. The orders were not
+                queued.
         """
 
-        # Add the orders
-        self.orders.extend(orders)
-        self.commit()
+        turn = self.on_turn
+        orders_dict = order_lib.orders_as_dict(orders)
+
+        # Hold the lock on the game files, so that two submissions can not
+        # both miss each other's orders, and no submission lands while the
+        # turn is being resolved.
+        with self._get_store().lock():
+            # The turn may have been resolved since this `Game` was loaded.
+            # Orders given for it are of no use any more.
+            db.session.refresh(self)
+            if self.on_turn != turn:
+                raise TurnResolvingError("Turn {0} is over".format(turn))
+            elif self.turn_status() == TURN_RESOLVING:
+                raise TurnResolvingError(
+                    "Turn {0} is being resolved".format(self.on_turn))
+
+            # Load the galaxy and the queued orders again; another request
+            # may have changed them since we loaded them. This also finds out
+            # where the journal ends. The orders are parsed again against the
+            # galaxy just loaded.
+            self._galaxy = None
+            self._scheduler = None
+            scheduler = self._get_scheduler()
+            orders = order_lib.orders_from_dict(orders_dict, self)
+
+            # Record the orders in the journal before we act on them.
+            self._get_store().append(storage_lib.JOURNAL_ORDERS, {
+                'player' : player.unique,
+                'orders' : orders_dict
+            })
+
+            # Add the orders
+            for order in orders:
+                scheduler.add(order)
+            self._submitted.add(player.unique)
+
+            # See if every player has sent orders. If this is the case, then
+            # hand the turn to the turn workers.
+            waiting = [p for p in self.players
+                       if p.unique not in self._submitted]
+            pubsub_lib.publish(self.unique, pubsub_lib.EVENT_ORDERS, {
+                'turn' : self.on_turn,
+                'player' : player.unique,
+                'submitted' : len(self.players) - len(waiting),
+                'players' : len(self.players),
+                'resolving' : not waiting
+            })
+            if waiting:
+                return False # don't execute
+
+            turnqueue_lib.enqueue_turn(self.unique, self.on_turn)
+            return True
+
+    def resolve_turn(self, turn):
+        """
+        Executes the orders, begins the next turn and folds the journal into a
+        new snapshot. Called by a turn worker once every `Player` has
+        submitted orders.
 
-        # See if every player has sent orders. If this is the case, then
-        # execute the orders.
-        for player in self.players:
-            for order in self.orders:
-                if order.orderer == player:
-                    break
-            else:
-                return # don't execute
+        Args:
+            turn (int):
+                The turn to resolve. Nothing is done if the `Game` has moved
+                past it already (say, because a worker that was thought to
+                have died resolved it after all).
+        """
+
+        with self._get_store().lock():
+            db.session.refresh(self)
+            if self.on_turn != turn:
+                return
 
-        # Execute the orders
-        self.execute_orders()
+            # Work on a Galaxy of our own rather than the cached one, which
+            # the web pages may be reading while the turn is resolved.
+            # `commit` puts ours in the cache once the turn is over.
+            self._galaxy = self._get_store().load_galaxy(self)
+            self._scheduler = None
+
+            since = self.galaxy.version
+            self.execute_orders()
+            income = self.next_turn()
+
+            # Save the new turn to disk before the database, so that the
+            # database is never on a turn whose snapshot was not written.
+            self.commit()
+            db.session.commit()
+
+            # Only tell the clients once the new snapshot is written, so
+            # that what they ask for next is the galaxy of the new turn.
+            changed = self.galaxy.systems_changed_since(since)
+            self._publish_turn(income, changed)
+
+    def turn_status(self):
+        """
+        Returns:
+            `TURN_RESOLVING` while the current turn is queued or being
+            resolved, `TURN_FAILED` if resolving it failed and
+            `TURN_WAITING` while orders are still being submitted.
+        """
+
+        global TURN_FAILED
+        global TURN_RESOLVING
+        global TURN_WAITING
+
+        state = turnqueue_lib.turn_status(self.unique, self.on_turn)
+        if state in (turnqueue_lib.JOB_QUEUED, turnqueue_lib.JOB_RUNNING):
+            return TURN_RESOLVING
+        elif state == turnqueue_lib.JOB_FAILED:
+            return TURN_FAILED
+        return TURN_WAITING
 
     def execute_orders(self):
-        orders_finished = False
-        not_done = order_lib.ORDER_NOT_FINISHED
-        finished = order_lib.ORDER_NEXT_TURN
-
-        while not orders_finished:
-            orders_finished = True
-            new_orders = []
-
-            for order in self.orders:
-                result = order.execute(self.galaxy)
-                if result == not_done:
-                    orders_finished = False
-                elif result == finished:
-                    continue
-                new_orders.append(order)
+        """
+        Executes this turn's queued orders, phase by phase. See
+        `OrderScheduler.execute_turn`.
+        """
 
-            # Remove completed orders
-            self.orders = new_orders
+        self._get_scheduler().execute_turn(self.galaxy, self.on_turn)
 
         # Return the results
         return [] # TODO
@@ -218,19 +349,15 @@ class Game(db.Model):
         return len(self.players) == GAME_MAX_PLAYERS
 
     def next_turn(self):
-        # Add planet GDP to players.
-        systems = self.galaxy.systems
-        for system in systems:
-            planets = system.flat_planets()
-            for planet in planets:
-                if planet.owner is None:
-                    continue
-                money = planet.economic_output()
-                planet.owner.money += money
+        """
+        Pays every `Player` their income and begins the next turn. Committing
+        the changes to the database is up to the caller.
 
-        # Increment turn
-        self.on_turn += 1
-        db.session.commit()
+        Returns:
+            A `dict` that maps each faction code to the income paid to it.
+        """
+
+        return simulation_lib.next_turn(self)
 
     def start(self):
         """
@@ -243,7 +370,8 @@ class Game(db.Model):
         # Preconditions
         assert len(self.players) >= GAME_MIN_PLAYERS
 
-        # Setup the galaxy for this game.
+        # Setup the galaxy for this game. A new seed is picked for it and
+        # saved with the first snapshot.
         self.galaxy = galaxy_lib.Galaxy(self, generate=True)
         self.orders = []
         self.on_turn = 1
@@ -277,36 +405,121 @@ class Game(db.Model):
         return None
 
     def commit(self):
-        # Find out where we will write the galaxy and orders.
-        import os
-        current_directory = os.path.dirname(__file__)
-        data_directory = current_directory+"/data/"
-
-        # Get the dict version of the galaxy and write it.
-        output = self.galaxy.as_list(discoveries=True)
-        galaxy_filename = self.galaxy.get_json_filename()
-        galaxy_file = open(data_directory+galaxy_filename, 'w+')
-        galaxy_file.write(json.dumps(output))
-        galaxy_file.close()
-
-        # Get the dict version of the orders and write it.
-        output = {
-            'move' : [],
-            'hyperspace' : [],
-            'build' : [],
-            'colonize' : []
-        }
-        for order in self.orders:
-            if not isinstance(order, order_lib.Order):
-                raise Exception("Something went wrong - nonorder item in list")
-            to_put = order.as_dict()
-            output[order.dict_index()].append(to_put)
-
-        # Write it to the file.
-        order_filename = "{0}.orders.json".format(str(self.unique))
-        order_file = open(data_directory+order_filename, 'w+')
-        order_file.write(json.dumps(output))
-        order_file.close()
+        """
+        Writes a new snapshot of the `Galaxy` and the queued orders and empties
+        the journal. Called at the start of the game and at the end of every
+        turn.
+        """
+
+        store = self._get_store()
+        orders_dict = order_lib.orders_as_dict(self.orders)
+        store.write_snapshot(self.galaxy, orders_dict)
+        self._submitted = set()
+
+        # The galaxy in memory is now the one on disk.
+        version = store.galaxy_file_version()
+        galaxycache_lib.put(self.unique, version, self.galaxy)
+
+    def _publish_turn(self, income, changed_systems):
+        """
+        PRIVATE METHOD
+
+        Publishes the `EVENT_TURN` event for the turn that just began. Its
+        "players" field maps the unique of every `Player` to their money,
+        their income and the uniques of the `changed_systems` they can see.
+        """
+
+        players = {}
+        for player in self.players:
+            players[player.unique] = {
+                'money' : player.money,
+                'income' : income.get(player.faction_code, 0),
+                'systems' : [s.unique for s in changed_systems if
+                             s.discovered(player)]
+            }
+        pubsub_lib.publish(self.unique, pubsub_lib.EVENT_TURN, {
+            'turn' : self.on_turn,
+            'players' : players
+        })
+
+    def _get_store(self):
+        """
+        PRIVATE METHOD
+
+        Returns the `GameStore` for this `Game`'s files.
+        """
+
+        if self._store is None:
+            self._store = storage_lib.GameStore(self.unique)
+        return self._store
+
+    def _get_scheduler(self):
+        """
+        PRIVATE METHOD
+
+        Returns the `OrderScheduler` that holds this `Game`'s queued orders,
+        loading the orders if they have not been loaded yet.
+        """
+
+        if self._scheduler is None:
+            self._load_orders()
+        return self._scheduler
+
+    def _load_galaxy(self):
+        """
+        PRIVATE METHOD
+
+        Loads the `Galaxy` of this `Game` from the galaxy cache if it has not
+        changed on disk since it was cached, or from disk otherwise. The
+        cached `Galaxy` is shared by every request for this `Game`, so it must
+        not be changed; `resolve_turn` loads a `Galaxy` of its own.
+        """
+
+        store = self._get_store()
+        version = store.galaxy_file_version()
+        galaxy = galaxycache_lib.get(self.unique, version)
+
+        if galaxy is None:
+            galaxy = store.load_galaxy(self)
+            galaxycache_lib.put(self.unique, version, galaxy)
+        self._galaxy = galaxy
+
+    def _load_orders(self):
+        """
+        PRIVATE METHOD
+
+        Loads the queued orders from the last snapshot and replays the journal
+        on top of them.
+        """
+
+        self._submitted = set()
+        if not self.started:
+            self._scheduler = scheduler_lib.OrderScheduler()
+            return
+
+        # Parse the snapshot.
+        (orders_dict, records) = self._get_store().load_orders()
+        orders = order_lib.orders_from_dict(orders_dict, self)
+        self._scheduler = scheduler_lib.OrderScheduler(orders)
+
+        # Replay everything that happened since the snapshot.
+        for record in records:
+            self._replay(record)
+
+    def _replay(self, record):
+        """
+        PRIVATE METHOD
+
+        Applies one journal record (`dict`) to this `Game`.
+        """
+
+        if record['kind'] == storage_lib.JOURNAL_ORDERS:
+            for order in order_lib.orders_from_dict(record['orders'], self):
+                self._scheduler.add(order)
+            self._submitted.add(record['player'])
+        else:
+            kind = record['kind']
+            raise Exception("Unknown journal record {0}".format(kind))
 
 
 
@@ -327,6 +540,25 @@ def find(unique=None):
 
 
 
+def resolve_turn(game_unique, turn):
+    """
+    Resolves turn `turn` of the `Game` with the given unique. See
+    `Game.resolve_turn`. Called from the turn worker threads, so it sets up
+    its own application context and database session.
+    """
+
+    from interstellarage import app
+
+    with app.app_context():
+        try:
+            game = find(unique=game_unique)
+            if game is not None:
+                game.resolve_turn(turn)
+        finally:
+            db.session.remove()
+
+
+
 @game_pages.route('/game/create', methods=['POST'])
 def web_create_game():
     """
@@ -441,6 +673,119 @@ def web_start_game(gameid):
 
 
 
+@game_pages.route('/game/turn/status', methods=['POST'])
+def web_turn_status():
+    """
+    Called by the client after it submits its orders, to find out whether the
+    turn has been resolved.
+
+    Form Args:
+        game (int):
+            The unique of the `Game`.
+
+        wait (float):
+            Optional. If given and the turn is being resolved, the answer is
+            held back for up to this many seconds (at most
+            `TURN_STATUS_MAX_WAIT`) until it is resolved.
+
+    Returns:
+        A JSON object with `Game.turn_status` in its "status" field and the
+        current turn number in its "turn" field.
+    """
+
+    global TURN_RESOLVING
+    global TURN_STATUS_MAX_WAIT
+
+    from interstellarage import current_user
+    user = current_user()
+    if user is None:
+        return "Not logged in", 400
+
+    game = find(unique=int(request.form['game']))
+    if game is None:
+        return "Game does not exist.", 400
+    elif user not in game:
+        return "You are not in this game", 400
+
+    status = game.turn_status()
+    wait = min(float(request.form.get('wait', 0)), TURN_STATUS_MAX_WAIT)
+    if status == TURN_RESOLVING and wait > 0:
+        turnqueue_lib.wait_for_turn(game.unique, game.on_turn, wait)
+        db.session.refresh(game)
+        status = game.turn_status()
+
+    return json.dumps({
+        "status" : status,
+        "turn" : game.on_turn
+    })
+
+
+
+@game_pages.route('/game/events/<gameid>')
+def web_game_events(gameid):
+    """
+    A stream of Server-Sent Events about a `Game` (see "pubsub.py"), for the
+    client to hear about new turns without asking over and over. Each event
+    has one of the `pubsub.EVENT_*` kinds as its name and a JSON object as
+    its data:
+
+        orders: a `Player` submitted orders. The "turn", "player",
+            "submitted" and "players" fields say who submitted orders for
+            which turn and how many of how many `Player`s have; "resolving"
+            is `true` if the turn is now being resolved.
+
+        turn: a turn was resolved. The "turn" field has the new turn number,
+            "money" and "income" are the `Player`'s money and what they just
+            earned, and "systems" holds the uniques of the `System`s the
+            `Player` can see that changed (see "/game/galaxy/changes").
+
+    Keepalives are sent as comments.
+    """
+
+    global EVENTS_RETRY
+
+    from interstellarage import current_user
+    user = current_user()
+    game = find(unique=int(gameid))
+
+    if user is None:
+        return "Not logged in", 400
+    elif game is None:
+        return "Game does not exist.", 400
+    elif user not in game:
+        return "You are not in this game", 400
+
+    game_unique = game.unique
+    player_unique = game.player_for_user(user).unique
+
+    # The stream can stay open for hours; give the database connection back
+    # now rather than when it ends.
+    db.session.remove()
+
+    def stream():
+        subscription = pubsub_lib.subscribe(game_unique)
+        try:
+            yield "retry: {0}\n\n".format(EVENTS_RETRY)
+            while True:
+                (kind, data) = subscription.get()
+                if kind == pubsub_lib.EVENT_KEEPALIVE:
+                    yield ":\n\n"
+                    continue
+                if kind == pubsub_lib.EVENT_TURN:
+                    data = dict(data['players'].get(player_unique, {}),
+                                turn=data['turn'])
+                yield "event: {0}\ndata: {1}\n\n".format(kind,
+                                                          json.dumps(data))
+        finally:
+            subscription.close()
+
+    return Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control" : "no-cache",
+        "X-Accel-Buffering" : "no"
+    })
+
+
+
 # When we load a Game from the SQL database, it is important that we also
 # load its galaxy and queued orders from the JSON.
 event.listen(Game, 'load', Game.on_load)
@@ -0,0 +1,160 @@
+"""
+InterstellarAge
+jumpmatrix.py
+
+While a `Player` looks over the Galaxy Map and plots hyperspace jumps, the
+client needs to know how far every visible `System` is from the `System`s the
+`Player` can send fleets from. This module works out, in one go, the grid
+distances and direct jump lengths from a set of source `System`s to every
+`System` a `Player` can see, and keeps the encoded answers until the turn
+ends.
+
+The grid distances are worked out with NumPy over an array of positions when
+it is installed, and one pair at a time otherwise.
+"""
+
+# Import python modules
+import json
+from collections import OrderedDict
+
+# NumPy works out the whole matrix at once. Without it, the matrix is filled
+# in one pair of `System`s at a time.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Import our modules
+import system as system_lib
+
+# Define constants.
+
+# The most (game, player, sources) matrices that are kept in memory at once.
+JUMP_MATRIX_MAX_ENTRIES = 64
+
+class JumpMatrixCache(object):
+    """
+    Holds the JSON of the most recently asked for jump matrices.
+
+    Discoveries and changes of ownership only happen while a turn is being
+    executed, so a matrix stays good until the `Game` moves on to the next
+    turn. The turn number is part of the key of every matrix.
+
+    Private Attributes:
+        _matrices (OrderedDict):
+            Maps `(game unique, faction code, turn, source uniques)` to the
+            JSON of a matrix. Ordered from least to most recently used.
+
+        _max_entries (int):
+            The most matrices to keep.
+    """
+
+    def __init__(self, max_entries=JUMP_MATRIX_MAX_ENTRIES):
+        self._matrices = OrderedDict()
+        self._max_entries = max_entries
+
+    def matrix_json(self, game, player, sources):
+        """
+        Args:
+            game (Game):
+                The `Game` being played.
+
+            player (Player):
+                The `Player` the matrix will be sent to.
+
+            sources (list of System):
+                The `System`s to measure from.
+
+        Returns:
+            A JSON `str` of the object returned by `jump_matrix` for
+            `sources` and the `System`s that `player` can see.
+        """
+
+        key = (game.unique, player.faction_code, game.on_turn,
+               tuple(system.unique for system in sources))
+        encoded = self._matrices.pop(key, None)
+        if encoded is None:
+            targets = game.galaxy.visible_systems(player)
+            encoded = json.dumps(jump_matrix(sources, targets))
+        self._matrices[key] = encoded
+
+        # Throw away the least recently used matrices.
+        while len(self._matrices) > self._max_entries:
+            self._matrices.popitem(last=False)
+        return encoded
+
+
+
+def jump_matrix(sources, targets):
+    """
+    Args:
+        sources (list of System):
+            The `System`s to measure from.
+
+        targets (list of System):
+            The `System`s to measure to.
+
+    Returns:
+        A `dict` with the uniques of `sources` in its "sources" field and of
+        `targets` in its "targets" field. Its "distances" field holds one
+        `list` per source `System` with the `System.grid_distance` to every
+        target `System`, and its "jumps" field holds the
+        `System.hyperspace_jump_length` of each of those jumps.
+    """
+
+    if numpy is not None:
+        distances = _distances_vectorized(sources, targets)
+        speed = system_lib.HYPERSPACE_SPEED
+        jumps = numpy.maximum(1, distances // speed)
+        distances = distances.tolist()
+        jumps = jumps.tolist()
+    else:
+        distances = [[s.grid_distance(t) for t in targets] for s in sources]
+        jumps = [[s.hyperspace_jump_length(t) for t in targets]
+                 for s in sources]
+
+    return {
+        "sources" : [system.unique for system in sources],
+        "targets" : [system.unique for system in targets],
+        "distances" : distances,
+        "jumps" : jumps
+    }
+
+
+
+def _distances_vectorized(sources, targets):
+    """
+    PRIVATE FUNCTION
+
+    Returns a NumPy array with one row per `System` in `sources` and one
+    column per `System` in `targets` holding the grid distance of each pair.
+    The distance along each axis is added in turn, so no array is bigger than
+    the matrix itself.
+    """
+
+    distances = numpy.zeros((len(sources), len(targets)), dtype=numpy.int64)
+    if not sources or not targets:
+        return distances
+
+    from_positions = numpy.array([s.position for s in sources],
+                                 dtype=numpy.int64)
+    to_positions = numpy.array([t.position for t in targets],
+                               dtype=numpy.int64)
+    for axis in xrange(0, 3):
+        column = from_positions[:, axis, None] - to_positions[None, :, axis]
+        distances += numpy.abs(column)
+    return distances
+
+
+
+# The cache used by the web pages.
+_cache = JumpMatrixCache()
+
+def matrix_json(game, player, sources):
+    """
+    Returns the jump matrix from `sources` to every `System` that `player`
+    can see as a JSON `str` from the shared cache. See
+    `JumpMatrixCache.matrix_json`.
+    """
+
+    return _cache.matrix_json(game, player, sources)
@@ -0,0 +1,174 @@
+"""
+InterstellarAge
+ledger.py
+
+This module defines the `IncomeLedger` class, which keeps the income of every
+faction in a `Galaxy` along with how much each owned `Planet` adds to it. The
+income of a `Planet` only changes when it changes hands or gains a colony, so
+the ledger is updated in those two places (see `Galaxy.income_changed`)
+instead of being worked out again from every `Planet` at the end of each turn.
+
+Set `LEDGER_VERIFY` to `True` to check the ledger against a full walk of the
+`Galaxy` every time it is read.
+"""
+
+# Import our modules
+import planettable as planettable_lib
+
+# Define global variables.
+
+# When `True`, `Galaxy.income_by_faction` checks the ledger against a full
+# recomputation and raises an exception if they disagree.
+LEDGER_VERIFY = False
+
+class IncomeLedger(object):
+    """
+    Private Attributes:
+        _contributions (dict):
+            Maps the `unique` of every owned `Planet` to a tuple of
+            `(faction code, income)`: the faction that owns it and the money
+            it makes that faction each turn.
+
+        _income (dict):
+            Maps faction codes to the sum of their `Planet`s' contributions.
+    """
+
+    def __init__(self, contributions):
+        """
+        Args:
+            contributions (dict):
+                Maps the `unique` of every owned `Planet` to a tuple of
+                `(faction code, income)`.
+        """
+
+        self._contributions = contributions
+        self._income = _totals(contributions)
+
+    def update(self, planet):
+        """
+        Works out again what `planet` adds to the income of its owner. Call
+        this whenever `planet` changes hands or gains or loses a colony.
+        """
+
+        old = self._contributions.pop(planet.unique, None)
+        if old is not None:
+            self._income[old[0]] -= old[1]
+
+        if planet.owner_code is not None:
+            new = (planet.owner_code, planet.economic_output())
+            self._contributions[planet.unique] = new
+            self._income[new[0]] = self._income.get(new[0], 0) + new[1]
+
+    def income_by_faction(self):
+        """
+        Returns:
+            A `dict` that maps faction codes to the money that the `Planet`s
+            owned by that faction make each turn.
+        """
+
+        return dict(self._income)
+
+    def verify(self, galaxy):
+        """
+        Checks every contribution and total in this ledger against a walk of
+        every `Planet` in `galaxy`.
+
+        Raises:
+            Exception: if the ledger and the walk disagree.
+        """
+
+        expected = _walk_contributions(galaxy)
+        if expected != self._contributions:
+            wrong = set(expected.items()) ^ set(self._contributions.items())
+            uniques = sorted(set(item[0] for item in wrong))
+            raise Exception("Income ledger is wrong for planets {0}".format(
+                uniques))
+
+        totals = _totals(expected)
+        if _nonzero(totals) != _nonzero(self._income):
+            raise Exception("Income ledger totals {0} should be {1}".format(
+                self._income, totals))
+
+
+
+def ledger_for_galaxy(galaxy):
+    """
+    Args:
+        galaxy (Galaxy):
+            The `Galaxy` whose income the ledger will keep.
+
+    Returns:
+        A new `IncomeLedger` with the contribution of every owned `Planet` in
+        `galaxy`. It is read out of `galaxy`'s `PlanetTable` when NumPy is
+        installed.
+    """
+
+    table = galaxy.planet_table()
+    if table is None:
+        return IncomeLedger(_walk_contributions(galaxy))
+    return ledger_for_table(table)
+
+
+
+def ledger_for_table(table):
+    """
+    Args:
+        table (PlanetTable):
+            The `PlanetTable` of the `Galaxy` whose income the ledger will
+            keep.
+
+    Returns:
+        A new `IncomeLedger` with the contribution of every owned `Planet` in
+        `table`.
+    """
+
+    owned = table.owner != planettable_lib.NO_OWNER
+    uniques = table.unique[owned].tolist()
+    owners = table.owner[owned].tolist()
+    output = table.economic_output()[owned].tolist()
+    return IncomeLedger(dict(zip(uniques, zip(owners, output))))
+
+
+
+def _walk_contributions(galaxy):
+    """
+    PRIVATE FUNCTION
+
+    Returns the contribution of every owned `Planet` in `galaxy`, in the
+    format of `IncomeLedger._contributions`, by walking every `Planet`.
+    """
+
+    contributions = {}
+    for system in galaxy.systems:
+        for planet in system.flat_planets():
+            code = planet.owner_code
+            if code is None:
+                continue
+            contributions[planet.unique] = (code, planet.economic_output())
+    return contributions
+
+
+
+def _totals(contributions):
+    """
+    PRIVATE FUNCTION
+
+    Returns a `dict` that maps faction codes to the sum of their
+    contributions in `contributions`.
+    """
+
+    totals = {}
+    for (code, income) in contributions.values():
+        totals[code] = totals.get(code, 0) + income
+    return totals
+
+
+
+def _nonzero(totals):
+    """
+    PRIVATE FUNCTION
+
+    Returns `totals` without the factions whose total is zero.
+    """
+
+    return dict((code, t) for (code, t) in totals.items() if t != 0)
@@ -0,0 +1,333 @@
+"""
+InterstellarAge
+loadtest.py
+
+Checks how "serve.py" holds up with many idle clients. It starts the server
+in this process on a throwaway SQLite database and data directory, sets up a
+game for two players and then:
+
+    1) opens an event stream ("/game/events/<id>") for every client and
+       leaves it idle,
+    2) times requests to "/game/turn/status" while every stream is open,
+    3) submits both players' orders and, while the turn is being resolved,
+       times the same requests together with more order submissions (which
+       have to wait for the game files), then waits for the turn event to
+       reach every stream.
+
+Run it from this directory with the number of idle clients:
+
+    python loadtest.py 5000
+
+The clients run in the same process as the server, so the latencies include
+the time the clients themselves take. Every client needs two file
+descriptors (one for each end of its connection); raise `ulimit -n` to fit.
+"""
+
+# gevent has to patch the standard library before anything else imports it.
+try:
+    from gevent import monkey
+except ImportError:
+    monkey = None
+
+if monkey is not None:
+    monkey.patch_all()
+
+# Import python modules
+import hashlib
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import urllib
+
+# Define constants.
+
+# The number of idle clients if none is given.
+LOADTEST_CLIENTS = 5000
+
+# How many streams are opened at once while the clients connect.
+LOADTEST_CONNECT_BATCH = 200
+
+# The number of timed requests in each phase, and how many are in flight at
+# once.
+LOADTEST_REQUESTS = 500
+LOADTEST_CONCURRENCY = 20
+
+# How long (in seconds) to wait for the turn event to reach every stream.
+LOADTEST_TURN_TIMEOUT = 120
+
+LOADTEST_PASSWORD = "loadtest"
+
+def _send(port, method, path, cookie=None, form=None):
+    """
+    PRIVATE FUNCTION
+
+    Opens a connection to the server and sends one request on it.
+
+    Returns:
+        The connected `socket`.
+    """
+
+    body = urllib.urlencode(form) if form is not None else ""
+    lines = [
+        "{0} {1} HTTP/1.1".format(method, path),
+        "Host: 127.0.0.1",
+        "Connection: close",
+        "Content-Length: {0}".format(len(body))
+    ]
+    if form is not None:
+        lines.append("Content-Type: application/x-www-form-urlencoded")
+    if cookie is not None:
+        lines.append("Cookie: " + cookie)
+
+    connection = socket.create_connection(("127.0.0.1", port))
+    connection.sendall("\r\n".join(lines) + "\r\n\r\n" + body)
+    return connection
+
+
+
+def _request(port, method, path, cookie=None, form=None):
+    """
+    PRIVATE FUNCTION
+
+    Returns:
+        The whole response (`str`) to one request, headers and all.
+    """
+
+    connection = _send(port, method, path, cookie=cookie, form=form)
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    connection.close()
+    return "".join(chunks)
+
+
+
+def _login(port, username):
+    """
+    PRIVATE FUNCTION
+
+    Logs in as `username` and returns the session cookie.
+    """
+
+    global LOADTEST_PASSWORD
+
+    response = _request(port, "POST", "/login", form={
+        'username' : username,
+        'password' : LOADTEST_PASSWORD
+    })
+    for line in response.split("\r\n"):
+        if line.lower().startswith("set-cookie:"):
+            return line.split(":", 1)[1].strip().split(";")[0]
+    raise Exception("Could not log in as {0}".format(username))
+
+
+
+def _percentile(times, fraction):
+    """
+    PRIVATE FUNCTION
+
+    Returns the `fraction` percentile (0 to 1) of `times`.
+    """
+
+    ordered = sorted(times)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+
+def _time_requests(port, cookie, path, form):
+    """
+    PRIVATE FUNCTION
+
+    Sends `LOADTEST_REQUESTS` POST requests with `form` to `path`,
+    `LOADTEST_CONCURRENCY` at a time.
+
+    Returns:
+        A `list` of how long (in seconds) each request took.
+    """
+
+    global LOADTEST_CONCURRENCY
+    global LOADTEST_REQUESTS
+
+    from gevent.pool import Pool
+
+    def timed(a):
+        start = time.time()
+        _request(port, "POST", path, cookie=cookie, form=form)
+        return time.time() - start
+
+    pool = Pool(LOADTEST_CONCURRENCY)
+    return pool.map(timed, xrange(0, LOADTEST_REQUESTS))
+
+
+
+def _print_times(label, times):
+    """
+    PRIVATE FUNCTION
+
+    Prints the median and the 99th percentile of `times`.
+    """
+
+    print "{0:>24} {1:>10.1f} {2:>10.1f}".format(
+        label,
+        _percentile(times, 0.5) * 1000,
+        _percentile(times, 0.99) * 1000
+    )
+
+
+
+def _setup_game():
+    """
+    PRIVATE FUNCTION
+
+    Makes two `User`s, "loadtest1" and "loadtest2", and starts a `Game` for
+    them.
+
+    Returns:
+        The unique of the `Game`.
+    """
+
+    global LOADTEST_PASSWORD
+
+    from interstellarage import app, db
+    import game as game_lib
+    import user as user_lib
+
+    password_hash = hashlib.sha1(LOADTEST_PASSWORD).hexdigest()
+    with app.app_context():
+        db.create_all()
+        first = user_lib.User("loadtest1", password_hash, "1@loadtest")
+        second = user_lib.User("loadtest2", password_hash, "2@loadtest")
+        game = game_lib.Game("Load test", "loadtest")
+        game.add_user(first, 0, creator=True)
+        game.add_user(second, 1)
+        game.start()
+        game_unique = game.unique
+        db.session.remove()
+    return game_unique
+
+
+
+def run(clients):
+    """
+    Runs the load test with `clients` idle clients and prints the results.
+    """
+
+    global LOADTEST_CONNECT_BATCH
+    global LOADTEST_TURN_TIMEOUT
+
+    import gevent
+    from gevent.pool import Pool
+
+    directory = tempfile.mkdtemp() + "/"
+    try:
+        from interstellarage import app
+        app.config["SQLALCHEMY_DATABASE_URI"] = (
+            "sqlite:///" + directory + "loadtest.sqlite")
+
+        # Keep the load test's games out of the real data directory.
+        import storage as storage_lib
+        storage_lib.data_directory = lambda: directory
+
+        import serve as serve_lib
+        game_unique = _setup_game()
+        server = serve_lib.make_server('127.0.0.1', 0)
+        server.start()
+        port = server.server_port
+
+        cookies = [_login(port, "loadtest1"), _login(port, "loadtest2")]
+        path = "/game/events/{0}".format(game_unique)
+
+        # Open every stream and wait for the first line of each.
+        turn_times = []
+        streams = []
+
+        def listen(a):
+            connection = _send(port, "GET", path, cookie=cookies[a % 2])
+            received = ""
+            while "retry:" not in received:
+                chunk = connection.recv(4096)
+                if not chunk:
+                    raise Exception("Stream {0} was closed".format(a))
+                received += chunk
+            streams.append(connection)
+            return connection
+
+        def wait_for_turn(connection):
+            received = ""
+            while "event: turn" not in received:
+                chunk = connection.recv(4096)
+                if not chunk:
+                    return
+                received = received[-16:] + chunk
+            turn_times.append(time.time())
+
+        start = time.time()
+        connections = Pool(LOADTEST_CONNECT_BATCH).map(listen,
+                                                       xrange(0, clients))
+        connect_time = time.time() - start
+        readers = [gevent.spawn(wait_for_turn, c) for c in connections]
+
+        print "Load test ({0} idle event streams)".format(clients)
+        print "connected in {0:.1f} s; open streams: {1}".format(
+            connect_time, len(streams))
+        print "{0:>24} {1:>10} {2:>10}".format(
+            "requests", "p50 (ms)", "p99 (ms)")
+        status_form = {'game' : game_unique}
+        _print_times("idle", _time_requests(port, cookies[0],
+                                            "/game/turn/status", status_form))
+
+        # Submit both players' orders; the second submission queues the turn.
+        orders = {
+            'game' : game_unique,
+            'move' : "[]",
+            'hyperspace' : "[]",
+            'colonize' : "[]",
+            'build' : "[]"
+        }
+        submitted = time.time()
+        for cookie in cookies:
+            _request(port, "POST", "/game/submitorders", cookie=cookie,
+                     form=orders)
+
+        # Keep submitting orders while the turn is resolved. A submission
+        # that waits for the game files must not hold up the other requests.
+        statuses = gevent.spawn(_time_requests, port, cookies[0],
+                                "/game/turn/status", status_form)
+        submissions = gevent.spawn(_time_requests, port, cookies[1],
+                                   "/game/submitorders", orders)
+        gevent.joinall([statuses, submissions])
+        _print_times("while resolving", statuses.get())
+        _print_times("orders while resolving", submissions.get())
+
+        gevent.joinall(readers, timeout=LOADTEST_TURN_TIMEOUT)
+        if len(turn_times) == clients:
+            print "turn event reached every stream {0:.2f} s after " \
+                  "submission".format(max(turn_times) - submitted)
+        else:
+            print "turn event reached {0} of {1} streams".format(
+                len(turn_times), clients)
+
+        for connection in connections:
+            connection.close()
+        server.stop()
+
+        # The workers may still be recording the job in the queue, which is
+        # in the directory we are about to remove.
+        import turnqueue as turnqueue_lib
+        turnqueue_lib.stop_workers()
+    finally:
+        shutil.rmtree(directory)
+
+
+
+if __name__ == "__main__":
+    if monkey is None:
+        print "loadtest.py needs gevent (pip install gevent)."
+        sys.exit(1)
+
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else LOADTEST_CLIENTS)
@@ -0,0 +1,246 @@
+"""
+InterstellarAge
+maplod.py
+
+The Galaxy Map only draws stars: it needs the position, spectral class and
+size of every `System` and a summary of who owns it, but none of the
+`Planet`s, moons, colonies or textures that `System.as_dict` includes. This
+module packs that "map level of detail" projection of a `System` into a
+fixed-size binary record, `MAP_RECORD_FORMAT`. A set of `System`s is sent to
+the client as the base64 of its records, one after the other, along with the
+`System` names in the same order. The client fetches the full `System` once
+the player opens it (see `web_system_detail` in "galaxy.py").
+
+Like the views in "viewcache.py", the records sent to each `Player` are kept
+and only packed again once `System.version` says the `System` changed.
+"""
+
+# Import python modules
+import base64
+import json
+import struct
+from collections import OrderedDict
+
+# Import our modules
+import system as system_lib
+
+# Define constants.
+
+# unique, version, x, y, z, spectral class code, flags, star size, owner mask.
+# The owner mask has the faction code bit of every faction that owns a planet
+# in the system set.
+MAP_RECORD_FORMAT = "<iIhhhBBfB"
+MAP_RECORD_SIZE = struct.calcsize(MAP_RECORD_FORMAT)
+
+# Set in the flags of a record if the player has discovered the planets of the
+# system.
+MAP_FLAG_PLANETS_DISCOVERED = 1
+
+# Stored in place of the spectral class code of a system whose spectral class
+# is not in `system.SPECTRAL_CLASSES`.
+MAP_NO_SPECTRAL_CLASS = 255
+
+# The most (game, player) map views that are kept in memory at once.
+MAP_VIEW_MAX_ENTRIES = 64
+
+class MapView(object):
+    """
+    The packed records of the `System`s one `Player` can see.
+
+    Attributes:
+        version (int):
+            The `Galaxy.version` that `json` was made at or -1 if `json` is
+            out of date.
+
+        json (str):
+            The projection of every `System` the `Player` can see, as
+            returned by `MapViewCache.map_json`.
+
+        records (dict):
+            Maps the `unique` of every `System` in this view to a tuple of
+            `(version, record)`, where `record` is the packed record of the
+            `System` at `System.version` `version`.
+    """
+
+    def __init__(self):
+        self.version = -1
+        self.json = None
+        self.records = {}
+
+
+
+class MapViewCache(object):
+    """
+    Holds the `MapView`s for the most recently polled (game, player) pairs.
+
+    Private Attributes:
+        _views (OrderedDict):
+            Maps `(game unique, player unique)` to a `MapView`. Ordered from
+            least to most recently used.
+
+        _max_entries (int):
+            The most `MapView`s to keep.
+    """
+
+    def __init__(self, max_entries=MAP_VIEW_MAX_ENTRIES):
+        self._views = OrderedDict()
+        self._max_entries = max_entries
+
+    def map_json(self, galaxy, player):
+        """
+        Args:
+            galaxy (Galaxy):
+                The `Galaxy` to project.
+
+            player (Player):
+                The `Player` the projection will be sent to.
+
+        Returns:
+            The projection of every `System` in `galaxy` that `player` can
+            see, as a JSON `str` of the object returned by `systems_json`.
+        """
+
+        view = self._view(galaxy.game_unique, player.unique)
+
+        # Nothing has changed since the last time this view was made.
+        if view.version == galaxy.version:
+            return view.json
+
+        systems = galaxy.visible_systems(player)
+        view.json = self._json(view, systems, player)
+        view.version = galaxy.version
+        return view.json
+
+    def systems_json(self, galaxy, player, systems):
+        """
+        Args:
+            galaxy (Galaxy):
+                The `Galaxy` that `systems` are in.
+
+            player (Player):
+                The `Player` the projection will be sent to.
+
+            systems (list of System):
+                The `System`s to project. `player` must be able to see all of
+                them.
+
+        Returns:
+            A JSON `str` of an object with the base64 of the packed records
+            of `systems` in its "records" field, the names of `systems` in
+            its "names" field and `system.SPECTRAL_CLASSES`, which the
+            spectral class codes index, in its "classes" field.
+        """
+
+        view = self._view(galaxy.game_unique, player.unique)
+        return self._json(view, systems, player)
+
+    def _json(self, view, systems, player):
+        """
+        PRIVATE METHOD
+
+        Returns the JSON described in `systems_json`, reusing the records in
+        `view` of the `System`s that have not changed.
+        """
+
+        records = []
+        for system in systems:
+            cached = view.records.get(system.unique)
+            if cached is None or cached[0] != system.version:
+                cached = (system.version, pack_system(system, player))
+                view.records[system.unique] = cached
+            records.append(cached[1])
+
+        return json.dumps({
+            "records" : base64.b64encode("".join(records)),
+            "names" : [system.name for system in systems],
+            "classes" : system_lib.SPECTRAL_CLASSES
+        })
+
+    def _view(self, game_unique, player_unique):
+        """
+        PRIVATE METHOD
+
+        Returns the `MapView` for the given game and player, making a new one
+        if there is no such view.
+        """
+
+        key = (game_unique, player_unique)
+        view = self._views.pop(key, None)
+        if view is None:
+            view = MapView()
+        self._views[key] = view
+
+        # Throw away the least recently used views.
+        while len(self._views) > self._max_entries:
+            self._views.popitem(last=False)
+        return view
+
+
+
+def pack_system(system, player):
+    """
+    Args:
+        system (System):
+            The `System` to pack.
+
+        player (Player):
+            The `Player` the record will be sent to.
+
+    Returns:
+        The `MAP_RECORD_FORMAT` record of `system` as `player` sees it. Who
+        owns the `Planet`s of a `System` is only given if `player` has
+        discovered them.
+    """
+
+    global MAP_FLAG_PLANETS_DISCOVERED
+    global MAP_NO_SPECTRAL_CLASS
+    global MAP_RECORD_FORMAT
+
+    if system.star_spectral_class in system_lib.SPECTRAL_CLASSES:
+        spectral_class = system_lib.SPECTRAL_CLASSES.index(
+            system.star_spectral_class)
+    else:
+        spectral_class = MAP_NO_SPECTRAL_CLASS
+
+    flags = 0
+    owners = 0
+    if system.planets_discovered(player):
+        flags |= MAP_FLAG_PLANETS_DISCOVERED
+        for planet in system.flat_planets():
+            if planet.owner_code is not None:
+                owners |= 1 << planet.owner_code
+
+    (x, y, z) = system.position
+    return struct.pack(
+        MAP_RECORD_FORMAT,
+        system.unique,
+        system.version,
+        x, y, z,
+        spectral_class,
+        flags,
+        system.star_size,
+        owners
+    )
+
+
+
+# The cache used by the web pages.
+_cache = MapViewCache()
+
+def map_json(galaxy, player):
+    """
+    Returns the map projection of the part of `galaxy` that `player` can see
+    as a JSON `str` from the shared cache. See `MapViewCache.map_json`.
+    """
+
+    return _cache.map_json(galaxy, player)
+
+
+
+def systems_json(galaxy, player, systems):
+    """
+    Returns the map projection of `systems` as a JSON `str` from the shared
+    cache. See `MapViewCache.systems_json`.
+    """
+
+    return _cache.systems_json(galaxy, player, systems)
@@ -8,13 +8,16 @@ Orders are executed in the following order:
     3) Fleets are built
     4) Fleets arrive at intrasystem planets
     5) Fleets arrive at hyperspace planets
+
+Each `Order` lists the phases it does something in, and the `OrderScheduler`
+(see "scheduler.py") calls it once in each of those phases.
 """
 
 # Import python modules.
 import json
 
 # Import TODO
-from interstellarage import app, db
+from interstellarage import app
 
 # Import Flask stuff
 from flask import request
@@ -32,11 +35,51 @@ ORDER_FAILED = 3
 ORDER_UPGRADE_GROUND_TYPE = 1
 ORDER_UPGRADE_SPACE_TYPE = 2
 
+# The phases of a turn, in the order they are executed in.
+PHASE_COLONIES = 1
+PHASE_DEPARTURES = 2
+PHASE_BUILDS = 3
+PHASE_INTRASYSTEM_ARRIVALS = 4
+PHASE_HYPERSPACE_ARRIVALS = 5
+PHASES = [
+    PHASE_COLONIES,
+    PHASE_DEPARTURES,
+    PHASE_BUILDS,
+    PHASE_INTRASYSTEM_ARRIVALS,
+    PHASE_HYPERSPACE_ARRIVALS
+]
+
 class Order(object):
+    """
+    Attributes:
+        orderer (Player): The `Player` that issued the order.
+        phases (tuple of int): The phases (see the top of this module) that
+            this `Order` does something in, in order.
+        arrives_on (int): The turn on which a fleet sent by this `Order`
+            through hyperspace arrives, or `None` if no such fleet is in
+            transit.
+    """
+
     orderer = None
-    _phase = 0
+    phases = ()
+    arrives_on = None
+
+    def execute(self, galaxy, phase, turn):
+        """
+        Carries out the part of this `Order` that happens in `phase`.
+
+        Args:
+            galaxy (Galaxy): The `Galaxy` the `Order` is carried out in.
+            phase (int): One of the phases in `phases`.
+            turn (int): The number of the turn being executed.
+
+        Returns:
+            `ORDER_NOT_FINISHED` if the `Order` has more to do in its next
+            phase this turn, `ORDER_NOT_FINISHED_NEXT_TURN` if it has a fleet
+            in transit until `arrives_on`, `ORDER_NEXT_TURN` if it is done,
+            or `ORDER_FAILED` if it could not be carried out.
+        """
 
-    def execute(self, galaxy):
         pass
 
     def as_dict(self):
@@ -56,8 +99,6 @@ class MoveOrder(Order):
         fleet_number (int): Signifies that we are moving fleet number n.
 
     Private Attributes:
-        _phase (int): 
-
         _fleet_size (int): The number of ships in the fleet that this
             `MoveOrder` is supposed to move.
     """
@@ -65,6 +106,7 @@ class MoveOrder(Order):
     to_planet = None
     from_planet = None
     fleet_number = -1
+    phases = (PHASE_DEPARTURES, PHASE_INTRASYSTEM_ARRIVALS)
 
     _fleet_size = -1
 
@@ -73,7 +115,7 @@ class MoveOrder(Order):
         assert orderer is not None
         assert from_planet is not None
         assert to_planet is not None
-        assert from_planet.owner == orderer
+        assert from_planet.owned_by(orderer)
         assert 0 <= fleet_number <= 2
 
         # Assign data
@@ -81,13 +123,8 @@ class MoveOrder(Order):
         self.from_planet = from_planet
         self.to_planet = to_planet
         self.fleet_number = fleet_number
-        self._phase = 1
-
-    def execute(self, galaxy):
-        """
-        Returns:
-        """
 
+    def execute(self, galaxy, phase, turn):
         # Declare global variables.
         global ORDER_NOT_FINISHED
         global ORDER_NEXT_TURN
@@ -96,25 +133,19 @@ class MoveOrder(Order):
         assert self.from_planet in galaxy
         assert self.to_planet in galaxy
 
-        # PHASE 1/3: Colonies built; fleets built
-        if self._phase == 1 or self._phase == 3:
-            self._phase += 1
-            return ORDER_NOT_FINISHED
-
         # PHASE 2: Fleets leave their planet.
-        if self._phase == 2:
+        if phase == PHASE_DEPARTURES:
             fleet_size = self.from_planet.fleet_departs(self.fleet_number)
             assert fleet_size > 0
 
             # Update variables
             self._fleet_size = fleet_size
-            self._phase = 3
             return ORDER_NOT_FINISHED
 
         # PHASE 4: Fleets arrive at destination. They do combat if required.
-        elif self._phase == 4:
+        elif phase == PHASE_INTRASYSTEM_ARRIVALS:
             fs = self._fleet_size
-            self.to_planet.receive_fleet(fs, self.orderer)
+            galaxy.fleet_arrives(self.to_planet, fs, self.orderer)
             return ORDER_NEXT_TURN
 
     def as_dict(self):
@@ -154,7 +185,7 @@ def move_order_from_dict(data, game, user=None):
     to_planet = galaxy.planet_for_unique(to_unique)
 
     # Return the MoveOrder
-    return MoveOrder(player, from_unique, to_planet, fleet_number)
+    return MoveOrder(player, from_planet, to_planet, fleet_number)
 
 
 
@@ -163,16 +194,24 @@ class HyperspaceOrder(Order):
     fleet_number = -1
     to_planet = None
     to_system = None
+    phases = (PHASE_DEPARTURES, PHASE_HYPERSPACE_ARRIVALS)
 
-    _eta = -1
+    _fleet_size = -1
 
-    def __init__(self, orderer, from_planet, dest, fleet_number, eta=None):
+    def __init__(self, orderer, from_planet, dest, fleet_number,
+                 arrives_on=None, fleet_size=None):
         """
         Args:
             orderer (Player):
             from_planet (Planet):
             dest (Planet or System):
             fleet_number (int):
+
+        Keyword Args:
+            arrives_on (int): If the fleet has already departed, the turn it
+                arrives on.
+            fleet_size (int): If the fleet has already departed, the number
+                of ships in it.
         """
 
         # Preconditions.
@@ -190,66 +229,49 @@ class HyperspaceOrder(Order):
         else:
             self.to_system = dest
             self.to_planet = None
-        if eta is not None:
-            self._eta = eta
+        if arrives_on is not None:
+            self.arrives_on = arrives_on
+            self._fleet_size = fleet_size
         self.fleet_number = fleet_number
-        self._phase = 1
 
-    def execute(self, galaxy):
+    def execute(self, galaxy, phase, turn):
         # Declare global variables.
-        global ORDER_NOT_FINISHED
         global ORDER_NEXT_TURN
         global ORDER_NOT_FINISHED_NEXT_TURN
 
         # Ensure data structure invariants.
         assert self.from_planet in galaxy
         assert self.to_planet in galaxy or self.to_system in galaxy
-        assert self.from_planet.owner == self.orderer
         assert 0 <= self.fleet_number <= 2
 
         if self.to_system is None:
             assert self.to_planet is not None
             self.to_system = self.to_planet.system()
 
-        # PHASE 1: Colonies are build
-        if self._phase == 1:
-            self._phase = 2
-            return ORDER_NOT_FINISHED
-
         # PHASE 2: Fleets depart planets
-        if self._phase == 2:
+        if phase == PHASE_DEPARTURES:
+            assert self.from_planet.owned_by(self.orderer)
             from_system = self.from_planet.system()
 
             fleet_size = self.from_planet.fleet_departs(self.fleet_number)
             assert fleet_size > 0
             self._fleet_size = fleet_size
 
-            eta = from_system.hyperspace_distance(self.to_system, fleet_size)
-            self._eta = eta
-            self._phase = 3
-            return ORDER_NOT_FINISHED
-
-        # PHASE 3: Fleets are built
-        if self._phase == 3:
-            self._phase = 4
-            return ORDER_NOT_FINISHED
-
-        # PHASE 4: Fleets arrive at intrasystem destinations
-        elif self._phase == 4:
-            self._phase = 5
+            # The fleet takes the quickest route through the systems its
+            # faction knows (see "routes.py").
+            planner = galaxy.route_planner(self.orderer)
+            eta = planner.eta(from_system, self.to_system)
+            self.arrives_on = turn + eta
             return ORDER_NOT_FINISHED_NEXT_TURN
 
-        # PHASE 5: Hyperspace travel
-        elif self._phase == 5:
-            self._eta -= 1
-            if self._eta == 0:
-                if self.to_planet is not None:
-                    self.to_planet.receive_fleet(self._fleet_size, self.orderer)
-                else:
-                    self.to_system.receive_fleet(self._fleet_size, self.orderer)
-                return ORDER_NEXT_TURN
+        # PHASE 5: Fleets arrive through hyperspace
+        elif phase == PHASE_HYPERSPACE_ARRIVALS:
+            fs = self._fleet_size
+            if self.to_planet is not None:
+                galaxy.fleet_arrives(self.to_planet, fs, self.orderer)
             else:
-                return ORDER_NOT_FINISHED_NEXT_TURN
+                galaxy.fleet_arrives(self.to_system, fs, self.orderer)
+            return ORDER_NEXT_TURN
 
     def as_dict(self):
         to_return = {
@@ -263,7 +285,10 @@ class HyperspaceOrder(Order):
         elif self.to_system is not None:
             to_return['to_system'] = self.to_system.unique
 
-        to_return['_eta'] = self._eta
+        # Fleets in transit are saved along with their orders.
+        if self.arrives_on is not None:
+            to_return['arrives_on'] = self.arrives_on
+            to_return['fleet_size'] = self._fleet_size
         return to_return
 
     def dict_index(self):
@@ -282,7 +307,7 @@ def hyperspace_order_from_dict(data, game, user=None):
         player = game.player_for_user(user)
     elif 'orderer' in data:
         orderer_unique = int(data['orderer'])
-        player = game.planet_for_unique(orderer_unique)
+        player = game.player_for_unique(orderer_unique)
     else:
         raise Exception("No user or player given")
     galaxy = game.galaxy
@@ -295,14 +320,24 @@ def hyperspace_order_from_dict(data, game, user=None):
         to_planet_unique = int(data['to_planet'])
         destin = galaxy.planet_for_unique(to_planet_unique)
 
-    if '_eta' in data:
-        eta = int(data['_eta'])
+    arrives_on = None
+    fleet_size = None
+    if 'arrives_on' in data:
+        arrives_on = int(data['arrives_on'])
+        fleet_size = int(data['fleet_size'])
 
     fleet_number = int(data['fleet_number'])
-    from_planet = galaxy.planet_for_unique(from_planet)
+    from_planet = galaxy.planet_for_unique(from_unique)
 
     # Return the order
-    return HyperspaceOrder(player, from_planet, desin, fleet_number, eta=eta)
+    return HyperspaceOrder(
+        player,
+        from_planet,
+        destin,
+        fleet_number,
+        arrives_on=arrives_on,
+        fleet_size=fleet_size
+    )
 
 
 
@@ -321,6 +356,7 @@ class UpgradePlanetOrder(Order):
     planet_to_upgrade = None
     upgrade_type = 0
     new_colony_name = ""
+    phases = (PHASE_COLONIES,)
 
     def __init__ (self, orderer, planet, up_type, name):
         # Declare global variables.
@@ -331,7 +367,7 @@ class UpgradePlanetOrder(Order):
         cond1 = up_type == ORDER_UPGRADE_SPACE_TYPE
         cond2 = up_type == ORDER_UPGRADE_GROUND_TYPE
         assert planet is not None
-        assert planet.owner == orderer
+        assert planet.owned_by(orderer)
         assert len(name) >= 1
         assert cond1 or cond2
 
@@ -340,9 +376,8 @@ class UpgradePlanetOrder(Order):
         self.planet_to_upgrade = planet
         self.upgrade_type = up_type
         self.new_colony_name = name
-        self._phase = 1
 
-    def execute(self, galaxy):
+    def execute(self, galaxy, phase, turn):
         # Preconditions.
         assert self.planet_to_upgrade in galaxy
 
@@ -361,15 +396,15 @@ class UpgradePlanetOrder(Order):
             return ORDER_FAILED
 
         # Create the new colony.
-        import colony as colony_lib
-        colony = colony_lib.Colony(self.new_colony_name)
+        colony = planet_lib.Colony(self.new_colony_name)
         if self.upgrade_type == ORDER_UPGRADE_SPACE_TYPE:
             self.planet_to_upgrade.space_colonies.append(colony)
         elif self.upgrade_type == ORDER_UPGRADE_GROUND_TYPE:
             self.planet_to_upgrade.ground_colonies.append(colony)
 
         # Colony added. We're done here.
-        galaxy.update()
+        galaxy.income_changed(self.planet_to_upgrade)
+        self.planet_to_upgrade.system().touch()
         return ORDER_NEXT_TURN
 
     def as_dict(self):
@@ -422,6 +457,7 @@ class BuildFleetOrder(Order):
     at_planet = None
     in_fleet = 0
     ships = 0
+    phases = (PHASE_BUILDS,)
 
     def __init__(self, orderer, at_planet, in_fleet, ships):
         """
@@ -437,7 +473,7 @@ class BuildFleetOrder(Order):
         assert at_planet is not None
         assert ships >= 1
         assert 0 <= in_fleet <= 2
-        assert at_planet.owner == orderer
+        assert at_planet.owned_by(orderer)
 
         # Assign data.
         self.orderer = orderer
@@ -445,24 +481,20 @@ class BuildFleetOrder(Order):
         self.in_fleet = in_fleet
         self.ships = ships
 
-    def execute(self, galaxy):
+    def execute(self, galaxy, phase, turn):
         # Preconditions
         assert self.at_planet in galaxy
         assert 0 <= self.in_fleet <= 2
 
-        if self._phase != 3:
-            self._phase += 1
-            return ORDER_NOT_FINISHED
+        # See if we have enough money to build the fleet
+        cost = self.at_planet.starship_build_cost(self.ships)
+        if cost > self.orderer.money:
+            return ORDER_FAILED
         else:
-            # See if we have enough money to build the fleet
-            cost = self.at_planet.starship_build_cost(self.ships)
-            if cost > self.orderer.money:
-                return ORDER_FAILED
-            else:
-                self.orderer.money -= cost
-                self.at_planet.fleets[self.in_fleet] += ships
-                db.session.commit()
-                return ORDER_NEXT_TURN
+            self.orderer.money -= cost
+            self.at_planet.fleets[self.in_fleet] += self.ships
+            self.at_planet.system().touch()
+            return ORDER_NEXT_TURN
 
     def as_dict(self):
         return {
@@ -510,6 +542,48 @@ def build_fleet_order_from_dict(data, game, user=None):
 
 
 
+def orders_as_dict(orders):
+    """
+    Returns a `dict` that maps each `Order.dict_index` to the `list` of the
+    `dict`s of the `Order`s in `orders` with that index.
+    """
+
+    output = {
+        'move' : [],
+        'hyperspace' : [],
+        'build' : [],
+        'colonize' : []
+    }
+    for order in orders:
+        if not isinstance(order, Order):
+            raise Exception("Something went wrong - nonorder item in list")
+        to_put = order.as_dict()
+        output[order.dict_index()].append(to_put)
+    return output
+
+
+
+def orders_from_dict(data, game):
+    """
+    The inverse of `orders_as_dict`: parses the `Order`s of `game` out of
+    `data`.
+    """
+
+    parsers = [
+        ('move', move_order_from_dict),
+        ('hyperspace', hyperspace_order_from_dict),
+        ('build', build_fleet_order_from_dict),
+        ('colonize', upgrade_planet_order_from_dict)
+    ]
+
+    orders = []
+    for (index, parser) in parsers:
+        for order in data.get(index, []):
+            orders.append(parser(order, game))
+    return orders
+
+
+
 @app.route('/game/submitorders', methods=['POST'])
 def web_submit_orders():
     # Get the current user.
@@ -519,12 +593,15 @@ def web_submit_orders():
         return "Not logged in", 400
 
     # Get the game from the input.
+    import game as game_lib
     game_id = int(request.form['game'])
     game = game_lib.find(unique=game_id)
     if game is None:
         return "No game with that ID exists", 400
     elif user not in game:
         return "You are not in this game", 400
+    elif game.turn_status() == game_lib.TURN_RESOLVING:
+        return "This turn is being resolved", 400
 
     # Parse the JSON in the order fields
     move_order_dicts = json.loads(request.form['move'])
@@ -548,7 +625,20 @@ def web_submit_orders():
     orders.extend(ftl)
     orders.extend(colonize)
     orders.extend(build)
-    game.queue_orders(orders)
-
-    # We're done here.
-    return "Copy, Commander. Orders recieved.", 200
+    try:
+        resolving = game.queue_orders(orders, game.player_for_user(user))
+    except game_lib.TurnResolvingError:
+        return "This turn is being resolved", 400
+
+    # We're done here. If ours were the last orders, the turn is now being
+    # resolved in the background; the client asks "/game/turn/status" when it
+    # is done.
+    if resolving:
+        status = game_lib.TURN_RESOLVING
+    else:
+        status = game_lib.TURN_WAITING
+    return json.dumps({
+        "message" : "Copy, Commander. Orders recieved.",
+        "status" : status,
+        "turn" : game.on_turn
+    }), 200
@@ -5,13 +5,17 @@ other.py
 Defines miscelaneous constants and functions.
 """
 
-def coinflip(p):
+def coinflip(p, rng=None):
     """
     Simulates a biased coin that yields heads with probability `p` (`float`).
+    The coin is flipped with `rng` (a `random.Random`) if one is given, or
+    with the `random` module otherwise.
     """
     
     import random
-    return random.random() <= p
+    if rng is None:
+        rng = random
+    return rng.random() <= p
 
 
 
@@ -41,11 +45,18 @@ def irange(n, k):
 
 
 
-def rand_float_range(a, b):
+def rand_float_range(a, b, rng=None):
+    """
+    Returns a random `float` between `a` and `b`, drawn from `rng` (a
+    `random.Random`) if one is given, or from the `random` module otherwise.
+    """
+
     import random
+    if rng is None:
+        rng = random
 
     d = b - a
-    dice = random.random()
+    dice = rng.random()
     result = d * dice
     result += a
     return result
@@ -13,6 +13,7 @@ colonies on the surface.
 """
 
 # Import python modules
+from array import array
 import json
 import random
 
@@ -27,6 +28,8 @@ HABITABLE_PLANET_MAX_SIZE = 2.50
 GAS_PLANET_MIN_SIZE = 7.00
 GAS_PLANET_MAX_SIZE = 20.00
 
+DEFAULT_TEXTURE = "earth.jpg"
+
 class Planet(object):
     """
     `Planet`s are objects contained in `System`s which `Player`s fight to
@@ -59,11 +62,13 @@ class Planet(object):
             The `Colony`s that are placed on the surface of this `Planet`. Only
             rocky and habitable planets can have such colonies.
 
-        owner (Player or None): The `Player` that last had a fleet above this
-            `Planet` (if there is such a `Player`).
+        owner_code (int or None): The faction code of the `Player` that last
+            had a fleet above this `Planet` (if there is such a `Player`).
+            `Planet`s keep faction codes rather than `Player`s so that a
+            `Galaxy` can be shared by requests (see "galaxycache.py").
 
-        fleets (list of int): The value `fleets[a]` is the number of starships
-            in fleet number `a`.
+        fleets (array of int): The value `fleets[a]` is the number of
+            starships in fleet number `a`. Always holds three fleets.
 
         orbit_distance (float): The distance at which this planet orbits its
             parent. Measured in astronomical units (AU).
@@ -75,7 +80,8 @@ class Planet(object):
             Earth's radius.
 
         texture (str):
-            The texture to be used for the 3D rendering of this planet.
+            The texture to be used for the 3D rendering of this planet. Passed
+            through `intern_string`, since many planets share each texture.
 
         rings (str or None): If the planet has rings (like Saturn), then
             `rings` is the filename of their texture. It is set to `None` if
@@ -86,32 +92,41 @@ class Planet(object):
 
         _since_conquered (int): The number of turns since this `Planet` was
             conquered by another `Player`.
-    """
-
-    unique = 0
-
-    name = ""
-    moons = []
-    parent = None
 
-    space_colonies = []
-    ground_colonies = []
-
-    owner = None
-    fleets = [0, 0, 0]
-
-    # Astronomy attributes.
-    orbit_distance = 0.00
-    orbit_period = 0.00
-    size = 1.00
-    texture = "earth.jpg"
-    rings = None
+    Notes:
+        - Galaxies can hold tens of thousands of `Planet`s, so `Planet`s keep
+          their attributes in slots instead of a `dict`. Every attribute is
+          set in the constructor.
+    """
 
-    _next_assign = 0
-    _since_conquered = -1
+    __slots__ = (
+        'unique',
+        'name',
+        'moons',
+        'parent',
+        'space_colonies',
+        'ground_colonies',
+        'owner_code',
+        'fleets',
+
+        # Astronomy attributes.
+        'orbit_distance',
+        'orbit_period',
+        'size',
+        'texture',
+        'rings',
+
+        '_next_assign',
+        '_since_conquered'
+    )
+
+    # The most colonies a `Planet` of this class can have on its surface and
+    # in orbit.
+    MAX_GROUND_COLONIES = 0
+    MAX_SPACE_COLONIES = 4
 
     def __init__(self, name=None, orbit_distance=None, min_size=0.0,
-                 max_size=0.0):
+                 max_size=0.0, rng=None):
         """
         This is the constructor for the `Planet` class. Since `Planet` is an
         abstract class, this constructor should never be called unless called
@@ -126,13 +141,33 @@ class Planet(object):
             min_size (float);
 
             max_size (float):
+
+            rng (Random):
+                Where the size and orbital period are drawn from. The `random`
+                module by default.
         """
 
+        # Declare global variables.
+        global DEFAULT_TEXTURE
+
         # Preconditions.
         assert min_size != 0.0
         assert max_size != 0.0
         assert min_size < max_size
 
+        # Every `Planet` gets its own containers.
+        self.unique = 0
+        self.moons = []
+        self.parent = None
+        self.space_colonies = []
+        self.ground_colonies = []
+        self.owner_code = None
+        self.fleets = array('i', [0, 0, 0])
+        self.texture = DEFAULT_TEXTURE
+        self.rings = None
+        self._next_assign = 0
+        self._since_conquered = -1
+
         # Assign name.
         if name is not None:
             self.name = name
@@ -140,12 +175,13 @@ class Planet(object):
             self.name = ""
 
         # Assign size.
-        self.size = rand_float_range(min_size, max_size)
+        self.size = rand_float_range(min_size, max_size, rng=rng)
 
         # If we are given an orbit distance, then calculate an orbital period
         if orbit_distance is not None:
             self.orbit_distance = orbit_distance
-            self.orbit_period = orbit_distance * rand_float_range(0.5, 1.5)
+            self.orbit_period = orbit_distance * rand_float_range(
+                0.5, 1.5, rng=rng)
         else:
             self.orbit_distance = -1
             self.orbit_period = -1
@@ -153,6 +189,13 @@ class Planet(object):
     def __contains__(self, other):
         return other in self.moons
 
+    def owned_by(self, player):
+        """
+        Returns `True` if and only if `player` owns this `Planet`.
+        """
+
+        return player is not None and self.owner_code == player.faction_code
+
     def as_dict(self):
         """
         Returns:
@@ -161,10 +204,11 @@ class Planet(object):
             `Player`.
         """
 
-        if self.owner is None:
+        if self.owner_code is None:
             owner_str = ""
         else:
-            owner_str = self.owner.faction_shortname()
+            import player as player_lib
+            owner_str = player_lib.faction_shortname(self.owner_code)
 
         parent_str = "" # TODO
 
@@ -176,7 +220,7 @@ class Planet(object):
             "space_colonies" : [col.as_dict() for col in self.space_colonies],
             "ground_colonies" : [col.as_dict() for col in self.ground_colonies],
             "owner" : owner_str,
-            "fleets" : self.fleets,
+            "fleets" : list(self.fleets),
             "orbit_distance" : self.orbit_distance,
             "orbit_period" : self.orbit_period,
             "size" : self.size,
@@ -184,6 +228,32 @@ class Planet(object):
             "rings" : self.rings
         }
 
+    def as_record(self):
+        """
+        Returns:
+            This `Planet`, except for its `owner_code` and `parent`, as a
+            `tuple` of plain values. Records are much smaller and quicker to
+            pickle than the `Planet`s themselves; `planet_from_record` turns
+            one back into a `Planet`.
+        """
+
+        return (
+            self.__class__.__name__,
+            self.unique,
+            self.name,
+            [moon.as_record() for moon in self.moons],
+            [colony.name for colony in self.space_colonies],
+            [colony.name for colony in self.ground_colonies],
+            self.fleets.tolist(),
+            self.orbit_distance,
+            self.orbit_period,
+            self.size,
+            self.texture,
+            self.rings,
+            self._next_assign,
+            self._since_conquered
+        )
+
     def economic_output(self):
         """
         Returns:
@@ -228,6 +298,7 @@ class Planet(object):
         assert 0 <= fleet_number <= 2
         fleet_size = self.fleets[fleet_number]
         self.fleets[fleet_number] = 0
+        self.system().touch()
         return fleet_size
 
     def receive_fleet(self, incoming_fleet_size, from_player):
@@ -253,45 +324,90 @@ class Planet(object):
         """
 
         system = self.system()
+        system.touch()
+        if self.resolve_arrivals({from_player : [incoming_fleet_size]}):
+            system.galaxy.income_changed(self)
+            system.discover(from_player)
+
+    def resolve_arrivals(self, incoming):
+        """
+        Resolves every fleet that arrives at this `Planet` during one phase at
+        once, so that the outcome does not depend on the order they arrive
+        in.
+
+        The owner's arriving fleets join the ones already here. Every other
+        `Player` attacks with all of its arriving ships. The side with the
+        most ships (the owner's fleets here included) wins and keeps as many
+        ships as it had more than the runner-up. The owner keeps the `Planet`
+        on a tie; if other `Player`s tie for the most ships, every side is
+        destroyed and the `Planet` does not change hands.
+
+        This method does not touch the `System` or tell anyone about a change
+        of owner; see `receive_fleet` and `ArrivalBatch`.
 
-        # Fleet sent to unoccupied planet
-        if self.owner is None:
-            self.fleets[0] = incoming_fleet_size
-            self._next_assign = 1
-            self.owner = from_player
-            system.discover()
-
-        # Player sends fleet to owned planet
-        elif from_player == self.owner:
-            # Look for an empty fleet slot. If there is none, combine it with
-            # an existing fleet.
-            for a in xrange(0,3):
+        Args:
+            incoming (dict):
+                Maps each `Player` with fleets arriving at this `Planet` to a
+                `list` of the sizes of those fleets.
+
+        Returns:
+            `True` if and only if this `Planet` changed hands.
+        """
+
+        owner = self.owner_code
+        reinforcements = []
+        for (player, sizes) in incoming.items():
+            if player.faction_code == owner:
+                reinforcements.extend(sizes)
+
+        # Player sends fleets to owned planet. Look for an empty fleet slot
+        # for each. If there is none, combine it with an existing fleet.
+        for fleet_size in sorted(reinforcements, reverse=True):
+            for a in xrange(0, 3):
                 if self.fleets[a] == 0:
-                    self.fleets[a] = incoming_fleet_size
+                    self.fleets[a] = fleet_size
                     break
             else:
-                self.fleets[self._next_assign] += incoming_fleet_size
+                self.fleets[self._next_assign] += fleet_size
                 self._next_assign = (self._next_assign + 1) % 3
 
-        # Player sends fleet to planet owned by other player -- engage in
-        # combat.
-        else:
-            for a in xrange(0,3):
-                my_fleet = self.fleets[a]
-                if my_fleet >= incoming_fleet_size:
-                    self.fleets[a] -= incoming_fleet_size
-                    break
-                else:
-                    incoming_fleet_size -= self.fleets[a]
-                    self.fleets[a] = 0
-            else:
-                # If we reach this point, the invading player has won. Change
-                # ownership.
-                assert incoming_fleet_size > 0
-                self.fleets = [incoming_fleet_size, 0, 0]
-                self._next_assign = 1
-                self.owner = from_player
-                system.discover()
+        # Players send fleets to planet owned by another player (or no one)
+        # -- engage in combat.
+        sides = [(sum(sizes), player) for (player, sizes) in incoming.items()
+                 if player.faction_code != owner]
+        if len(sides) == 0:
+            return False
+        if owner is not None:
+            sides.append((self.strength(), None))
+
+        strengths = sorted([side[0] for side in sides], reverse=True)
+        most = strengths[0]
+        remaining = most - (strengths[1] if len(strengths) > 1 else 0)
+        winners = [player for (ships, player) in sides if ships == most]
+
+        # The owner (`None` among the winners) holds the planet. Its losses
+        # come out of its fleets in order.
+        if owner is not None and None in winners:
+            losses = self.strength() - remaining
+            for a in xrange(0, 3):
+                lost = min(losses, self.fleets[a])
+                self.fleets[a] -= lost
+                losses -= lost
+            return False
+
+        # Every defending fleet is destroyed.
+        for a in xrange(0, 3):
+            self.fleets[a] = 0
+        if len(winners) > 1:
+            return False
+
+        # If we reach this point, an invading player has won. Change
+        # ownership.
+        assert remaining > 0
+        self.fleets[0] = remaining
+        self._next_assign = 1
+        self.owner_code = winners[0].faction_code
+        return True
 
     def starship_build_cost(self, number):
         """
@@ -322,7 +438,8 @@ class Planet(object):
             The `System` that contains this `Planet`.
         """
 
-        if isinstance(self.parent, System):
+        import system as system_lib
+        if isinstance(self.parent, system_lib.System):
             return self.parent
         elif isinstance(self.parent, Planet):
             return self.parent.system()
@@ -334,7 +451,7 @@ class Planet(object):
             of this planet at any point.
         """
 
-        return 0
+        return self.MAX_GROUND_COLONIES
 
     def max_space_colonies(self):
         """
@@ -342,8 +459,8 @@ class Planet(object):
             `int` -- the maximum number of colonies that can be in orbit of
             this planet at any point.
         """
-        
-        return 4
+
+        return self.MAX_SPACE_COLONIES
 
     def space_upgrade_cost(self):
         """
@@ -377,7 +494,12 @@ class GasPlanet(Planet):
     colonies (`ground_colonies`).
     """
 
-    def __init__(self, name=None, orbit_distance=None):
+    __slots__ = ()
+
+    MAX_GROUND_COLONIES = 0
+    MAX_SPACE_COLONIES = 4
+
+    def __init__(self, name=None, orbit_distance=None, rng=None):
         # Declare global variables.
         global GAS_PLANET_MAX_SIZE
         global GAS_PLANET_MIN_SIZE
@@ -386,27 +508,10 @@ class GasPlanet(Planet):
             name=name,
             orbit_distance=orbit_distance,
             min_size = GAS_PLANET_MIN_SIZE,
-            max_size = GAS_PLANET_MAX_SIZE
+            max_size = GAS_PLANET_MAX_SIZE,
+            rng=rng
         )
 
-    def max_ground_colonies(self):
-        """
-        Returns:
-            `int` -- the maximum number of colonies that can be on the ground
-            of this planet at any point.
-        """
-
-        return 0
-
-    def max_space_colonies(self):
-        """
-        Returns:
-            `int` -- the maximum number of colonies that can be in orbit of
-            this planet at any point.
-        """
-        
-        return 4
-
     def space_upgrade_cost(self):
         num_colonies = len(self.space_colonies)
         return 1000 * (1 + num_colonies)
@@ -428,13 +533,18 @@ class RockyPlanet(Planet):
     Luna.
     """
 
+    __slots__ = ()
+
+    MAX_GROUND_COLONIES = 4
+    MAX_SPACE_COLONIES = 4
+
     # Declare global variables.
     global ROCKY_PLANET_MAX_SIZE
     global ROCKY_PLANET_MIN_SIZE
 
     def __init__(self, name=None, orbit_distance=None,
                  min_size=ROCKY_PLANET_MIN_SIZE,
-                 max_size=ROCKY_PLANET_MAX_SIZE):
+                 max_size=ROCKY_PLANET_MAX_SIZE, rng=None):
         """
         Keyword Args:
             name (str):
@@ -453,32 +563,20 @@ class RockyPlanet(Planet):
                 The maxumum size that this planet can be. This arg should be
                 considered *private* -- it may only be passed in by members of
                 this module.
+
+            rng (Random):
+                Where the size and orbital period are drawn from. The `random`
+                module by default.
         """
 
         super(RockyPlanet, self).__init__(
             name=name,
             orbit_distance=orbit_distance,
             min_size=min_size,
-            max_size=max_size
+            max_size=max_size,
+            rng=rng
         )
 
-    def max_ground_colonies(self):
-        """
-        Returns:
-            `int` -- the maximum number of colonies that can be on the ground
-            of this planet at any point.
-        """
-        return 4
-
-    def max_space_colonies(self):
-        """
-        Returns:
-            `int` -- the maximum number of colonies that can be in orbit of
-            this planet at any point.
-        """
-        
-        return 4
-
     def space_upgrade_cost(self):
         num_colonies = len(self.space_colonies)
         return 1000 * (1 + num_colonies)
@@ -499,7 +597,12 @@ class HabitablePlanet(RockyPlanet):
     to settle colonies on `HabitablePlanet`s.
     """
 
-    def __init__(self, name=None, orbit_distance=None):
+    __slots__ = ()
+
+    MAX_GROUND_COLONIES = 8
+    MAX_SPACE_COLONIES = 4
+
+    def __init__(self, name=None, orbit_distance=None, rng=None):
         # Declare global variables.
         global HABITABLE_PLANET_MAX_SIZE
         global HABITABLE_PLANET_MIN_SIZE
@@ -508,26 +611,10 @@ class HabitablePlanet(RockyPlanet):
             name=name,
             orbit_distance=orbit_distance,
             min_size = HABITABLE_PLANET_MIN_SIZE,
-            max_size = HABITABLE_PLANET_MAX_SIZE
+            max_size = HABITABLE_PLANET_MAX_SIZE,
+            rng=rng
         )
 
-    def max_ground_colonies(self):
-        """
-        Returns:
-            `int` -- the maximum number of colonies that can be on the ground
-            of this planet at any point.
-        """
-        return 8
-
-    def max_space_colonies(self):
-        """
-        Returns:
-            `int` -- the maximum number of colonies that can be in orbit of
-            this planet at any point.
-        """
-
-        return 4
-
     def space_upgrade_cost(self):
         num_colonies = len(self.space_colonies)
         return 750 * (1 + num_colonies)
@@ -539,7 +626,7 @@ class HabitablePlanet(RockyPlanet):
 
 
 class Colony(object):
-    name = ""
+    __slots__ = ('name',)
 
     def __init__(self, name):
         self.name = name
@@ -584,7 +671,7 @@ def planet_from_dict(data, game):
         ground = [colony_from_dict(col) for col in data['ground_colonies']]
     else:
         ground = []
-    fleets = data['fleets']
+    fleets = array('i', data['fleets'])
 
     # Get astronomy data
     orbit_distance = float(data['orbit_distance'])
@@ -622,16 +709,88 @@ def planet_from_dict(data, game):
     planet.orbit_distance = orbit_distance
     planet.orbit_period = orbit_period
     planet.size = size
-    planet.texture = texture
-    planet.rings = rings
+    planet.texture = intern_string(texture)
+    planet.rings = intern_string(rings)
 
-    # Get the player's owner.
-    planet.owner = game.player_for_faction(data['owner'])
+    # Get the faction code of the owner.
+    owner = game.player_for_faction(data['owner'])
+    planet.owner_code = None if owner is None else owner.faction_code
 
     # We're done here.
     return planet
 
 
 
+def planet_from_record(record):
+    """
+    Creates a `Planet` from what `Planet.as_record` returned, without drawing
+    any random numbers.
+
+    Args:
+        record (tuple):
+            The record to read.
+
+    Returns:
+        `Planet` -- a planet whose attributes match the record. It has no
+        owner and no `parent`.
+    """
+
+    (type_name, unique, name, moons, space, ground, fleets, orbit_distance,
+     orbit_period, size, texture, rings, next_assign, since_conquered) = record
+
+    # Determine the type of planet to create.
+    if type_name == 'GasPlanet':
+        planet_type = GasPlanet
+    elif type_name == 'RockyPlanet':
+        planet_type = RockyPlanet
+    elif type_name == 'HabitablePlanet':
+        planet_type = HabitablePlanet
+    else:
+        raise Exception("Unknown planet type {0}".format(type_name))
+
+    planet = planet_type.__new__(planet_type)
+    planet.unique = unique
+    planet.name = name
+    planet.moons = [planet_from_record(moon) for moon in moons]
+    for moon in planet.moons:
+        moon.parent = planet
+    planet.parent = None
+    planet.space_colonies = [Colony(colony) for colony in space]
+    planet.ground_colonies = [Colony(colony) for colony in ground]
+    planet.owner_code = None
+    planet.fleets = array('i', fleets)
+    planet.orbit_distance = orbit_distance
+    planet.orbit_period = orbit_period
+    planet.size = size
+    planet.texture = intern_string(texture)
+    planet.rings = intern_string(rings)
+    planet._next_assign = next_assign
+    planet._since_conquered = since_conquered
+    return planet
+
+
+
 def colony_from_dict(data):
     return Colony(data['name'])
+
+
+
+def intern_string(string):
+    """
+    Args:
+        string (str or None):
+            A string that many objects hold copies of, such as a texture's
+            filename.
+
+    Returns:
+        The one shared copy of `string`, so that each distinct string is only
+        held in memory once. Returns `string` itself if it cannot be interned
+        (`None` or non-ASCII text).
+    """
+
+    if string is None:
+        return None
+    try:
+        return intern(str(string))
+    except UnicodeEncodeError:
+        return string
@@ -0,0 +1,209 @@
+"""
+InterstellarAge
+planettable.py
+
+This module defines the `PlanetTable` class. It keeps the numbers that the end
+of a turn needs about every `Planet` in a `Galaxy` (its owner, its colony
+counts and capacities and its fleets) in NumPy columns with one row per
+`Planet`. Income and fleet totals are then sums over columns instead of a walk
+over every `Planet` object.
+
+The `Planet` objects stay the real state of the game. A `PlanetTable` copies
+their numbers and is told by `Galaxy.touch` which `System`s changed; the rows
+of those `System`s are copied again the next time the table is read.
+
+NumPy is optional. Without it, `Galaxy` walks its `Planet`s instead.
+"""
+
+# NumPy holds the columns. This module is only used when it is installed.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Define constants.
+
+# Stored in the owner column for `Planet`s that have no owner.
+NO_OWNER = -1
+
+class PlanetTable(object):
+    """
+    Every attribute below is a NumPy array with one row per `Planet`. Rows are
+    sorted by `Planet.unique`.
+
+    Attributes:
+        unique (array of int32):
+            The `unique` of each `Planet`.
+
+        system (array of int32):
+            The `unique` of the `System` each `Planet` is in.
+
+        owner (array of int16):
+            The faction code of the owner of each `Planet`, or `NO_OWNER`.
+
+        ground_colonies (array of int16):
+            The number of `Colony`s on the surface of each `Planet`.
+
+        space_colonies (array of int16):
+            The number of `Colony`s in orbit of each `Planet`.
+
+        max_ground_colonies (array of int16):
+            `Planet.max_ground_colonies` of each `Planet`.
+
+        max_space_colonies (array of int16):
+            `Planet.max_space_colonies` of each `Planet`.
+
+        fleets (array of int32):
+            `Planet.fleets` of each `Planet`, one column per fleet.
+
+    Private Attributes:
+        _dirty (dict):
+            Maps the `unique` of every `System` that changed since its rows
+            were last copied to that `System`.
+    """
+
+    def __init__(self, count):
+        """
+        Args:
+            count (int):
+                The number of rows (`Planet`s). Every row starts out as zeros
+                with no owner.
+        """
+
+        self.unique = numpy.zeros(count, dtype=numpy.int32)
+        self.system = numpy.zeros(count, dtype=numpy.int32)
+        self.owner = numpy.empty(count, dtype=numpy.int16)
+        self.owner.fill(NO_OWNER)
+        self.ground_colonies = numpy.zeros(count, dtype=numpy.int16)
+        self.space_colonies = numpy.zeros(count, dtype=numpy.int16)
+        self.max_ground_colonies = numpy.zeros(count, dtype=numpy.int16)
+        self.max_space_colonies = numpy.zeros(count, dtype=numpy.int16)
+        self.fleets = numpy.zeros((count, 3), dtype=numpy.int32)
+        self._dirty = {}
+
+    def __len__(self):
+        return len(self.unique)
+
+    def mark(self, system):
+        """
+        Notes that `system` (or one of its `Planet`s) changed, so its rows
+        have to be copied again before the table is next read.
+        """
+
+        self._dirty[system.unique] = system
+
+    def refresh(self):
+        """
+        Copies the rows of every `System` that changed since it was last
+        copied.
+        """
+
+        if not self._dirty:
+            return
+
+        planets = []
+        systems = []
+        for system in self._dirty.values():
+            for planet in system.flat_planets():
+                planets.append(planet)
+                systems.append(system.unique)
+        self._dirty = {}
+
+        uniques = numpy.array([p.unique for p in planets], dtype=numpy.int32)
+        rows = numpy.searchsorted(self.unique, uniques)
+        self.set_rows(rows, planets, systems)
+
+    def set_rows(self, rows, planets, systems):
+        """
+        Copies the numbers of `planets` into the table.
+
+        Args:
+            rows (array of int):
+                The row of each `Planet`.
+
+            planets (list of Planet):
+                The `Planet`s to copy.
+
+            systems (list of int):
+                The `unique` of the `System` of each `Planet`.
+        """
+
+        global NO_OWNER
+
+        owner = lambda p: NO_OWNER if p.owner_code is None else p.owner_code
+
+        self.unique[rows] = [p.unique for p in planets]
+        self.system[rows] = systems
+        self.owner[rows] = [owner(p) for p in planets]
+        self.ground_colonies[rows] = [len(p.ground_colonies) for p in planets]
+        self.space_colonies[rows] = [len(p.space_colonies) for p in planets]
+        self.max_ground_colonies[rows] = [
+            p.max_ground_colonies() for p in planets]
+        self.max_space_colonies[rows] = [
+            p.max_space_colonies() for p in planets]
+        self.fleets[rows] = [list(p.fleets) for p in planets]
+
+    def economic_output(self):
+        """
+        Returns:
+            An array with `Planet.economic_output` of every `Planet`.
+        """
+
+        self.refresh()
+        ground = self.ground_colonies * self.max_ground_colonies
+        space = self.space_colonies * self.max_space_colonies
+        return ground.astype(numpy.int64) + space
+
+    def income_by_faction(self):
+        """
+        Returns:
+            A `dict` that maps faction codes to the money that the `Planet`s
+            owned by that faction make this turn.
+        """
+
+        return self._sum_by_faction(self.economic_output())
+
+    def fleets_by_faction(self):
+        """
+        Returns:
+            A `dict` that maps faction codes to the number of ships in the
+            fleets above the `Planet`s owned by that faction.
+        """
+
+        self.refresh()
+        return self._sum_by_faction(self.fleets.sum(axis=1))
+
+    def _sum_by_faction(self, values):
+        """
+        PRIVATE METHOD
+
+        Returns a `dict` that maps faction codes to the sum of `values` (an
+        array with one value per row) over the rows owned by that faction.
+        """
+
+        global NO_OWNER
+
+        owned = self.owner != NO_OWNER
+        sums = numpy.bincount(self.owner[owned], weights=values[owned])
+        return dict((code, int(total)) for (code, total) in enumerate(sums))
+
+
+
+def table_for_systems(systems):
+    """
+    Args:
+        systems (list of System):
+            The `System`s whose `Planet`s go in the table.
+
+    Returns:
+        A `PlanetTable` of every `Planet` in `systems`.
+    """
+
+    pairs = [(p, s.unique) for s in systems for p in s.flat_planets()]
+    pairs.sort(key=lambda pair: pair[0].unique)
+
+    table = PlanetTable(len(pairs))
+    planets = [pair[0] for pair in pairs]
+    systems = [pair[1] for pair in pairs]
+    table.set_rows(numpy.arange(len(pairs)), planets, systems)
+    return table
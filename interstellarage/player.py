@@ -111,21 +111,7 @@ class Player(db.Model):
         Player is playing.
         """
 
-        global FACTION_CODE_ISCA
-        global FACTION_CODE_GALAXYCORP
-        global FACTION_CODE_FSR
-        global FACTION_CODE_PRIVATEER
-
-        if self.faction_code == FACTION_CODE_ISCA:
-            return "ISCA"
-        elif self.faction_code == FACTION_CODE_GALAXYCORP:
-            return "GalaxyCorp"
-        elif self.faction_code == FACTION_CODE_PRIVATEER:
-            return "Mercs"
-        elif self.faction_code == FACTION_CODE_FSR:
-            return "FSR"
-        else:
-            return None
+        return faction_shortname(self.faction_code)
 
     def faction_name(self):
         """
@@ -156,7 +142,30 @@ class Player(db.Model):
 
         global PLAYER_START_MONEY
         self.money = PLAYER_START_MONEY
-        db.session.commit()
+
+
+
+def faction_shortname(faction_code):
+    """
+    Returns a `str` representing the short name for the faction with the
+    given faction code, or `None` if there is no such faction.
+    """
+
+    global FACTION_CODE_ISCA
+    global FACTION_CODE_GALAXYCORP
+    global FACTION_CODE_FSR
+    global FACTION_CODE_PRIVATEER
+
+    if faction_code == FACTION_CODE_ISCA:
+        return "ISCA"
+    elif faction_code == FACTION_CODE_GALAXYCORP:
+        return "GalaxyCorp"
+    elif faction_code == FACTION_CODE_PRIVATEER:
+        return "Mercs"
+    elif faction_code == FACTION_CODE_FSR:
+        return "FSR"
+    else:
+        return None
 
 
 
@@ -0,0 +1,273 @@
+"""
+InterstellarAge
+pubsub.py
+
+Clients used to find out about new turns by asking the server every few
+seconds, and every ask loaded the `Game` and looked through the `Galaxy`.
+This module lets the server push instead: `Game`s publish events (orders
+submitted, turn resolved) to a `Broker`, and every client that is watching a
+`Game` holds a `Subscription` to that `Game`'s events, which the
+"/game/events/<id>" page sends on as Server-Sent Events.
+
+A `Subscription` waits for events without a timeout, so a client that is
+watching but has nothing to hear about costs a blocked thread (or greenlet)
+and no CPU time. Keepalive events, which stop proxies from closing idle
+streams and let the server find out about clients that went away, are put in
+every `Subscription` by one thread for the whole `Broker`.
+
+The `Broker` only reaches subscribers in its own process. Turns resolved by
+a turn worker in another process ("python turnqueue.py", see "turnqueue.py")
+are not published. Clients that listen to the events still ask
+"/game/turn/status" every so often (see `TURN_STATUS_POLL_INTERVAL` in
+"static/js/game.js") and catch up when the turn has moved on.
+"""
+
+# Import python modules
+import Queue
+import threading
+import time
+
+# Define constants.
+
+# How often (in seconds) every subscription gets a keepalive event.
+PUBSUB_KEEPALIVE = 20
+
+# The most events that are held for a subscriber that is not keeping up. The
+# oldest events are dropped first.
+PUBSUB_MAX_PENDING = 100
+
+# Event kinds.
+EVENT_KEEPALIVE = "keepalive"
+EVENT_ORDERS = "orders"
+EVENT_TURN = "turn"
+
+class Subscription(object):
+    """
+    The events of one `Game` for one listener.
+
+    Attributes:
+        game_unique (int):
+            The unique of the `Game` whose events these are.
+
+    Private Attributes:
+        _broker (Broker):
+            The `Broker` this `Subscription` is registered with.
+
+        _queue (Queue):
+            Holds `(kind, data)` tuples of the events that have not been read.
+    """
+
+    def __init__(self, broker, game_unique):
+        self.game_unique = game_unique
+        self._broker = broker
+        self._queue = Queue.Queue(PUBSUB_MAX_PENDING)
+
+    def get(self):
+        """
+        Waits for the next event.
+
+        Returns:
+            A tuple `(kind, data)`: one of the `EVENT_*` kinds and the `dict`
+            that was published with it.
+        """
+
+        return self._queue.get()
+
+    def close(self):
+        """
+        Stops this `Subscription` from getting any more events.
+        """
+
+        self._broker.unsubscribe(self)
+
+    def _put(self, kind, data):
+        """
+        PRIVATE METHOD
+
+        Adds an event, dropping the oldest event if too many are waiting.
+        """
+
+        while True:
+            try:
+                self._queue.put_nowait((kind, data))
+                return
+            except Queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except Queue.Empty:
+                    pass
+
+
+
+class Broker(object):
+    """
+    Passes the events published for each `Game` to its `Subscription`s.
+
+    Private Attributes:
+        _subscriptions (dict):
+            Maps the unique of a `Game` to the `set` of its `Subscription`s.
+
+        _lock (Lock):
+            Held while `_subscriptions` is read or changed.
+
+        _keepalive_thread (Thread):
+            The thread that sends the keepalive events, once it is started.
+    """
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self._keepalive_thread = None
+
+    def subscribe(self, game_unique):
+        """
+        Returns:
+            A new `Subscription` to the events of the `Game` with the given
+            unique.
+        """
+
+        subscription = Subscription(self, game_unique)
+        with self._lock:
+            self._subscriptions.setdefault(game_unique, set()).add(
+                subscription)
+            if self._keepalive_thread is None:
+                self._keepalive_thread = threading.Thread(
+                    target=self._keepalive)
+                self._keepalive_thread.daemon = True
+                self._keepalive_thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Removes `subscription` from this `Broker`. Does nothing if it was
+        already removed.
+        """
+
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.game_unique)
+            if subscriptions is None:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.game_unique]
+
+    def publish(self, game_unique, kind, data):
+        """
+        Gives an event to every `Subscription` to the `Game` with the given
+        unique.
+
+        Args:
+            game_unique (int):
+                The unique of the `Game` the event is about.
+
+            kind (str):
+                One of the `EVENT_*` kinds.
+
+            data (dict):
+                What happened. Must not be changed once published; it is
+                shared by every `Subscription`.
+        """
+
+        if _dispatcher is None:
+            self._deliver(game_unique, kind, data)
+        else:
+            _dispatcher(self._deliver, game_unique, kind, data)
+
+    def _deliver(self, game_unique, kind, data):
+        """
+        PRIVATE METHOD
+
+        Puts an event in every `Subscription` to the `Game` with the given
+        unique. See `publish`.
+        """
+
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(game_unique, ()))
+        for subscription in subscriptions:
+            subscription._put(kind, data)
+
+    def subscriber_count(self, game_unique=None):
+        """
+        Returns:
+            The number of `Subscription`s to the `Game` with the given
+            unique, or to any `Game` if no unique is given.
+        """
+
+        with self._lock:
+            if game_unique is not None:
+                return len(self._subscriptions.get(game_unique, ()))
+            return sum(len(s) for s in self._subscriptions.itervalues())
+
+    def _keepalive(self):
+        """
+        PRIVATE METHOD
+
+        Runs in its own thread. Puts a keepalive event in every `Subscription`
+        every `PUBSUB_KEEPALIVE` seconds.
+        """
+
+        global EVENT_KEEPALIVE
+        global PUBSUB_KEEPALIVE
+
+        while True:
+            time.sleep(PUBSUB_KEEPALIVE)
+            with self._lock:
+                subscriptions = [s for game in self._subscriptions.values()
+                                 for s in game]
+            for subscription in subscriptions:
+                subscription._put(EVENT_KEEPALIVE, None)
+
+
+
+# Called as `_dispatcher(function, *args)` to deliver events, if set. See
+# `set_dispatcher`.
+_dispatcher = None
+
+def set_dispatcher(dispatcher):
+    """
+    Makes every `Broker` hand the delivery of each published event to
+    `dispatcher`. "serve.py" uses this so that events published on a real
+    thread (by a turn being resolved) are delivered by the gevent hub, the
+    only thread that can wake the greenlets waiting on `Subscription`s.
+
+    Args:
+        dispatcher (function):
+            Called with a function and its arguments; arranges for the
+            function to be called with the arguments.
+    """
+
+    global _dispatcher
+    _dispatcher = dispatcher
+
+
+
+# The broker used by the web pages.
+_broker = Broker()
+
+def subscribe(game_unique):
+    """
+    Returns a new `Subscription` to the events of a `Game` from the shared
+    `Broker`. See `Broker.subscribe`.
+    """
+
+    return _broker.subscribe(game_unique)
+
+
+
+def publish(game_unique, kind, data):
+    """
+    Publishes an event about a `Game` to the shared `Broker`. See
+    `Broker.publish`.
+    """
+
+    _broker.publish(game_unique, kind, data)
+
+
+
+def subscriber_count(game_unique=None):
+    """
+    Returns the number of subscriptions to the shared `Broker`. See
+    `Broker.subscriber_count`.
+    """
+
+    return _broker.subscriber_count(game_unique)
@@ -0,0 +1,398 @@
+"""
+InterstellarAge
+routes.py
+
+This module defines the `RoutePlanner` class, which plans the hyperspace
+routes of one faction's fleets.
+
+A fleet can always jump straight to a `System` it is sent to, which takes
+`System.hyperspace_jump_length` turns. It can also hop between the `System`s
+its faction has discovered, as long as no hop is longer than `ROUTE_MAX_HOP`
+grid spaces. Short hops take a turn each, so a chain of them through known
+space is often quicker than one long jump. Routes are found with A* over the
+graph of those hops.
+
+A `RoutePlanner` works the hop graph out once, along with the distances from
+a few landmark `System`s to every other `System` in it. The landmark
+distances make the A* search look at far fewer `System`s. Everything is made
+again once the faction discovers another `System` (see
+`DiscoveryMap.generation`).
+"""
+
+# Import python modules
+import heapq
+
+# Import our modules
+import system as system_lib
+
+# Define constants.
+
+# The farthest (in grid spaces) that a jump of any length goes for each turn it
+# takes. `System.hyperspace_jump_length` gives `max(1, d / s)` turns for a jump
+# of `d` grid spaces at `HYPERSPACE_SPEED` `s`, and
+# `d <= s * t + s - 1 <= (2 * s - 1) * t` for any `t >= 1` turns. Dividing a
+# distance by this gives a lower bound on the turns a route takes.
+ROUTE_DISTANCE_PER_TURN = 2 * system_lib.HYPERSPACE_SPEED - 1
+
+# The longest hop (in grid spaces) between two discovered systems. Hops this
+# short take a single turn.
+ROUTE_MAX_HOP = ROUTE_DISTANCE_PER_TURN
+
+# The number of landmark systems a `RoutePlanner` keeps distances from.
+ROUTE_LANDMARKS = 4
+
+class RoutePlanner(object):
+    """
+    Plans the routes of the fleets of one faction. Jump lengths do not depend
+    on the size of the fleet (see `System.hyperspace_jump_length`), so the
+    same planner serves every fleet of the faction.
+
+    Attributes:
+        faction_code (int):
+            The faction whose routes this planner plans.
+
+        generation (int):
+            The `DiscoveryMap.generation` of the faction when this planner was
+            made. Once the two differ, the planner is out of date.
+
+    Private Attributes:
+        _systems (list of System):
+            The `System`s the faction has discovered. Each one is a node of
+            the hop graph, numbered by its position in this `list`.
+
+        _node_for_unique (dict):
+            Maps the `unique` of every `System` in `_systems` to its node.
+
+        _neighbors (list of list):
+            For every node, a `list` of `(node, turns)` tuples: the nodes one
+            hop away and how many turns the hop takes.
+
+        _components (list of int):
+            For every node, the number of the connected part of the hop graph
+            it is in. There is no chain of hops between nodes in different
+            parts.
+
+        _landmarks (list of list):
+            For every landmark, the `list` of the turns it takes to hop from
+            the landmark to each node (`None` if there is no chain of hops).
+    """
+
+    def __init__(self, galaxy, player):
+        """
+        Args:
+            galaxy (Galaxy):
+                The `Galaxy` the routes are in.
+
+            player (Player):
+                A `Player` of the faction whose routes will be planned.
+        """
+
+        discovery = galaxy.discovery_map()
+        self.faction_code = player.faction_code
+        self.generation = discovery.generation(player.faction_code)
+
+        self._systems = galaxy.visible_systems(player)
+        self._node_for_unique = dict(
+            (system.unique, node) for (node, system) in
+            enumerate(self._systems))
+        self._neighbors = _hop_graph(self._systems)
+        self._components = _components(self._neighbors)
+        self._landmarks = [_distances(self._neighbors, node)
+                           for node in self._pick_landmarks()]
+
+    def route(self, from_system, to_system):
+        """
+        Args:
+            from_system (System):
+                Where the fleet departs from.
+
+            to_system (System):
+                Where the fleet is going.
+
+        Returns:
+            A tuple of `(turns, systems)`. `systems` is the `list` of the
+            `System`s the fleet stops at, from `from_system` to `to_system`,
+            and `turns` is how many turns the trip takes. If jumping straight
+            to `to_system` is quickest, `systems` is just those two.
+        """
+
+        direct = from_system.hyperspace_jump_length(to_system)
+        source = self._node_for_unique.get(from_system.unique)
+        target = self._node_for_unique.get(to_system.unique)
+        if source is None or target is None or source == target:
+            return (direct, [from_system, to_system])
+        if self._components[source] != self._components[target]:
+            return (direct, [from_system, to_system])
+
+        found = self._search(source, target, direct)
+        if found is None:
+            return (direct, [from_system, to_system])
+        (turns, nodes) = found
+        return (turns, [self._systems[node] for node in nodes])
+
+    def eta(self, from_system, to_system):
+        """
+        Returns:
+            The number of turns the quickest route from `from_system` to
+            `to_system` takes.
+        """
+
+        return self.route(from_system, to_system)[0]
+
+    def etas(self, from_system, to_systems):
+        """
+        Works out the ETAs to many `System`s at once. This costs about as much
+        as a single call to `eta`, since the distances to every destination
+        come out of the same search.
+
+        Args:
+            from_system (System):
+                Where the fleet departs from.
+
+            to_systems (list of System):
+                The destinations.
+
+        Returns:
+            A `list` with the number of turns the quickest route to each
+            `System` in `to_systems` takes.
+        """
+
+        directs = [from_system.hyperspace_jump_length(system)
+                   for system in to_systems]
+        source = self._node_for_unique.get(from_system.unique)
+        if source is None:
+            return directs
+
+        # Only destinations in the same part of the hop graph can be hopped
+        # to. The search stops once it is past the slowest direct jump.
+        targets = set()
+        for system in to_systems:
+            node = self._node_for_unique.get(system.unique)
+            if node is not None and \
+               self._components[node] == self._components[source]:
+                targets.add(node)
+        if not targets:
+            return directs
+        hops = _distances(self._neighbors, source, targets=targets,
+                          limit=max(directs))
+
+        to_return = []
+        for (system, direct) in zip(to_systems, directs):
+            node = self._node_for_unique.get(system.unique)
+            turns = hops.get(node)
+            if turns is None or node == source or direct <= turns:
+                to_return.append(direct)
+            else:
+                to_return.append(turns)
+        return to_return
+
+    def _search(self, source, target, limit):
+        """
+        PRIVATE METHOD
+
+        A* search of the hop graph from node `source` to node `target`.
+
+        Returns:
+            A tuple of `(turns, nodes)` for the quickest chain of hops, or
+            `None` if no chain takes fewer than `limit` turns.
+        """
+
+        target_system = self._systems[target]
+        h = lambda node: self._heuristic(node, target, target_system)
+
+        best = {source: 0}
+        came_from = {}
+        frontier = [(h(source), 0, source)]
+        while frontier:
+            (estimate, turns, node) = heapq.heappop(frontier)
+            if estimate >= limit:
+                return None
+            if node == target:
+                return (turns, _path(came_from, source, target))
+            if turns > best[node]:
+                continue
+            for (neighbor, hop) in self._neighbors[node]:
+                new_turns = turns + hop
+                if new_turns < best.get(neighbor, new_turns + 1):
+                    best[neighbor] = new_turns
+                    came_from[neighbor] = node
+                    entry = (new_turns + h(neighbor), new_turns, neighbor)
+                    heapq.heappush(frontier, entry)
+        return None
+
+    def _heuristic(self, node, target, target_system):
+        """
+        PRIVATE METHOD
+
+        Returns a lower bound on the turns it takes to hop from `node` to
+        `target`: the larger of the bound given by the grid distance and the
+        bounds given by the landmarks (by the triangle inequality).
+        """
+
+        global ROUTE_DISTANCE_PER_TURN
+
+        distance = self._systems[node].grid_distance(target_system)
+        bound = -(-distance // ROUTE_DISTANCE_PER_TURN)
+        for distances in self._landmarks:
+            to_node = distances[node]
+            to_target = distances[target]
+            if to_node is not None and to_target is not None:
+                bound = max(bound, abs(to_target - to_node))
+        return bound
+
+    def _pick_landmarks(self):
+        """
+        PRIVATE METHOD
+
+        Picks up to `ROUTE_LANDMARKS` nodes spread out across the hop graph:
+        each one is the node farthest (by grid distance) from the landmarks
+        picked before it. Landmarks near the edges of known space give the
+        best bounds.
+
+        Returns:
+            A `list` of nodes.
+        """
+
+        global ROUTE_LANDMARKS
+
+        if not self._systems:
+            return []
+
+        landmarks = [0]
+        nearest = [self._systems[0].grid_distance(s) for s in self._systems]
+        while len(landmarks) < min(ROUTE_LANDMARKS, len(self._systems)):
+            farthest = max(xrange(0, len(nearest)), key=nearest.__getitem__)
+            if nearest[farthest] == 0:
+                break
+            landmarks.append(farthest)
+            landmark = self._systems[farthest]
+            for (node, system) in enumerate(self._systems):
+                distance = landmark.grid_distance(system)
+                nearest[node] = min(nearest[node], distance)
+        return landmarks
+
+
+
+def _hop_graph(systems):
+    """
+    PRIVATE FUNCTION
+
+    Returns the neighbors of every `System` in `systems` in the format of
+    `RoutePlanner._neighbors`. The `System`s are filed in cubes `ROUTE_MAX_HOP`
+    grid spaces wide, so each one is only compared with the `System`s in the
+    27 cubes around it.
+    """
+
+    global ROUTE_MAX_HOP
+
+    cube = lambda p: (p[0] // ROUTE_MAX_HOP, p[1] // ROUTE_MAX_HOP,
+                      p[2] // ROUTE_MAX_HOP)
+    cubes = {}
+    for (node, system) in enumerate(systems):
+        cubes.setdefault(cube(system.position), []).append(node)
+
+    offsets = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+               for dz in (-1, 0, 1)]
+    neighbors = []
+    for system in systems:
+        (cx, cy, cz) = cube(system.position)
+        hops = []
+        for (dx, dy, dz) in offsets:
+            for other in cubes.get((cx + dx, cy + dy, cz + dz), []):
+                other_system = systems[other]
+                if other_system is system:
+                    continue
+                if system.grid_distance(other_system) <= ROUTE_MAX_HOP:
+                    turns = system.hyperspace_jump_length(other_system)
+                    hops.append((other, turns))
+        neighbors.append(hops)
+    return neighbors
+
+
+
+def _components(neighbors):
+    """
+    PRIVATE FUNCTION
+
+    Returns the `list` that `RoutePlanner._components` holds for the hop
+    graph `neighbors`.
+    """
+
+    components = [None] * len(neighbors)
+    for start in xrange(0, len(neighbors)):
+        if components[start] is not None:
+            continue
+        components[start] = start
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for (neighbor, turns) in neighbors[node]:
+                if components[neighbor] is None:
+                    components[neighbor] = start
+                    stack.append(neighbor)
+    return components
+
+
+
+def _distances(neighbors, source, targets=None, limit=None):
+    """
+    PRIVATE FUNCTION
+
+    Dijkstra's algorithm over the hop graph `neighbors` from node `source`.
+
+    Keyword Args:
+        targets (set of int):
+            If given, the search stops once every node in `targets` has been
+            reached and a `dict` is returned instead of a `list`.
+
+        limit (int):
+            If given, nodes that take `limit` turns or more to reach are left
+            out.
+
+    Returns:
+        The `list` of the turns it takes to reach every node (`None` for the
+        nodes that cannot be reached), or, if `targets` was given, a `dict`
+        that maps the nodes in `targets` that were reached to their turns.
+    """
+
+    best = {source: 0}
+    done = {}
+    remaining = None if targets is None else set(targets)
+    frontier = [(0, source)]
+    while frontier:
+        (turns, node) = heapq.heappop(frontier)
+        if node in done:
+            continue
+        if limit is not None and turns >= limit:
+            break
+        done[node] = turns
+        if remaining is not None:
+            remaining.discard(node)
+            if not remaining:
+                break
+        for (neighbor, hop) in neighbors[node]:
+            new_turns = turns + hop
+            if neighbor not in done and \
+               new_turns < best.get(neighbor, new_turns + 1):
+                best[neighbor] = new_turns
+                heapq.heappush(frontier, (new_turns, neighbor))
+
+    if targets is not None:
+        return dict((node, done[node]) for node in targets if node in done)
+    return [done.get(node) for node in xrange(0, len(neighbors))]
+
+
+
+def _path(came_from, source, target):
+    """
+    PRIVATE FUNCTION
+
+    Returns the `list` of nodes from `source` to `target` that the search
+    which filled `came_from` found.
+    """
+
+    path = [target]
+    while path[-1] != source:
+        path.append(came_from[path[-1]])
+    path.reverse()
+    return path
@@ -0,0 +1,130 @@
+"""
+InterstellarAge
+scheduler.py
+
+This module defines the `OrderScheduler` class, which holds a `Game`'s queued
+`Order`s and executes them one turn at a time.
+
+Every turn is made of the phases defined at the top of "orders.py". The
+scheduler puts each `Order` in the bucket of the first phase it does something
+in and runs the buckets in phase order, so each `Order` is called once per
+phase it takes part in. `Order`s whose fleets are in hyperspace wait in a
+priority queue keyed by the turn they arrive on and are not looked at again
+until that turn. The fleets that arrive during a phase are resolved together
+once every `Order` in the phase has run (see "arrivals.py").
+"""
+
+# Import python modules
+import heapq
+
+# Import our modules
+import orders as order_lib
+
+class OrderScheduler(object):
+    """
+    Private Attributes:
+        _waiting (list of Order):
+            The `Order`s that have not been started, in the order they were
+            queued.
+
+        _in_transit (list):
+            A heap of `(arrives_on, seq, order)` tuples for the `Order`s whose
+            fleets are in hyperspace.
+
+        _seq (int):
+            Increases with every `Order` put in `_in_transit`, so that fleets
+            that arrive on the same turn arrive in the order they left.
+    """
+
+    def __init__(self, orders=None):
+        """
+        Keyword Args:
+            orders (list of Order):
+                The `Order`s to queue, in the order they were queued.
+        """
+
+        self._waiting = []
+        self._in_transit = []
+        self._seq = 0
+        for order in orders or []:
+            self.add(order)
+
+    def add(self, order):
+        """
+        Queues `order`. An `Order` with a fleet already in transit is put
+        straight into the hyperspace queue.
+        """
+
+        if order.arrives_on is not None:
+            self._send(order)
+        else:
+            self._waiting.append(order)
+
+    def orders(self):
+        """
+        Returns:
+            A `list` of every queued `Order`: those that have not been started
+            in the order they were queued, then those in transit in the order
+            they arrive.
+        """
+
+        in_transit = [entry[2] for entry in sorted(self._in_transit)]
+        return self._waiting + in_transit
+
+    def execute_turn(self, galaxy, turn):
+        """
+        Executes one turn of the queued `Order`s. `Order`s that are done or
+        that failed are dropped.
+
+        Args:
+            galaxy (Galaxy):
+                The `Galaxy` the `Order`s are carried out in.
+
+            turn (int):
+                The number of the turn being executed.
+        """
+
+        buckets = dict((phase, []) for phase in order_lib.PHASES)
+        for order in self._waiting:
+            buckets[order.phases[0]].append(order)
+        self._waiting = []
+
+        for phase in order_lib.PHASES:
+            bucket = buckets[phase]
+            if phase == order_lib.PHASE_HYPERSPACE_ARRIVALS:
+                bucket.extend(self._arrivals(turn))
+
+            for order in bucket:
+                result = order.execute(galaxy, phase, turn)
+                if result == order_lib.ORDER_NOT_FINISHED:
+                    next_phase = order.phases[order.phases.index(phase) + 1]
+                    assert next_phase > phase
+                    buckets[next_phase].append(order)
+                elif result == order_lib.ORDER_NOT_FINISHED_NEXT_TURN:
+                    self._send(order)
+
+            galaxy.resolve_arrivals()
+
+    def _arrivals(self, turn):
+        """
+        PRIVATE METHOD
+
+        Takes the `Order`s whose fleets arrive on or before `turn` out of the
+        hyperspace queue and returns them in the order they arrive.
+        """
+
+        arrivals = []
+        while self._in_transit and self._in_transit[0][0] <= turn:
+            arrivals.append(heapq.heappop(self._in_transit)[2])
+        return arrivals
+
+    def _send(self, order):
+        """
+        PRIVATE METHOD
+
+        Puts `order`, whose fleet is in hyperspace, in the hyperspace queue.
+        """
+
+        self._seq += 1
+        entry = (order.arrives_on, self._seq, order)
+        heapq.heappush(self._in_transit, entry)
@@ -0,0 +1,97 @@
+"""
+InterstellarAge
+serve.py
+
+Serves the web app from one process that can hold thousands of open
+connections, such as the event streams of "/game/events/<id>" (see
+"pubsub.py"). It needs gevent: every request is handled in a greenlet, and a
+request that waits (on a socket, a lock or a `Subscription`) only costs its
+greenlet, not a thread. The pages themselves are the usual Flask views.
+
+Resolving a turn takes a long time without waiting on anything, which would
+hold up every other greenlet. The turn workers of "turnqueue.py" hand the
+work to gevent's pool of real threads instead, so requests go on being
+answered while a turn is resolved.
+
+Run it from this directory with the port to listen on:
+
+    python serve.py [port]
+"""
+
+# gevent has to patch the standard library before anything else imports it.
+try:
+    from gevent import monkey
+except ImportError:
+    monkey = None
+
+if monkey is not None:
+    monkey.patch_all()
+
+# Import python modules
+import sys
+
+# Define constants.
+
+# The port to listen on if none is given.
+SERVE_PORT = 8000
+
+# The most real threads used to resolve turns at once.
+SERVE_RESOLVE_THREADS = 2
+
+def make_server(address, port):
+    """
+    Sets up the turn workers to resolve turns on real threads, the event
+    broker to deliver events from those threads, game locks to be waited for
+    without blocking and galaxy generation to stay in this process.
+
+    Args:
+        address (str):
+            The address to listen on.
+
+        port (int):
+            The port to listen on, or 0 for any free port.
+
+    Returns:
+        A `gevent.pywsgi.WSGIServer` for the web app. It is not started.
+    """
+
+    global SERVE_RESOLVE_THREADS
+
+    import gevent
+    from gevent.pywsgi import WSGIServer
+
+    from interstellarage import app
+    import galaxy as galaxy_lib
+    import pubsub as pubsub_lib
+    import storage as storage_lib
+    import turnqueue as turnqueue_lib
+
+    hub = gevent.get_hub()
+    hub.threadpool.maxsize = SERVE_RESOLVE_THREADS
+    turnqueue_lib.set_executor(hub.threadpool.apply)
+
+    # Turns resolved on those threads publish their events there; have the
+    # hub deliver them.
+    pubsub_lib.set_dispatcher(hub.loop.run_callback_threadsafe)
+
+    # A turn holds its game's lock while it is resolved on a real thread;
+    # requests that want the lock wait for it without blocking the hub.
+    storage_lib.set_lock_sleep(gevent.sleep)
+
+    # The pools of worker processes that generate large galaxies wait on
+    # pipes that gevent cannot see, so galaxies are generated in this process.
+    galaxy_lib.GALAXY_GENERATION_WORKERS = 1
+
+    return WSGIServer((address, port), app, log=None)
+
+
+
+if __name__ == "__main__":
+    if monkey is None:
+        print "serve.py needs gevent (pip install gevent)."
+        sys.exit(1)
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else SERVE_PORT
+    server = make_server('', port)
+    print "Serving on port {0}".format(port)
+    server.serve_forever()
@@ -0,0 +1,233 @@
+"""
+InterstellarAge
+simulation.py
+
+Runs games without the web app's database or game files: a `Simulation`
+generates a `Galaxy`, takes orders, executes them and begins new turns
+entirely in memory, with its snapshot and journal in a `MemoryStore` (or any
+other object with the methods of a `GameStore`). Its `SimulatedGame` and
+`SimulatedPlayer`s have the parts of `Game` and `Player` that the galaxy and
+order code use, without being rows in a database.
+
+The turn logic itself, `next_turn`, is shared with `Game`, which saves what
+it changed to the database afterwards.
+"""
+
+# Import our modules
+import galaxy as galaxy_lib
+import orders as order_lib
+import player as player_lib
+import scheduler as scheduler_lib
+import storage as storage_lib
+
+class SimulatedPlayer(object):
+    """
+    Stands in for a `Player`.
+
+    Attributes:
+        unique (int):
+        faction_code (int):
+        money (int):
+    """
+
+    def __init__(self, unique, faction_code):
+        self.unique = unique
+        self.faction_code = faction_code
+        self.money = -1
+
+    def faction_shortname(self):
+        return player_lib.faction_shortname(self.faction_code)
+
+    def start(self):
+        """
+        Sets up this `SimulatedPlayer` for the start of the game. See
+        `Player.start`.
+        """
+
+        self.money = player_lib.PLAYER_START_MONEY
+
+
+
+class SimulatedGame(object):
+    """
+    Stands in for a `Game`.
+
+    Attributes:
+        unique (int):
+        players (list of SimulatedPlayer):
+        galaxy (Galaxy):
+        on_turn (int):
+        seed (int):
+    """
+
+    def __init__(self, unique, players):
+        self.unique = unique
+        self.players = players
+        self.galaxy = None
+        self.on_turn = 0
+        self.seed = None
+
+    def player_for_faction(self, faction_shortname):
+        for player in self.players:
+            if player.faction_shortname() == faction_shortname:
+                return player
+        return None
+
+    def player_for_unique(self, unique):
+        for player in self.players:
+            if player.unique == unique:
+                return player
+        return None
+
+
+
+class Simulation(object):
+    """
+    A game played in memory.
+
+    Attributes:
+        game (SimulatedGame):
+            The game being simulated.
+
+        store (MemoryStore):
+            Where the snapshot and journal of the game are kept.
+
+    Private Attributes:
+        _scheduler (OrderScheduler):
+            Holds the queued orders.
+    """
+
+    def __init__(self, faction_codes=(0,), store=None, unique=0):
+        """
+        Keyword Args:
+            faction_codes (list of int):
+                The faction of each player. The players get the uniques 1, 2
+                and so on.
+
+            store (MemoryStore):
+                Where to keep the snapshot and journal. A new `MemoryStore`
+                by default.
+
+            unique (int):
+                The unique of the simulated game.
+        """
+
+        players = [SimulatedPlayer(a + 1, code) for (a, code) in
+                   enumerate(faction_codes)]
+        self.game = SimulatedGame(unique, players)
+        if store is None:
+            store = storage_lib.MemoryStore(unique)
+        self.store = store
+        self._scheduler = scheduler_lib.OrderScheduler()
+
+    def start(self, seed=None):
+        """
+        Generates the `Galaxy`, gives every player their starting money and
+        writes the first snapshot. See `Game.start`.
+
+        Keyword Args:
+            seed (int):
+                What the `Galaxy` is generated from; the same seed gives the
+                same `Galaxy`. A new seed is picked if none is given.
+        """
+
+        game = self.game
+        game.galaxy = galaxy_lib.Galaxy(game, generate=True, seed=seed)
+        game.seed = game.galaxy.seed
+        game.on_turn = 1
+        for player in game.players:
+            player.start()
+        self._scheduler = scheduler_lib.OrderScheduler()
+        self.commit()
+
+    def submit(self, player, orders_dict):
+        """
+        Parses and queues the orders of `player`, recording them in the
+        journal first. See `Game.queue_orders`.
+
+        Args:
+            player (SimulatedPlayer):
+                The player giving the orders.
+
+            orders_dict (dict):
+                The orders, in the format of `orders.orders_as_dict`.
+
+        Returns:
+            The `list` of the parsed `Order`s.
+        """
+
+        orders = order_lib.orders_from_dict(orders_dict, self.game)
+        self.store.append(storage_lib.JOURNAL_ORDERS, {
+            'player' : player.unique,
+            'orders' : orders_dict
+        })
+        for order in orders:
+            self._scheduler.add(order)
+        return orders
+
+    def resolve_turn(self):
+        """
+        Executes the queued orders, begins the next turn and writes a new
+        snapshot. See `Game.resolve_turn`.
+
+        Returns:
+            A `dict` that maps each faction code to the income paid to it.
+        """
+
+        game = self.game
+        self._scheduler.execute_turn(game.galaxy, game.on_turn)
+        income = next_turn(game)
+        self.commit()
+        return income
+
+    def commit(self):
+        """
+        Writes a new snapshot of the `Galaxy` and the queued orders and empties
+        the journal. See `Game.commit`.
+        """
+
+        orders_dict = order_lib.orders_as_dict(self._scheduler.orders())
+        self.store.write_snapshot(self.game.galaxy, orders_dict)
+
+    def reload(self):
+        """
+        Throws away the `Galaxy` and queued orders in memory and reads them
+        back from the snapshot and journal, the way a `Game` is loaded for a
+        new request.
+        """
+
+        game = self.game
+        game.galaxy = self.store.load_galaxy(game)
+        (orders_dict, records) = self.store.load_orders()
+        orders = order_lib.orders_from_dict(orders_dict, game)
+        self._scheduler = scheduler_lib.OrderScheduler(orders)
+        for record in records:
+            for order in order_lib.orders_from_dict(record['orders'], game):
+                self._scheduler.add(order)
+
+    @property
+    def orders(self):
+        return self._scheduler.orders()
+
+
+
+def next_turn(game):
+    """
+    Pays every player of `game` their income and begins the next turn. Only
+    the objects in memory are changed; saving them is up to the caller.
+
+    Args:
+        game (Game or SimulatedGame):
+
+    Returns:
+        A `dict` that maps each faction code to the income paid to it.
+    """
+
+    # Add planet GDP to players.
+    income = game.galaxy.income_by_faction()
+    for player in game.players:
+        player.money += income.get(player.faction_code, 0)
+
+    # Increment turn
+    game.on_turn += 1
+    return income
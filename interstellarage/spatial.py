@@ -0,0 +1,169 @@
+"""
+InterstellarAge
+spatial.py
+
+This module defines the `SpatialIndex` class, which a `Galaxy` uses to find
+its `System`s by position without looking at every `System` in the `Galaxy`.
+"""
+
+# Define constants.
+
+# The length (in grid spaces) of each side of the cubes that the galactic grid
+# is split into. This matches the distance that discoveries reach so that a
+# discovery only has to look at a handful of neighboring cubes.
+SPATIAL_BUCKET_SIZE = 4
+
+class SpatialIndex(object):
+    """
+    A uniform bucket grid over the positions of `System`s. The galactic grid
+    is split into cubes `bucket_size` grid spaces on a side, and every `System`
+    is filed under the cube that contains its position.
+
+    Attributes:
+        bucket_size (int):
+            The length of each side of the cubes.
+
+    Private Attributes:
+        _buckets (dict):
+            Maps the `(i, j, k)` key of a cube to the `list` of `System`s
+            inside that cube.
+
+        _positions (dict):
+            Maps a position `(x, y, z)` to the `System` at that position.
+    """
+
+    bucket_size = SPATIAL_BUCKET_SIZE
+
+    def __init__(self, bucket_size=SPATIAL_BUCKET_SIZE):
+        """
+        Keyword Args:
+            bucket_size (int):
+                The length (in grid spaces) of each side of the cubes.
+        """
+
+        # Preconditions.
+        assert bucket_size >= 1
+
+        self.bucket_size = bucket_size
+        self._buckets = {}
+        self._positions = {}
+
+    def __contains__(self, system):
+        return self._positions.get(tuple(system.position)) is system
+
+    def __len__(self):
+        return len(self._positions)
+
+    def add(self, system):
+        """
+        Files `system` under its position. The position of `system` must not
+        change while it is in the index.
+
+        Args:
+            system (System):
+                The `System` to add.
+        """
+
+        position = tuple(system.position)
+        key = self._bucket_key(position)
+        self._buckets.setdefault(key, []).append(system)
+        self._positions[position] = system
+
+    def remove(self, system):
+        """
+        Removes `system` from the index if it is in it.
+
+        Args:
+            system (System):
+                The `System` to remove.
+        """
+
+        position = tuple(system.position)
+        if self._positions.get(position) is not system:
+            return
+        del self._positions[position]
+
+        key = self._bucket_key(position)
+        bucket = self._buckets[key]
+        bucket.remove(system)
+        if len(bucket) == 0:
+            del self._buckets[key]
+
+    def at(self, position):
+        """
+        Args:
+            position ( (int, int, int) ):
+
+        Returns:
+            The `System` at `position` or `None` if there is no such `System`.
+        """
+
+        return self._positions.get(tuple(position))
+
+    def within(self, position, distance):
+        """
+        Args:
+            position ( (int, int, int) ):
+                The center of the search.
+
+            distance (int):
+                The search radius (in grid spaces).
+
+        Returns:
+            The `list` of `System`s whose grid distance from `position` is
+            less than or equal to `distance`. Only the cubes that could hold
+            such a `System` are looked at.
+        """
+
+        (x, y, z) = position
+        size = self.bucket_size
+
+        # The range of cubes along each axis that the search reaches.
+        low = self._bucket_key((x - distance, y - distance, z - distance))
+        high = self._bucket_key((x + distance, y + distance, z + distance))
+
+        to_return = []
+        for i in xrange(low[0], high[0] + 1):
+            dx = _axis_gap(x, i * size, size)
+            if dx > distance:
+                continue
+            for j in xrange(low[1], high[1] + 1):
+                dy = dx + _axis_gap(y, j * size, size)
+                if dy > distance:
+                    continue
+                for k in xrange(low[2], high[2] + 1):
+                    # Skip cubes whose closest corner is still too far away.
+                    if dy + _axis_gap(z, k * size, size) > distance:
+                        continue
+                    for system in self._buckets.get((i, j, k), ()):
+                        (sx, sy, sz) = system.position
+                        gap = abs(sx - x) + abs(sy - y) + abs(sz - z)
+                        if gap <= distance:
+                            to_return.append(system)
+        return to_return
+
+    def _bucket_key(self, position):
+        """
+        PRIVATE METHOD
+
+        Returns the `(i, j, k)` key of the cube that contains `position`.
+        """
+
+        size = self.bucket_size
+        return (position[0] // size, position[1] // size, position[2] // size)
+
+
+
+def _axis_gap(coordinate, start, size):
+    """
+    PRIVATE FUNCTION
+
+    Returns the distance along one axis between `coordinate` and the closest
+    point of the cube side that covers `start` to `start + size - 1`.
+    """
+
+    if coordinate < start:
+        return start - coordinate
+    elif coordinate > start + size - 1:
+        return coordinate - (start + size - 1)
+    return 0
@@ -353,6 +353,34 @@ var systemView = null;
 
 var systems;
 
+// The galaxy version the client last heard about from the server, and the star meshes on the
+// Galaxy Map indexed by system unique ID.
+var galaxyVersion = 0;
+var galaxyMapMeshes = {};
+
+// The turn the client last heard about from the server, and the jump lengths from the systems we
+// own to every system we can see during that turn (see "requestJumpMatrix").
+var galaxyTurn = -1;
+var jumpMatrix = null;
+
+// How often (in milliseconds) we ask the server what changed in the galaxy, if the browser can not
+// listen to the server's game events.
+var GALAXY_POLL_INTERVAL = 5000;
+
+// How often (in milliseconds) we ask the server whether the turn moved on while we listen to its
+// game events. Turns resolved by a turn worker of its own ("python turnqueue.py") are not sent
+// on the event stream (see "pubsub.py").
+var TURN_STATUS_POLL_INTERVAL = 30000;
+
+// Our money as of the last turn event (or galaxy changes) from the server, or null if we have not
+// had one yet.
+var playerMoney = null;
+
+// The size (in bytes) of a system's record in the map projection of the galaxy, and the flag set
+// in a record when we have discovered the planets of the system (see "maplod.py").
+var MAP_RECORD_SIZE = 21;
+var MAP_FLAG_PLANETS_DISCOVERED = 1;
+
 /**************************************************************************************************
                                     GALAXY MAP DISPLAY FUNCTIONS
 **************************************************************************************************/
@@ -378,23 +406,29 @@ function createGalaxyMap (startSystems) {
     galaxyMapSetup();
 
     for (a = 0; a < len; a++) {
-        var system = startSystems[a];
+        addGalaxyMapSystem(startSystems[a]);
+    }
+}
 
-        var x = system.x;
-        var y = system.z;
-        var z = system.y;
+/**
+ * Creates the star mesh for the given system dictionary and adds it to the Galaxy Map scene.
+ */
+function addGalaxyMapSystem (system) {
+    var x = system.x;
+    var y = system.z;
+    var z = system.y;
 
-        var sphere = new THREE.SphereGeometry(system.star_size / 2, 20, 20);
-        var mat = new THREE.MeshBasicMaterial( {
-            color: spectralClassColor(system.star_spectral_class)
-        });
-        var mesh = new THREE.Mesh(sphere, mat);
+    var sphere = new THREE.SphereGeometry(system.star_size / 2, 20, 20);
+    var mat = new THREE.MeshBasicMaterial( {
+        color: spectralClassColor(system.star_spectral_class)
+    });
+    var mesh = new THREE.Mesh(sphere, mat);
 
-        galaxyMap.scene.add(mesh);
-        objects.push(mesh);
-        mesh.position = new THREE.Vector3(x * 3, y * 3, z * 3);
-        mesh.userData = system;
-    }
+    galaxyMap.scene.add(mesh);
+    objects.push(mesh);
+    mesh.position = new THREE.Vector3(x * 3, y * 3, z * 3);
+    mesh.userData = system;
+    galaxyMapMeshes[system.unique] = mesh;
 }
 
 /**
@@ -419,11 +453,270 @@ var galaxyMapRender = function () {
 **************************************************************************************************/
 
 /*
- * Called when the server confirms that we have discovered new systems in the galaxy. This function
- * creates new star meshes for said systems and adds them to the Galaxy Map scene.
+ * Called when the server confirms that we have discovered new systems in the galaxy or that systems
+ * we know about have changed. This function creates new star meshes for the new systems, adds them
+ * to the Galaxy Map scene, and replaces our copies of the systems that changed.
  */
 function updateGalaxyMap (newSystems) {
+    var a = 0;
+    var b = 0;
+    var len = newSystems.length;
 
+    for (a = 0; a < len; a++) {
+        var system = newSystems[a];
+        var mesh = galaxyMapMeshes[system.unique];
+
+        // CASE: A newly discovered system.
+        if (mesh === undefined) {
+            addGalaxyMapSystem(system);
+            systems.push(system);
+            continue;
+        }
+
+        // CASE: A system we already have. Swap in the new copy.
+        mesh.userData = system;
+        for (b = 0; b < systems.length; b++) {
+            if (systems[b].unique === system.unique) {
+                systems[b] = system;
+                break;
+            }
+        }
+    }
+}
+
+/**
+ * Turns the map projection of some systems (the base64 of their packed records, their names and
+ * the spectral classes) into system objects for the Galaxy Map. These objects have no "planets"
+ * field; the full system is fetched by "requestSystemDetail" when it is opened.
+ */
+function decodeMapLOD (lod) {
+    var bytes = atob(lod.records);
+    var view = new DataView(new ArrayBuffer(bytes.length));
+    var a = 0;
+    for (a = 0; a < bytes.length; a++) {
+        view.setUint8(a, bytes.charCodeAt(a));
+    }
+
+    var decoded = [];
+    for (a = 0; a < lod.names.length; a++) {
+        var offset = a * MAP_RECORD_SIZE;
+        var ownerMask = view.getUint8(offset + 20);
+        var owners = [];
+        for (var code = 0; code < 8; code++) {
+            if (ownerMask & (1 << code)) {
+                owners.push(code);
+            }
+        }
+
+        var spectralClass = lod.classes[view.getUint8(offset + 14)];
+        decoded.push({
+            unique : view.getInt32(offset, true),
+            version : view.getUint32(offset + 4, true),
+            x : view.getInt16(offset + 8, true),
+            y : view.getInt16(offset + 10, true),
+            z : view.getInt16(offset + 12, true),
+            star_spectral_class : (spectralClass === undefined) ? "" : spectralClass,
+            planets_known : (view.getUint8(offset + 15) & MAP_FLAG_PLANETS_DISCOVERED) !== 0,
+            star_size : view.getFloat32(offset + 16, true),
+            owners : owners,
+            name : lod.names[a]
+        });
+    }
+    return decoded;
+}
+
+/**
+ * Asks the server for the full copy of a system that we only have the map projection of, swaps it
+ * into the Galaxy Map and then calls "callback" with it.
+ */
+function requestSystemDetail (system, callback) {
+    $.ajax({
+        type : 'POST',
+        url : '/game/galaxy/system',
+        data : {
+            'game' : gameId,
+            'system' : system.unique
+        },
+        success: function(fromServer) {
+            var j = JSON.parse(fromServer);
+            updateGalaxyMap([j.system]);
+            callback(j.system);
+        }
+    });
+}
+
+/**
+ * Downloads the galaxy from the server one spatial chunk at a time, starting with the chunks
+ * around our home systems, and adds each chunk to the Galaxy Map as soon as it arrives. Once the
+ * whole galaxy is here we start polling for changes.
+ */
+function streamGalaxy () {
+    systems = [];
+    galaxyMapSetup();
+    galaxyMapRender();
+
+    var request = new XMLHttpRequest();
+    var read = 0;
+
+    // The response is one JSON object per line. Handle every line that has arrived in full.
+    function readLines () {
+        var text = request.responseText;
+        var end = text.lastIndexOf("\n");
+        if (end < read) {
+            return;
+        }
+        var lines = text.substring(read, end).split("\n");
+        read = end + 1;
+
+        for (var a = 0; a < lines.length; a++) {
+            if (lines[a].length === 0) {
+                continue;
+            }
+            var j = JSON.parse(lines[a]);
+
+            // CASE: The first line, with the turn and the galaxy version.
+            if (j.version !== undefined) {
+                galaxyVersion = j.version;
+                galaxyTurn = j.turn;
+                requestJumpMatrix();
+            }
+
+            // CASE: The last line.
+            else if (j.done) {
+                listenForGameEvents();
+            }
+
+            // CASE: A chunk of systems, sent as their map projection.
+            else if (j.map !== undefined) {
+                updateGalaxyMap(decodeMapLOD(j.map));
+            }
+
+            // CASE: A chunk of systems, sent in full.
+            else {
+                updateGalaxyMap(j.galaxy);
+            }
+        }
+    }
+
+    request.onprogress = readLines;
+    request.onload = readLines;
+    request.open('POST', '/game/galaxy/stream', true);
+    request.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
+    request.send('game=' + encodeURIComponent(gameId) + '&lod=1');
+}
+
+/**
+ * Listens to the server's stream of events about our game, so that we hear about new turns the
+ * moment they begin instead of asking every few seconds. Browsers without EventSource poll. We
+ * still ask every now and then whether the turn moved on, for the turns that are not published.
+ */
+function listenForGameEvents () {
+    if (typeof EventSource === 'undefined') {
+        setInterval(pollGalaxyChanges, GALAXY_POLL_INTERVAL);
+        return;
+    }
+
+    var events = new EventSource('/game/events/' + encodeURIComponent(gameId));
+    events.addEventListener('turn', function (e) {
+        var j = JSON.parse(e.data);
+        playerMoney = j.money;
+
+        // Only ask for the galaxy if something we can see changed or the turn moved on.
+        if (j.systems.length > 0 || j.turn !== galaxyTurn) {
+            pollGalaxyChanges();
+        }
+    });
+
+    // We may have missed a turn while we were not connected.
+    events.onopen = pollGalaxyChanges;
+
+    setInterval(pollTurnStatus, TURN_STATUS_POLL_INTERVAL);
+}
+
+/**
+ * Asks the server which turn it is and catches up with the galaxy if the turn moved on.
+ */
+function pollTurnStatus () {
+    $.ajax({
+        type : 'POST',
+        url : '/game/turn/status',
+        data : {
+            'game' : gameId
+        },
+        success: function(fromServer) {
+            var j = JSON.parse(fromServer);
+            if (j.turn !== galaxyTurn) {
+                pollGalaxyChanges();
+            }
+        }
+    });
+}
+
+/**
+ * Asks the server for the systems that changed since the galaxy version we last heard about and
+ * applies them to the Galaxy Map.
+ */
+function pollGalaxyChanges () {
+    $.ajax({
+        type : 'POST',
+        url : '/game/galaxy/changes',
+        data : {
+            'game' : gameId,
+            'version' : galaxyVersion
+        },
+        success: function(fromServer) {
+            var j = JSON.parse(fromServer);
+            updateGalaxyMap(j.galaxy);
+            galaxyVersion = j.version;
+            playerMoney = j.money;
+            if (j.turn !== galaxyTurn) {
+                galaxyTurn = j.turn;
+                requestJumpMatrix();
+            }
+        }
+    });
+}
+
+/**
+ * Asks the server for the jump lengths from every system we own a planet in to every system we
+ * can see, all in one response. The answer stays good until the turn ends.
+ */
+function requestJumpMatrix () {
+    $.ajax({
+        type : 'POST',
+        url : '/game/galaxy/jumps',
+        data : {
+            'game' : gameId
+        },
+        success: function(fromServer) {
+            var j = JSON.parse(fromServer);
+            j.targetIndex = {};
+            for (var a = 0; a < j.targets.length; a++) {
+                j.targetIndex[j.targets[a]] = a;
+            }
+            jumpMatrix = j;
+        }
+    });
+}
+
+/**
+ * Returns the number of turns of the shortest jump from a system we own to the system with the
+ * unique ID "systemUnique", or undefined if we do not know it.
+ */
+function shortestJump (systemUnique) {
+    if (jumpMatrix === null || jumpMatrix.targetIndex[systemUnique] === undefined) {
+        return undefined;
+    }
+
+    var column = jumpMatrix.targetIndex[systemUnique];
+    var shortest;
+    for (var a = 0; a < jumpMatrix.jumps.length; a++) {
+        var jump = jumpMatrix.jumps[a][column];
+        if (shortest === undefined || jump < shortest) {
+            shortest = jump;
+        }
+    }
+    return shortest;
 }
 
 /**
@@ -489,8 +782,12 @@ function galaxyMapMove (goForward, goLeft, goBackward, goRight) {
 }
 
 function galaxyMapHover (x, y, above) {
-    // Draw the tooltip on the star.
+    // Draw the tooltip on the star, along with how far it is from our nearest system.
     var starName = above.name;
+    var jump = shortestJump(above.unique);
+    if (jump !== undefined) {
+        starName += " (" + jump + " turns away)";
+    }
     iagui.drawTooltip(x, y, starName);
 }
 
@@ -523,6 +820,12 @@ function systemViewSetup () {
  * dictionary.
  */
 function createSystemView (system) {
+    // The Galaxy Map only has the map projection of most systems. Fetch the full system first.
+    if (system.planets === undefined) {
+        requestSystemDetail(system, createSystemView);
+        return;
+    }
+
     // Declare iteration/loop variables.
     var a = 0;
     var len = system.planets.length;
@@ -596,7 +899,8 @@ function createSystemView (system) {
 
     // Setup the GUI.
     iagui.clear();
-    iagui.setTopbar(1000, 1, "<- Galaxy", systemViewBackToGalaxyMap);
+    iagui.setTopbar((playerMoney === null) ? 1000 : playerMoney, 1, "<- Galaxy",
+                    systemViewBackToGalaxyMap);
     iagui.draw();
 
     // Swap out the views.
@@ -777,7 +1081,8 @@ function animateSystemView () {
 var hyperspaceJump = {
     fromPlanet : -1,
     fleetNumber : -1,
-    oldSystemView : null
+    oldSystemView : null,
+    etas : {}
 };
 
 function setupHyperspaceJump(fromPlanet, fleetNumber) {
@@ -789,16 +1094,69 @@ function setupHyperspaceJump(fromPlanet, fleetNumber) {
     // We now display the galaxy map with a catch: clicking on a system will call
     // "hyperspaceJumpSystemSelect".
     galaxyMap.onMeshClick = hyperspaceJumpSystemSelect;
+    galaxyMap.onMeshHover = hyperspaceJumpHover;
     galaxyMap.onMouseDown = null;
     galaxyMap.onMouseUp = null;
     systemView.hide();
     galaxyMap.show();
 
+    // Ask for the ETA to every system on the map at once so they can be shown while the user
+    // picks a destination.
+    hyperspaceJump.etas = {};
+    requestHyperspaceETAs(fromPlanet, systems);
+
     // Set the camera position to be above our solar system in case it was moved.
 }
 
+/**
+ * Asks the server how many turns the quickest route from the planet "fromPlanet" to each of the
+ * systems in "candidates" takes and stores the answers in "hyperspaceJump.etas", keyed by system
+ * unique.
+ */
+function requestHyperspaceETAs(fromPlanet, candidates) {
+    var uniques = [];
+    for (var a = 0; a < candidates.length; a++) {
+        uniques.push(candidates[a].unique);
+    }
+
+    $.ajax({
+        type : 'POST',
+        url : '/game/galaxy/etas',
+        data : {
+            'game' : gameId,
+            'from_planet' : fromPlanet.unique,
+            'systems' : JSON.stringify(uniques)
+        },
+        success: function(fromServer) {
+            hyperspaceJump.etas = JSON.parse(fromServer);
+        }
+    });
+}
+
+/**
+ * Called when the mouse is over a system while plotting a hyperspace jump. Shows the name of the
+ * system along with how long it would take to get there.
+ */
+function hyperspaceJumpHover(x, y, above) {
+    // Until the ETAs arrive, show the direct jump from our nearest system.
+    var eta = hyperspaceJump.etas[above.unique];
+    if (eta === undefined) {
+        eta = shortestJump(above.unique);
+    }
+    if (eta === undefined) {
+        iagui.drawTooltip(x, y, above.name);
+    } else {
+        iagui.drawTooltip(x, y, above.name + " (" + eta + " turns)");
+    }
+}
+
 function hyperspaceJumpSystemSelect(system) {
-    var discovered = (system.planets.length !== 0);
+    // If we know the planets of this system but only have its map projection, fetch the planets.
+    if (system.planets === undefined && system.planets_known) {
+        requestSystemDetail(system, hyperspaceJumpSystemSelect);
+        return;
+    }
+    var discovered = (system.planets !== undefined && system.planets.length !== 0);
 
     // CASE: If the planets in this system are not discovered, then set the jump to the system.
     if (!discovered) {
@@ -849,6 +1207,7 @@ function hyperspaceJumpPlanetSelect(planet) {
  */
 function hyperspaceJumpRestoreOldSystemView () {
     // Restore the old system view.
+    galaxyMap.onMeshHover = galaxyMapHover;
     systemView.hide();
     galaxyMap.hide();
     systemView = oldSystemView;
@@ -897,17 +1256,6 @@ $(document).ready(function () {
     // Create the GUI.
     iagui = new IAGUI(canvas, dragCanvas, tooltipCanvas, factionCode);
 
-    $.ajax({
-        type : 'POST',
-        url : '/game/galaxy/entire',
-        data : {
-            'game' : gameId
-        },
-        success: function(fromServer) {
-            var j = JSON.parse(fromServer);
-            systems = j.galaxy;
-            createGalaxyMap(j.galaxy);
-            galaxyMapRender();
-        }
-    });
+    // Download the galaxy, drawing it as it arrives.
+    streamGalaxy();
 });
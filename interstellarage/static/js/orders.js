@@ -42,6 +42,7 @@ var orders = {
 
     deleteOrder : null,
     submit : null,
+    waitForTurn : null,
     reset : null,
 
     idCount : 0,
@@ -177,8 +178,43 @@ orders.submit = function () {
             'colonize' : orders.colonize
         },
         success : function(fromServer) {
-            console.log(fromServer);
+            var j = JSON.parse(fromServer);
+            console.log(j.message);
+            if (j.status === 'resolving') {
+                orders.waitForTurn();
+            } else {
+                orders.reset();
+            }
+        }
+    });
+};
+
+/**
+ * Called once our orders were the last ones in and the server is resolving
+ * the turn in the background. Asks the server to tell us when the turn is
+ * over (each request waits up to 20 seconds), then gets the new turn ready.
+ */
+orders.waitForTurn = function () {
+    $.ajax({
+        type : 'POST',
+        url : '/game/turn/status',
+        data : {
+            'game' : gameId,
+            'wait' : 20
+        },
+        success : function(fromServer) {
+            var j = JSON.parse(fromServer);
+            if (j.status === 'resolving') {
+                orders.waitForTurn();
+                return;
+            }
             orders.reset();
+            if (typeof pollGalaxyChanges === 'function') {
+                pollGalaxyChanges();
+            }
+        },
+        error : function() {
+            setTimeout(orders.waitForTurn, 5000);
         }
     });
 };
@@ -0,0 +1,584 @@
+"""
+InterstellarAge
+storage.py
+
+This module defines the `GameStore` class, which reads and writes the files
+that a started `Game` is saved in. A `Game` is saved as:
+
+    1) a snapshot: "<id>.galaxy.<n>.bin" holds the whole `Galaxy` (in the
+       format defined in "galaxyfile.py") and "<id>.orders.<n>.json" holds
+       the `Order`s that were still queued, both as they were at the end of
+       the last turn, and
+    2) a journal: "<id>.journal.json" holds one JSON record per line for
+       everything that happened since the snapshot was taken (for now, the
+       orders that `Player`s submitted).
+
+Submitting orders only appends one line to the journal. The snapshot is only
+rewritten at the end of a turn, when the journal is folded into it.
+
+The snapshot's files are numbered. "<id>.snapshot.json" names the number of
+the current snapshot and the sequence number of the last journal record
+folded into it, and keeps the seed the `Galaxy` was generated from. A new snapshot is written beside the current one and only
+takes its place when "<id>.snapshot.json" is replaced, so a crash leaves
+either the old snapshot or the new one, never the galaxy of one with the
+orders of the other. The files of the snapshot before the current one are
+kept for readers that were still opening them.
+
+Everything that reads the journal to act on it or writes the files of a
+`Game` does so while holding the `Game`'s lock, "<id>.lock" (see
+`GameStore.lock`), so that submissions and turn resolution in different
+threads and processes never interleave.
+
+A `MemoryStore` has the same methods as a `GameStore` but keeps the snapshot
+and journal in memory, for games that are only simulated (see
+"simulation.py").
+
+Games saved before the binary format was added have their `Galaxy` in
+"<id>.galaxy.json" instead, and games saved before snapshots were numbered
+have theirs in "<id>.galaxy.bin" and "<id>.orders.json". They are read until
+the next snapshot replaces them.
+"""
+
+# Import python modules
+import errno
+import fcntl
+import json
+import os
+import threading
+
+# Define constants.
+
+# Journal record kinds.
+JOURNAL_ORDERS = "orders"
+
+# How long (in seconds) a `GameLock` waits between tries at first and at
+# most, when it waits by polling (see `set_lock_sleep`).
+LOCK_POLL_MIN = 0.005
+LOCK_POLL_MAX = 0.1
+
+def data_directory():
+    """
+    Returns the path (ending in a slash) of the directory that the game files
+    are kept in.
+    """
+
+    current_directory = os.path.dirname(os.path.abspath(__file__))
+    return current_directory + "/data/"
+
+
+
+class GameStore(object):
+    """
+    Reads and writes the snapshot and journal of one `Game`.
+
+    Attributes:
+        game_unique (int):
+            The unique of the `Game` whose files these are.
+
+        journal_seq (int):
+            The sequence number of the last record in the journal or, if the
+            journal is empty, of the last record folded into the snapshot.
+    """
+
+    game_unique = 0
+    journal_seq = 0
+
+    def __init__(self, game_unique, directory=None):
+        """
+        Args:
+            game_unique (int):
+                The unique of the `Game` whose files these are.
+
+        Keyword Args:
+            directory (str):
+                Where to keep the files. Set to `data_directory()` by default.
+        """
+
+        self.game_unique = game_unique
+        self.journal_seq = 0
+        if directory is None:
+            directory = data_directory()
+        self._directory = directory
+
+    def lock(self):
+        """
+        Returns:
+            A `GameLock` on this `Game`'s files, to be used in a `with`
+            statement. The lock is not reentrant.
+        """
+
+        return GameLock(self._filename("lock"))
+
+    def galaxy_filename(self):
+        """
+        Returns:
+            The path of the galaxy file of the current snapshot.
+        """
+
+        manifest = self._read_manifest()
+        if manifest is None:
+            return self._filename("galaxy.bin")
+        return self._snapshot_filename("galaxy", manifest['snapshot'], "bin")
+
+    def json_galaxy_filename(self):
+        return self._filename("galaxy.json")
+
+    def orders_filename(self):
+        """
+        Returns:
+            The path of the orders file of the current snapshot.
+        """
+
+        manifest = self._read_manifest()
+        if manifest is None:
+            return self._filename("orders.json")
+        return self._snapshot_filename("orders", manifest['snapshot'], "json")
+
+    def journal_filename(self):
+        return self._filename("journal.json")
+
+    def manifest_filename(self):
+        return self._filename("snapshot.json")
+
+    def galaxy_file_version(self):
+        """
+        Returns:
+            A value that changes every time the snapshot's galaxy file is
+            replaced, or `None` if there is no galaxy file.
+        """
+
+        for filename in [self.galaxy_filename(), self.json_galaxy_filename()]:
+            if os.path.exists(filename):
+                stat = os.stat(filename)
+                return (filename, stat.st_ino, stat.st_mtime, stat.st_size)
+        return None
+
+    def load_galaxy(self, game):
+        """
+        Reads the `Galaxy` out of the snapshot. Only the header of the galaxy
+        file is read here; see `LazyGalaxy`.
+
+        Args:
+            game (Game):
+                The `Game` the `Galaxy` belongs to.
+
+        Returns:
+            The `Galaxy` as it was saved in the snapshot.
+        """
+
+        # Imported here since "galaxy.py" imports the web app, which imports
+        # this module.
+        import galaxy as galaxy_lib
+        import galaxyfile as galaxyfile_lib
+
+        galaxy_filename = self.galaxy_filename()
+        if os.path.exists(galaxy_filename):
+            galaxy = galaxyfile_lib.LazyGalaxy(game, galaxy_filename)
+        else:
+            galaxy_file = open(self.json_galaxy_filename())
+            galaxy_list = json.loads(galaxy_file.read())
+            galaxy_file.close()
+            galaxy = galaxy_lib.galaxy_from_dict(galaxy_list, game)
+
+        # The galaxy file does not hold the seed; the manifest does.
+        galaxy.seed = self.seed()
+        return galaxy
+
+    def seed(self):
+        """
+        Returns:
+            The seed the `Galaxy` of the current snapshot was generated from,
+            or `None` if it is not known (say, because the `Game` was saved
+            before seeds were kept).
+        """
+
+        manifest = self._read_manifest()
+        if manifest is None:
+            return None
+        return manifest.get('seed')
+
+    def load_orders(self):
+        """
+        Reads the queued orders out of the snapshot, along with the journal
+        records that were written after it.
+
+        Returns:
+            A tuple `(orders_dict, records)`: the queued orders as they were
+            saved in the snapshot, and the `list` of journal records (`dict`s)
+            to replay on top of them, in the order they were written.
+        """
+
+        manifest = self._read_manifest()
+        orders_file = open(self.orders_filename())
+        orders_dict = json.loads(orders_file.read())
+        orders_file.close()
+
+        # Records at or below the snapshot's sequence number were already
+        # folded into it. They can be left over if we stopped between writing
+        # the snapshot and emptying the journal.
+        if manifest is not None:
+            snapshot_seq = int(manifest['journal_seq'])
+        else:
+            snapshot_seq = int(orders_dict.get('journal_seq', 0))
+        self.journal_seq = snapshot_seq
+        records = []
+        if os.path.exists(self.journal_filename()):
+            journal_file = open(self.journal_filename())
+            for line in journal_file:
+                line = line.strip()
+                if line == "":
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn write at the end of the journal. Everything
+                    # after it is lost anyway.
+                    break
+                if record['seq'] <= snapshot_seq:
+                    continue
+                records.append(record)
+                self.journal_seq = record['seq']
+            journal_file.close()
+
+        return (orders_dict, records)
+
+    def append(self, kind, data):
+        """
+        Appends a record to the journal and waits until it is on disk.
+
+        Args:
+            kind (str):
+                One of the journal record kinds defined at the top of this
+                module.
+
+            data (dict):
+                What to record. The "seq" and "kind" keys are filled in by
+                this method.
+
+        Returns:
+            The `dict` that was written.
+        """
+
+        self.journal_seq += 1
+        record = dict(data)
+        record['seq'] = self.journal_seq
+        record['kind'] = kind
+
+        journal_file = open(self.journal_filename(), 'a')
+        journal_file.write(json.dumps(record) + "\n")
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+        journal_file.close()
+        return record
+
+    def write_snapshot(self, galaxy, orders_dict):
+        """
+        Replaces the snapshot with a new one and empties the journal. The
+        records in the journal must already be reflected in `galaxy` and
+        `orders_dict`. `galaxy.seed` is kept in the manifest.
+
+        Args:
+            galaxy (Galaxy):
+                The `Galaxy` to save.
+
+            orders_dict (dict):
+                The queued orders, keyed by `Order.dict_index`.
+        """
+
+        import galaxyfile as galaxyfile_lib
+
+        manifest = self._read_manifest()
+        previous = manifest['snapshot'] if manifest is not None else 0
+        snapshot = previous + 1
+
+        # Write the new snapshot's files beside the current ones. Nothing
+        # reads them until the manifest names them; if we stop before then,
+        # the next snapshot writes over them.
+        galaxy_bytes = galaxyfile_lib.encode_galaxy(galaxy)
+        _write_atomically(self._snapshot_filename("galaxy", snapshot, "bin"),
+                          galaxy_bytes)
+        _write_atomically(self._snapshot_filename("orders", snapshot, "json"),
+                          json.dumps(orders_dict))
+
+        # Replacing the manifest makes the new snapshot the current one.
+        _write_atomically(self.manifest_filename(), json.dumps({
+            'snapshot' : snapshot,
+            'journal_seq' : self.journal_seq,
+            'seed' : galaxy.seed
+        }))
+
+        journal_file = open(self.journal_filename(), 'w')
+        journal_file.close()
+
+        # The snapshot before the previous one and the files of older
+        # formats are out of date now.
+        old_filenames = [
+            self.json_galaxy_filename(),
+            self._filename("galaxy.bin"),
+            self._filename("orders.json")
+        ]
+        if previous > 1:
+            old_filenames.extend([
+                self._snapshot_filename("galaxy", previous - 1, "bin"),
+                self._snapshot_filename("orders", previous - 1, "json")
+            ])
+        for filename in old_filenames:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def _read_manifest(self):
+        """
+        PRIVATE METHOD
+
+        Returns:
+            The manifest of the current snapshot (a `dict` with its
+            "snapshot" number, its "journal_seq" and the "seed" of its
+            `Galaxy`), or `None` if this `Game` was saved before snapshots
+            were numbered.
+        """
+
+        try:
+            manifest_file = open(self.manifest_filename())
+        except IOError:
+            return None
+        manifest = json.loads(manifest_file.read())
+        manifest_file.close()
+        return manifest
+
+    def _snapshot_filename(self, kind, snapshot, extension):
+        """
+        PRIVATE METHOD
+
+        Returns the path of the `kind` ("galaxy" or "orders") file of the
+        snapshot numbered `snapshot`.
+        """
+
+        return self._filename("{0}.{1}.{2}".format(kind, snapshot, extension))
+
+    def _filename(self, suffix):
+        """
+        PRIVATE METHOD
+
+        Returns the path of this `Game`'s file that ends with `suffix`.
+        """
+
+        return "{0}{1}.{2}".format(self._directory, self.game_unique, suffix)
+
+
+
+class MemoryStore(object):
+    """
+    Keeps the snapshot and journal of one `Game` in memory, in the same
+    formats that a `GameStore` writes to disk.
+
+    Attributes:
+        game_unique (int):
+            The unique of the `Game` whose snapshot and journal these are.
+
+        journal_seq (int):
+            See `GameStore.journal_seq`.
+
+    Private Attributes:
+        _galaxy_bytes (str):
+            The galaxy file of the snapshot, or `None` before the first
+            snapshot.
+
+        _orders_json (str):
+            The queued orders of the snapshot as JSON.
+
+        _journal (list of str):
+            The journal records as JSON, in the order they were written.
+
+        _snapshots (int):
+            The number of snapshots written so far.
+
+        _seed (int):
+            The seed of the `Galaxy` of the snapshot. See `GameStore.seed`.
+
+        _lock (Lock):
+            Returned by `lock`.
+    """
+
+    def __init__(self, game_unique=0):
+        self.game_unique = game_unique
+        self.journal_seq = 0
+        self._galaxy_bytes = None
+        self._orders_json = None
+        self._journal = []
+        self._snapshots = 0
+        self._seed = None
+        self._lock = threading.Lock()
+
+    def lock(self):
+        """
+        Returns:
+            A `Lock` for the snapshot and journal. See `GameStore.lock`.
+        """
+
+        return self._lock
+
+    def galaxy_file_version(self):
+        """
+        Returns:
+            The number of snapshots written so far, or `None` if none have
+            been.
+        """
+
+        return self._snapshots if self._galaxy_bytes is not None else None
+
+    def load_galaxy(self, game):
+        """
+        Reads the `Galaxy` out of the snapshot. See `GameStore.load_galaxy`.
+        """
+
+        import galaxyfile as galaxyfile_lib
+        galaxy = galaxyfile_lib.LazyGalaxy(game, data=self._galaxy_bytes)
+        galaxy.seed = self._seed
+        return galaxy
+
+    def seed(self):
+        """
+        Returns:
+            The seed of the `Galaxy` of the snapshot. See `GameStore.seed`.
+        """
+
+        return self._seed
+
+    def load_orders(self):
+        """
+        Reads the queued orders out of the snapshot, along with the journal
+        records that were written after it. See `GameStore.load_orders`.
+        """
+
+        orders_dict = json.loads(self._orders_json)
+        snapshot_seq = int(orders_dict.get('journal_seq', 0))
+        self.journal_seq = snapshot_seq
+        records = []
+        for line in self._journal:
+            record = json.loads(line)
+            if record['seq'] <= snapshot_seq:
+                continue
+            records.append(record)
+            self.journal_seq = record['seq']
+        return (orders_dict, records)
+
+    def append(self, kind, data):
+        """
+        Appends a record to the journal. See `GameStore.append`.
+        """
+
+        self.journal_seq += 1
+        record = dict(data)
+        record['seq'] = self.journal_seq
+        record['kind'] = kind
+        self._journal.append(json.dumps(record))
+        return record
+
+    def write_snapshot(self, galaxy, orders_dict):
+        """
+        Replaces the snapshot with a new one and empties the journal. See
+        `GameStore.write_snapshot`.
+        """
+
+        import galaxyfile as galaxyfile_lib
+
+        orders_dict = dict(orders_dict)
+        orders_dict['journal_seq'] = self.journal_seq
+        self._galaxy_bytes = galaxyfile_lib.encode_galaxy(galaxy)
+        self._orders_json = json.dumps(orders_dict)
+        self._seed = galaxy.seed
+        self._journal = []
+        self._snapshots += 1
+
+
+
+class GameLock(object):
+    """
+    An exclusive advisory lock on a lock file, held while in a `with`
+    statement. Works across threads as well as processes since every
+    `GameLock` opens the lock file for itself.
+
+    Waiting for the lock blocks the thread, unless `set_lock_sleep` was
+    called; then the lock is tried without blocking and `_lock_sleep` is
+    called between tries.
+
+    Attributes:
+        filename (str):
+            The path of the lock file.
+
+    Private Attributes:
+        _file (file):
+            The open lock file while the lock is held.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = None
+
+    def __enter__(self):
+        global LOCK_POLL_MAX
+        global LOCK_POLL_MIN
+
+        self._file = open(self.filename, 'a')
+        if _lock_sleep is None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            return self
+
+        delay = LOCK_POLL_MIN
+        while True:
+            try:
+                fcntl.flock(self._file.fileno(),
+                            fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return self
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    self._file.close()
+                    self._file = None
+                    raise
+            _lock_sleep(delay)
+            delay = min(delay * 2, LOCK_POLL_MAX)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+        return False
+
+
+
+# Called with a number of seconds to wait between tries at a `GameLock`, if
+# set. See `set_lock_sleep`.
+_lock_sleep = None
+
+def set_lock_sleep(sleep):
+    """
+    Makes every `GameLock` wait for its lock by trying it without blocking
+    and calling `sleep` between tries. "serve.py" uses this with
+    `gevent.sleep`: gevent can not wait on a blocked `flock` call, so one
+    request waiting for a lock would hold up every other request.
+
+    Args:
+        sleep (function):
+            Called with the number of seconds (`float`) to wait.
+    """
+
+    global _lock_sleep
+    _lock_sleep = sleep
+
+
+
+def _write_atomically(filename, contents):
+    """
+    PRIVATE FUNCTION
+
+    Writes `contents` (`str`) to `filename` so that `filename` holds either its
+    old contents or all of `contents`, never a mix.
+    """
+
+    temp_filename = filename + ".tmp"
+    temp_file = open(temp_filename, 'wb')
+    temp_file.write(contents)
+    temp_file.flush()
+    os.fsync(temp_file.fileno())
+    temp_file.close()
+    os.rename(temp_filename, filename)
@@ -14,6 +14,9 @@ from other import rand_float_range, coinflip
 
 # Define global variables.
 DISCOVER_DISTANCE = 4
+
+# The number of grid spaces a fleet in hyperspace covers each turn.
+HYPERSPACE_SPEED = 4
 SYSTEM_MIN_PLANETS = 1
 SYSTEM_MAX_PLANETS = 10
 
@@ -47,50 +50,80 @@ class System(object):
             The `Planet`s in this `System`. Ordered such that the closest
             `Planet` to the star is at index 0.
 
-        discovered_by (set of Player):
-            The `Player`s that have discovered this `System` (able to travel
-            to it).
+        discovered_by (set of int):
+            The faction codes of the `Player`s that have discovered this
+            `System` (able to travel to it). Read only: worked out from the
+            `Galaxy`'s `DiscoveryMap` (see "discovery.py").
 
-        planets_discovered_by (set of Player):
-            The `Player`s that are able to travel to specific `Planet`s in this
-            `System`. This value is always a subset of `discovered_by`.
+        planets_discovered_by (set of int):
+            The faction codes of the `Player`s that are able to travel to
+            specific `Planet`s in this `System`. This value is always a subset
+            of `discovered_by`. Read only, like `discovered_by`.
 
         galaxy (Galaxy):
             The `Galaxy` that contains this `System`.
-    """
-
-    unique = 0
 
-    name = ""
-    position = (0, 0, 0)
+        index (int):
+            The position of this `System` in `Galaxy.systems`, or `None` if it
+            has not been added to a `Galaxy`. Discoveries are recorded against
+            this index.
 
-    star_spectral_class = ""
-    star_size = 0.0
-
-    planets = []
+        version (int):
+            The value of `Galaxy.version` the last time anything about this
+            `System` (including its `Planet`s) changed. Zero if nothing has
+            changed since the `System` was created.
 
-    discovered_by = set()
-    planets_discovered_by = set()
+    Notes:
+        - Like `Planet`s, `System`s keep their attributes in slots instead of
+          a `dict`. Every attribute is set in the constructor.
+    """
 
-    galaxy = None
+    __slots__ = (
+        'unique',
+        'name',
+        'position',
+        'star_spectral_class',
+        'star_size',
+        'planets',
+        'galaxy',
+        'index',
+        'version'
+    )
 
-    def __init__(self, name, star_spectral_class=None, generate_planets=False):
+    def __init__(self, name, star_spectral_class=None, generate_planets=False,
+                 rng=None):
         """
         Args:
             name (str):
                 The name of this system.
 
+        Keyword Args:
+            rng (Random):
+                Where the size of the star is drawn from. The `random` module
+                by default.
+
         Postconditions:
             If a `star_spectral_class` was given, then a `star_size` will also
             be calculated.
         """
 
+        self.unique = 0
         self.name = name
-        
+        self.position = (0, 0, 0)
+        self.star_spectral_class = ""
+        self.star_size = 0.0
+
+        # Every `System` gets its own list of planets.
+        self.planets = []
+
+        self.galaxy = None
+        self.index = None
+        self.version = 0
+
         if star_spectral_class is not None:
             self.star_spectral_class = star_spectral_class
             # TODO set size
-            self.star_size = rand_float_range(0.5, 3.0)
+            self.star_size = rand_float_range(0.5, 3.0, rng=rng)
 
     def __contains__(self, other):
         """
@@ -100,6 +133,20 @@ class System(object):
 
         return other in self.planets
 
+    @property
+    def discovered_by(self):
+        if self.index is None:
+            return set()
+        mask = self.galaxy.discovery_map().system_mask(self.index)
+        return self.galaxy.factions_for_mask(mask)
+
+    @property
+    def planets_discovered_by(self):
+        if self.index is None:
+            return set()
+        mask = self.galaxy.discovery_map().planets_mask(self.index)
+        return self.galaxy.factions_for_mask(mask)
+
     def as_dict(self, hide_planets=False, include_discoveries=True):
         """
         Gives a dictionary summary of this object. This is useful for returning
@@ -125,6 +172,7 @@ class System(object):
 
         to_return = {
             "unique" : self.unique,
+            "version" : self.version,
             "name" : self.name,
             "x" : self.position[0],
             "y" : self.position[1],
@@ -142,14 +190,33 @@ class System(object):
         # have discovered the planets in this system) if we're saving this
         # information to disk.
         if include_discoveries:
-            faction = lambda p: p.faction_shortname()
-            star = [faction(p) for p in self.discovered_by]
-            planets = [faction(p) for p in self.planets_discovered_by]
+            import player as player_lib
+            faction = player_lib.faction_shortname
+            star = [faction(code) for code in self.discovered_by]
+            planets = [faction(code) for code in self.planets_discovered_by]
             to_return['discovered_by'] = star
             to_return['planets_discovered_by'] = planets
 
         return to_return
 
+    def as_record(self):
+        """
+        Returns:
+            This `System` and its `Planet`s (see `Planet.as_record`) as a
+            `tuple` of plain values. `system_from_record` turns it back into a
+            `System`.
+        """
+
+        return (
+            self.unique,
+            self.name,
+            self.position,
+            self.star_spectral_class,
+            self.star_size,
+            self.version,
+            [planet.as_record() for planet in self.planets]
+        )
+
     def cartesian_distance(self, other_system):
         """
         The *actual* distance between the positions of this `System` and
@@ -197,9 +264,36 @@ class System(object):
         """
 
         global DISCOVER_DISTANCE
-        self.planets_discovered_by.add(by_player)
+
+        discovery = self.galaxy.discovery_map()
+        code = by_player.faction_code
+        if discovery.discover_planets(code, self.index):
+            self.touch()
         for system in self.galaxy.systems_near_system(self, DISCOVER_DISTANCE):
-            system.discovered_by.add(by_player)
+            if discovery.discover_system(code, system.index):
+                system.touch()
+
+    def discovered(self, player):
+        """
+        Returns `True` if and only if `player` has discovered this `System`.
+        Unlike `discovered_by`, no `set` is made.
+        """
+
+        if self.index is None:
+            return False
+        discovery = self.galaxy.discovery_map()
+        return discovery.knows_system(player.faction_code, self.index)
+
+    def planets_discovered(self, player):
+        """
+        Returns `True` if and only if `player` has discovered the `Planet`s in
+        this `System`.
+        """
+
+        if self.index is None:
+            return False
+        discovery = self.galaxy.discovery_map()
+        return discovery.knows_planets(player.faction_code, self.index)
 
     def flat_planets(self):
         """
@@ -240,26 +334,30 @@ class System(object):
 
         return x + y + z
 
-    def hyperspace_jump_length(self, other_system, fleet_size):
+    def hyperspace_jump_length(self, other_system, fleet_size=None):
         """
         Gives the number of turns it takes a fleet departing from this `System`
         to reach another system `other_system` when traveling through
-        hyperspace.
+        hyperspace in a single jump.
 
         Args:
             other_system (System):
                 The destination of the fleet whose journey length we're
                 calculating.
 
+        Keyword Args:
             fleet_size (int):
-                The number of ships in the departing fleet.
+                The number of ships in the departing fleet. The length of a
+                jump does not depend on it yet.
 
         Returns:
             An `int` representing how many turns it will take a fleet of
             `fleet_size` ships to reach `other_system`.
         """
 
-        return max(1, int(self.grid_distance(other_system) / 4))
+        global HYPERSPACE_SPEED
+        distance = self.grid_distance(other_system)
+        return max(1, int(distance / HYPERSPACE_SPEED))
 
     def receive_fleet(self, incoming_fleet_size, from_player):
         """
@@ -278,29 +376,40 @@ class System(object):
         """
 
         # Ensure data structure invariants
-        assert from_player not in self.planets_discovered_by
-        assert from_player in self.discovered_by
+        assert not self.planets_discovered(from_player)
+        assert self.discovered(from_player)
 
         # Send the fleet to the nearset planet
         self.planets[-1].receive_fleet(incoming_fleet_size, from_player)
-        self.discover()
+        self.discover(from_player)
+
+    def touch(self):
+        """
+        Marks this `System` as changed so that views of it that were cached
+        before the change are not used again. Call this whenever this
+        `System`, one of its `Planet`s or the set of `Player`s who have
+        discovered it changes.
+        """
+
+        if self.galaxy is not None:
+            self.galaxy.touch(self)
 
     def owners(self):
         """
         Returns:
-            The `set` of `Player`s who occupy at least one `Planet` in this
-            `System`.
+            The `set` of the faction codes of the `Player`s who occupy at
+            least one `Planet` in this `System`.
         """
 
         all_planets = self.flat_planets()
         to_return = set()
         for planet in all_planets:
-            to_return.add(planet.owner)
+            to_return.add(planet.owner_code)
         return to_return
 
 
 
-def generate_system(name, scheme):
+def generate_system(name, scheme, rng=None):
     """
     Args:
         name (str):
@@ -312,6 +421,12 @@ def generate_system(name, scheme):
             `SYSTEM_SCHEME_STAR` to name planets after `name` (for example,
             "Ceti Alpha V" and "Ceti Alpha VI").
 
+    Keyword Args:
+        rng (Random):
+            Where every random number is drawn from. The `random` module by
+            default. The same `name` and `scheme` and an `rng` in the same
+            state always give the same `System`.
+
     Returns:
         A `System` generated at random.
 
@@ -323,11 +438,14 @@ def generate_system(name, scheme):
     global SYSTEM_MAX_PLANETS
     global SYSTEM_MIN_PLANETS
 
+    if rng is None:
+        rng = random
+
     # How many planets does this system have?
-    num_planets = random.randint(SYSTEM_MIN_PLANETS, SYSTEM_MAX_PLANETS)
+    num_planets = rng.randint(SYSTEM_MIN_PLANETS, SYSTEM_MAX_PLANETS)
 
     # Generate a random spectral class.
-    star_spectral_class = _random_spectral_class()
+    star_spectral_class = _random_spectral_class(rng)
 
     # Now calculate the maximum and minimum distances planets can be between.
     min_orbit_dist = 0.1
@@ -336,7 +454,7 @@ def generate_system(name, scheme):
     # Calculate the orbiting distances between the planets.
     orbit_distances = []
     for a in xrange(0, num_planets):
-        distance = rand_float_range(min_orbit_dist, max_orbit_dist)
+        distance = rand_float_range(min_orbit_dist, max_orbit_dist, rng=rng)
         orbit_distances.append(distance)
     orbit_distances.sort()
 
@@ -355,22 +473,25 @@ def generate_system(name, scheme):
         planet_type = None
 
         # Case: Rocky or habitable planet
-        if coinflip(chance_rocky(distance)):
+        if coinflip(chance_rocky(distance), rng=rng):
             planet_type = planet_lib.RockyPlanet
-            if coinflip(chance_habitable(distance)):
+            if coinflip(chance_habitable(distance), rng=rng):
                 planet_type = planet_lib.HabitablePlanet
         else:
             planet_type = planet_lib.GasPlanet
 
-        planet = planet_type(orbit_distance=distance)
+        planet = planet_type(orbit_distance=distance, rng=rng)
 
         # TODO setup planet
-        planet.name = _planet_name(name, scheme, a)
+        planet.name = _planet_name(name, scheme, a, rng)
         planets.append(planet)
         a += 1
 
     # Setup the system that we will return
-    system = System(name, star_spectral_class=star_spectral_class)
+    system = System(name, star_spectral_class=star_spectral_class, rng=rng)
+    system.planets = planets
+    for planet in planets:
+        planet.parent = system
     return system
 
 
@@ -407,43 +528,95 @@ def system_from_dict(data, game):
         star_spectral_class=star_spectral_class
     )
     system.unique = unique
+    system.version = int(data.get('version', 0))
     system.planets = planets
+    for planet in planets:
+        planet.parent = system
     system.star_size = star_size
     system.position = (x, y, z)
     system.galaxy = game.galaxy
 
-    # Get the users who discovered the system.
+    # We're done here.
+    return system
+
+
+
+def system_from_record(record):
+    """
+    Creates a `System` from what `System.as_record` returned, without drawing
+    any random numbers.
+
+    Args:
+        record (tuple):
+            The record to read.
+
+    Returns:
+        A `System` whose attributes match the record. It is not part of any
+        `Galaxy`.
+    """
+
+    (unique, name, position, star_spectral_class, star_size, version,
+     planets) = record
+
+    system = System(name)
+    system.unique = unique
+    system.position = tuple(position)
+    system.star_spectral_class = star_spectral_class
+    system.star_size = star_size
+    system.version = version
+    system.planets = [planet_lib.planet_from_record(p) for p in planets]
+    for planet in system.planets:
+        planet.parent = system
+    return system
+
+
+
+def discoveries_from_dict(data, game):
+    """
+    Reads who discovered a `System` out of the `dict` it was saved as. The
+    discoveries are not part of the `System` itself, so the caller records
+    them in the `Galaxy` once the `System` has been added.
+
+    Args:
+        data (dict):
+            The `System` as returned by `System.as_dict`.
+
+        game (Game):
+            The `Game` whose `Player`s discovered the `System`.
+
+    Returns:
+        A tuple of `(discovered_by, planets_discovered_by)`, two `set`s of
+        `Player`s. Every `Player` of `game` is in a `set` that is missing from
+        `data`.
+    """
+
     p4f = game.player_for_faction
     if 'discovered_by' in data:
-        discov = data['discovered_by']
-        system.discovered_by = map(p4f, discov)
+        discovered_by = set(map(p4f, data['discovered_by']))
     else:
-        system.discovered_by = set(game.players)
+        discovered_by = set(game.players)
     if 'planets_discovered_by' in data:
-        pdiscov = data['planets_discovered_by']
-        system.planets_discovered_by = map(p4f, pdiscov)
+        planets_discovered_by = set(map(p4f, data['planets_discovered_by']))
     else:
-        system.planets_discovered_by = set(game.players)
+        planets_discovered_by = set(game.players)
+    return (discovered_by, planets_discovered_by)
 
-    # We're done here.
-    return system
 
 
-
-def _random_spectral_class():
+def _random_spectral_class(rng):
     """
     PRIVATE FUNCTION
 
-    Returns a random spectral class to be assigned to a `System` in the form
-    of a `str`.
+    Returns a random spectral class, drawn from `rng`, to be assigned to a
+    `System` in the form of a `str`.
     """
 
     global SPECTRAL_CLASSES
-    return random.choice(SPECTRAL_CLASSES)
+    return rng.choice(SPECTRAL_CLASSES)
 
 
 
-def _planet_name(system_name, scheme, n):
+def _planet_name(system_name, scheme, n, rng):
     """
     PRIVATE FUNCTION
 
@@ -463,6 +636,9 @@ def _planet_name(system_name, scheme, n):
         n (int):
             The planet we're naming is the `n`th planet in its system.
 
+        rng (Random):
+            Where a random name is drawn from.
+
     Returns:
         `str` -- what to name a planet.
     """
@@ -481,7 +657,7 @@ def _planet_name(system_name, scheme, n):
 
     # Case: random name
     else:
-        return galaxy_lib.random_name()
+        return galaxy_lib.random_name(rng=rng)
 
 
 
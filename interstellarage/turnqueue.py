@@ -0,0 +1,543 @@
+"""
+InterstellarAge
+turnqueue.py
+
+Once every `Player` of a `Game` has submitted orders, the turn has to be
+resolved: the orders executed, income paid out and a new snapshot written.
+That takes a while on a big galaxy, so it is not done inside the request of
+the last `Player` to submit. Instead, `Game.queue_orders` puts a job for the
+turn in the `TurnQueue` defined here, a table in a SQLite file next to the
+game files, and a pool of worker threads resolves it in the background.
+
+Claiming a job is a single SQLite transaction that skips every `Game` with a
+job already running, so one `Game` is never resolved by two workers at once,
+even when workers run in several processes. On top of that, a worker holds
+the `Game`'s file lock (see `GameStore.lock`) while it resolves the turn.
+
+Turns of different `Game`s have nothing to do with each other, so they can be
+resolved side by side. Threads share one interpreter and do not speed up the
+work itself; running this module as a script starts a pool of processes, one
+per core by default, that does nothing but resolve turns:
+
+    python turnqueue.py [number of processes]
+
+With such a pool running, `TURN_WORKERS` can be set to zero.
+"""
+
+# Import python modules
+import atexit
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+
+# Import our modules
+import storage as storage_lib
+
+# Define constants.
+
+# The number of worker threads the web server starts to resolve turns. Set to
+# zero to leave the jobs to worker processes started from the command line.
+TURN_WORKERS = 2
+
+# The name of the queue's SQLite file in the data directory.
+TURN_QUEUE_FILENAME = "turns.sqlite"
+
+# How long (in seconds) a job may run before it is assumed that its worker
+# died and the job is handed to another worker.
+TURN_JOB_TIMEOUT = 600
+
+# How often (in seconds) an idle worker looks for new jobs. Workers in the
+# same process as the submitting request are woken up straight away.
+TURN_POLL_INTERVAL = 1.0
+
+# How long (in seconds) `TurnWorkerPool.stop` waits for each worker to finish
+# the turn it is resolving. A job left running is handed to another worker
+# once `TURN_JOB_TIMEOUT` is up.
+TURN_STOP_TIMEOUT = 30
+
+# Job states.
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+class TurnQueue(object):
+    """
+    The jobs are kept in the "turn_jobs" table, which has one row per turn of
+    every `Game` that was put in the queue.
+
+    Attributes:
+        filename (str):
+            The path of the SQLite file.
+    """
+
+    def __init__(self, filename=None):
+        """
+        Keyword Args:
+            filename (str):
+                The path of the SQLite file. By default, `TURN_QUEUE_FILENAME`
+                in the data directory.
+        """
+
+        global TURN_QUEUE_FILENAME
+
+        if filename is None:
+            filename = storage_lib.data_directory() + TURN_QUEUE_FILENAME
+        self.filename = filename
+
+        connection = self._connect()
+        try:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS turn_jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "game INTEGER NOT NULL, "
+                "turn INTEGER NOT NULL, "
+                "state TEXT NOT NULL, "
+                "worker TEXT, "
+                "claimed_at REAL, "
+                "finished_at REAL, "
+                "error TEXT, "
+                "UNIQUE (game, turn))"
+            )
+        finally:
+            connection.close()
+
+    def enqueue(self, game_unique, turn):
+        """
+        Puts a job to resolve turn `turn` of a `Game` in the queue. A job that
+        failed before is queued again. Does nothing if the job is already
+        queued, running or done.
+
+        Returns:
+            `True` if and only if the job was queued.
+        """
+
+        global JOB_FAILED
+        global JOB_QUEUED
+
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO turn_jobs (game, turn, state) "
+                "VALUES (?, ?, ?)", (game_unique, turn, JOB_QUEUED))
+            queued = cursor.rowcount == 1
+            if not queued:
+                cursor = connection.execute(
+                    "UPDATE turn_jobs SET state = ?, error = NULL "
+                    "WHERE game = ? AND turn = ? AND state = ?",
+                    (JOB_QUEUED, game_unique, turn, JOB_FAILED))
+                queued = cursor.rowcount == 1
+            connection.execute("COMMIT")
+            return queued
+        finally:
+            connection.close()
+
+    def claim(self, worker):
+        """
+        Takes the oldest queued job of a `Game` that has no job running and
+        marks it as run by `worker`. Jobs that have been running for longer
+        than `TURN_JOB_TIMEOUT` are queued again first.
+
+        Args:
+            worker (str):
+                A name for the worker, for the record.
+
+        Returns:
+            A tuple of `(job id, game unique, turn)` or `None` if there is no
+            job to take.
+        """
+
+        global JOB_QUEUED
+        global JOB_RUNNING
+        global TURN_JOB_TIMEOUT
+
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "UPDATE turn_jobs SET state = ?, worker = NULL "
+                "WHERE state = ? AND claimed_at < ?",
+                (JOB_QUEUED, JOB_RUNNING, now - TURN_JOB_TIMEOUT))
+            row = connection.execute(
+                "SELECT id, game, turn FROM turn_jobs WHERE state = ? AND "
+                "game NOT IN (SELECT game FROM turn_jobs WHERE state = ?) "
+                "ORDER BY id LIMIT 1", (JOB_QUEUED, JOB_RUNNING)).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE turn_jobs SET state = ?, worker = ?, "
+                    "claimed_at = ? WHERE id = ?",
+                    (JOB_RUNNING, worker, now, row[0]))
+            connection.execute("COMMIT")
+            return row
+        finally:
+            connection.close()
+
+    def finish(self, job_id, error=None):
+        """
+        Marks a job as done or, if `error` (a `str`) is given, as failed.
+        """
+
+        global JOB_DONE
+        global JOB_FAILED
+
+        state = JOB_DONE if error is None else JOB_FAILED
+        connection = self._connect()
+        try:
+            connection.execute(
+                "UPDATE turn_jobs SET state = ?, finished_at = ?, error = ? "
+                "WHERE id = ?", (state, time.time(), error, job_id))
+        finally:
+            connection.close()
+
+    def status(self, game_unique, turn):
+        """
+        Returns:
+            The state of the job for turn `turn` of a `Game` (one of the
+            `JOB_*` constants) or `None` if there is no such job.
+        """
+
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT state FROM turn_jobs WHERE game = ? AND turn = ?",
+                (game_unique, turn)).fetchone()
+            return None if row is None else row[0]
+        finally:
+            connection.close()
+
+    def pending(self):
+        """
+        Returns:
+            The number of jobs that are queued or running.
+        """
+
+        global JOB_QUEUED
+        global JOB_RUNNING
+
+        connection = self._connect()
+        try:
+            return connection.execute(
+                "SELECT COUNT(*) FROM turn_jobs WHERE state IN (?, ?)",
+                (JOB_QUEUED, JOB_RUNNING)).fetchone()[0]
+        finally:
+            connection.close()
+
+    def _connect(self):
+        """
+        PRIVATE METHOD
+
+        Returns a new connection to the SQLite file. Every call uses its own
+        connection so that the queue can be used from any thread.
+        """
+
+        connection = sqlite3.connect(self.filename, timeout=30)
+        connection.isolation_level = None
+        return connection
+
+
+
+class TurnWorkerPool(object):
+    """
+    Threads or processes that take jobs from a `TurnQueue` and resolve them.
+
+    Private Attributes:
+        _queue (TurnQueue):
+            Where the jobs come from.
+
+        _resolve (function):
+            Called with the unique of a `Game` and a turn number to resolve
+            that turn.
+
+        _count (int):
+            The number of workers.
+
+        _processes (bool):
+            Whether the workers are processes rather than threads.
+
+        _until_empty (bool):
+            Whether the workers stop once the queue is empty.
+
+        _workers (list of Thread or Process):
+            The workers, once they are started.
+
+        _condition (Condition):
+            Notified when a job is queued or finished in this process.
+
+        _stopping (Event):
+            Set by `stop`. The workers stop once it is set.
+    """
+
+    def __init__(self, queue, resolve, count=TURN_WORKERS, processes=False,
+                 until_empty=False):
+        """
+        Args:
+            queue (TurnQueue):
+                Where the jobs come from.
+
+            resolve (function):
+                Called with the unique of a `Game` and a turn number to
+                resolve that turn.
+
+        Keyword Args:
+            count (int):
+                The number of workers.
+
+            processes (bool):
+                Whether to run the workers as processes instead of threads.
+                Process workers only look at the queue every
+                `TURN_POLL_INTERVAL` seconds, since `wake` can not reach them.
+
+            until_empty (bool):
+                Whether the workers stop once they find the queue empty,
+                rather than waiting for more jobs.
+        """
+
+        self._queue = queue
+        self._resolve = resolve
+        self._count = count
+        self._processes = processes
+        self._until_empty = until_empty
+        self._workers = []
+        self._condition = threading.Condition()
+        if processes:
+            self._stopping = multiprocessing.Event()
+        else:
+            self._stopping = threading.Event()
+
+    def start(self):
+        """
+        Starts the workers if they have not been started.
+        """
+
+        with self._condition:
+            if self._workers:
+                return
+            prefix = "{0}:{1}".format(socket.gethostname(), os.getpid())
+            for number in xrange(0, self._count):
+                name = "{0}:{1}".format(prefix, number)
+                if self._processes:
+                    worker = multiprocessing.Process(target=self._run,
+                                                     args=(name,))
+                else:
+                    worker = threading.Thread(target=self._run, args=(name,))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def join(self):
+        """
+        Waits for the workers to stop. They only stop by themselves if the
+        pool was made with `until_empty`.
+        """
+
+        for worker in self._workers:
+            worker.join()
+
+    def stop(self):
+        """
+        Tells the workers to stop and waits (for up to `TURN_STOP_TIMEOUT`
+        seconds each) for them to finish the jobs they are resolving. The
+        shared pool is stopped this way when the interpreter exits (see
+        `stop_workers`), since worker threads that are still running then die
+        with errors.
+        """
+
+        global TURN_STOP_TIMEOUT
+
+        self._stopping.set()
+        self.wake()
+        for worker in self._workers:
+            worker.join(TURN_STOP_TIMEOUT)
+
+    def wake(self):
+        """
+        Wakes up the idle threads (and anyone in `wait`) to look at the queue.
+        """
+
+        with self._condition:
+            self._condition.notify_all()
+
+    def wait(self, game_unique, turn, timeout):
+        """
+        Waits for up to `timeout` seconds for the job for turn `turn` of a
+        `Game` to stop being queued or running.
+
+        Returns:
+            The state of the job when the wait ended (see
+            `TurnQueue.status`).
+        """
+
+        global JOB_QUEUED
+        global JOB_RUNNING
+        global TURN_POLL_INTERVAL
+
+        deadline = time.time() + timeout
+        while True:
+            state = self._queue.status(game_unique, turn)
+            remaining = deadline - time.time()
+            if state not in (JOB_QUEUED, JOB_RUNNING) or remaining <= 0:
+                return state
+            with self._condition:
+                self._condition.wait(min(remaining, TURN_POLL_INTERVAL))
+
+    def _run(self, name):
+        """
+        PRIVATE METHOD
+
+        The loop of each worker: takes a job, resolves it and records how it
+        went, or sleeps until woken up if there is no job. Stops once `stop`
+        is called.
+        """
+
+        global TURN_POLL_INTERVAL
+
+        while not self._stopping.is_set():
+            job = self._queue.claim(name)
+            if job is None:
+                if self._until_empty and self._queue.pending() == 0:
+                    return
+                with self._condition:
+                    self._condition.wait(TURN_POLL_INTERVAL)
+                continue
+
+            (job_id, game_unique, turn) = job
+            try:
+                self._resolve(game_unique, turn)
+                error = None
+            except Exception:
+                error = traceback.format_exc()
+            self._queue.finish(job_id, error=error)
+            self.wake()
+
+
+
+# Called as `_executor(function, args)` to resolve turns, if set. See
+# `set_executor`.
+_executor = None
+
+def set_executor(executor):
+    """
+    Makes the shared workers hand every turn to `executor` rather than
+    resolve it themselves. "serve.py" uses this to resolve turns on real
+    threads while the workers are greenlets, so that the server can go on
+    answering requests in the meantime.
+
+    Args:
+        executor (function):
+            Called with a function and a `tuple` of arguments; calls the
+            function with the arguments and returns what it returns.
+    """
+
+    global _executor
+    _executor = executor
+
+
+
+def _resolve(game_unique, turn):
+    """
+    PRIVATE FUNCTION
+
+    Resolves turn `turn` of a `Game`. See `game.resolve_turn`.
+    """
+
+    import game as game_lib
+    if _executor is None:
+        game_lib.resolve_turn(game_unique, turn)
+    else:
+        _executor(game_lib.resolve_turn, (game_unique, turn))
+
+
+
+# The queue and worker pool used by the web server, made when first needed.
+_queue = None
+_pool = None
+_setup_lock = threading.Lock()
+
+def _shared_pool():
+    """
+    PRIVATE FUNCTION
+
+    Returns the shared `TurnWorkerPool`, making it (and the shared
+    `TurnQueue`) the first time.
+    """
+
+    global _pool
+    global _queue
+
+    with _setup_lock:
+        if _pool is None:
+            _queue = TurnQueue()
+            _pool = TurnWorkerPool(_queue, _resolve)
+        return _pool
+
+
+
+@atexit.register
+def stop_workers():
+    """
+    Stops this process' worker threads, if they were started, and waits for
+    them to finish the turns they are resolving (see `TurnWorkerPool.stop`).
+    Called when the interpreter exits. Workers are started again the next
+    time a turn is queued.
+    """
+
+    global _pool
+
+    with _setup_lock:
+        pool = _pool
+        _pool = None
+    if pool is not None:
+        pool.stop()
+
+
+
+def enqueue_turn(game_unique, turn):
+    """
+    Puts a job to resolve turn `turn` of a `Game` in the shared queue and
+    makes sure that this process' worker threads are running.
+    """
+
+    pool = _shared_pool()
+    _queue.enqueue(game_unique, turn)
+    pool.start()
+    pool.wake()
+
+
+
+def turn_status(game_unique, turn):
+    """
+    Returns the state of the job for turn `turn` of a `Game` in the shared
+    queue. See `TurnQueue.status`.
+    """
+
+    _shared_pool()
+    return _queue.status(game_unique, turn)
+
+
+
+def wait_for_turn(game_unique, turn, timeout):
+    """
+    Waits for up to `timeout` seconds for the job for turn `turn` of a `Game`
+    to finish. See `TurnWorkerPool.wait`.
+    """
+
+    return _shared_pool().wait(game_unique, turn, timeout)
+
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    else:
+        count = multiprocessing.cpu_count()
+    pool = TurnWorkerPool(TurnQueue(), _resolve, count=max(1, count),
+                          processes=True)
+    pool.start()
+    pool.join()
@@ -0,0 +1,244 @@
+"""
+InterstellarAge
+viewcache.py
+
+Every time a client polls for the galaxy, it gets back every `System` it can
+see as JSON. Most of those `System`s have not changed since the last poll, so
+this module keeps the JSON for each `System` that was sent to each `Player`
+and only serializes a `System` again once `System.version` says it changed.
+"""
+
+# Import python modules
+import json
+from collections import OrderedDict
+
+# Define constants.
+
+# The most (game, player) views that are kept in memory at once. When another
+# view is needed, the one that was used longest ago is thrown away.
+VIEW_CACHE_MAX_ENTRIES = 64
+
+class GalaxyView(object):
+    """
+    The cached JSON of the `Galaxy` as one `Player` sees it. The view stays
+    good across turns, since `System.version` changes with everything that
+    can change what a `Player` sees.
+
+    Attributes:
+        version (int):
+            The `Galaxy.version` that `json` was made at or -1 if `json` is
+            out of date.
+
+        json (str):
+            The whole visible galaxy as a JSON list.
+
+        fragments (dict):
+            Maps the `unique` of every `System` in this view to a tuple of
+            `(version, hide_planets, fragment)`, where `fragment` is the JSON
+            of the `System` at `System.version` `version`.
+    """
+
+    def __init__(self):
+        self.version = -1
+        self.json = "[]"
+        self.fragments = {}
+
+
+
+class GalaxyViewCache(object):
+    """
+    Holds the `GalaxyView`s for the most recently polled (game, player)
+    pairs.
+
+    Private Attributes:
+        _views (OrderedDict):
+            Maps `(game unique, player unique)` to a `GalaxyView`. Ordered from
+            least to most recently used.
+
+        _max_entries (int):
+            The most `GalaxyView`s to keep.
+    """
+
+    def __init__(self, max_entries=VIEW_CACHE_MAX_ENTRIES):
+        self._views = OrderedDict()
+        self._max_entries = max_entries
+
+    def galaxy_json(self, galaxy, player):
+        """
+        Args:
+            galaxy (Galaxy):
+                The `Galaxy` to serialize.
+
+            player (Player):
+                The `Player` the `Galaxy` will be sent to.
+
+        Returns:
+            The same list that `galaxy.as_list(for_player=player)` returns,
+            already encoded as a JSON `str`.
+        """
+
+        view = self._view(galaxy.game_unique, player.unique)
+
+        # Nothing has changed since the last time this view was made.
+        if view.version == galaxy.version:
+            return view.json
+
+        fragments = []
+        for system in galaxy.visible_systems(player):
+            fragment = self._fragment(view, system, player)
+            if fragment is not None:
+                fragments.append(fragment)
+
+        view.json = "[" + ", ".join(fragments) + "]"
+        view.version = galaxy.version
+        return view.json
+
+    def changes_json(self, galaxy, player, since):
+        """
+        Args:
+            galaxy (Galaxy):
+                The `Galaxy` to serialize.
+
+            player (Player):
+                The `Player` the changes will be sent to.
+
+            since (int):
+                The `Galaxy.version` the `Player` last saw.
+
+        Returns:
+            A JSON `str` of the list of `System`s that `player` can see and
+            that changed since `since`, in the same format as `galaxy_json`.
+        """
+
+        view = self._view(galaxy.game_unique, player.unique)
+
+        fragments = []
+        for system in galaxy.systems_changed_since(since):
+            fragment = self._fragment(view, system, player)
+            if fragment is not None:
+                fragments.append(fragment)
+        return "[" + ", ".join(fragments) + "]"
+
+    def systems_json(self, galaxy, player, systems):
+        """
+        Args:
+            galaxy (Galaxy):
+                The `Galaxy` that `systems` are in.
+
+            player (Player):
+                The `Player` the `System`s will be sent to.
+
+            systems (list of System):
+                The `System`s to serialize.
+
+        Returns:
+            A JSON `str` of the list of the `System`s in `systems` that
+            `player` can see, in the same format as `galaxy_json`.
+        """
+
+        view = self._view(galaxy.game_unique, player.unique)
+
+        fragments = []
+        for system in systems:
+            fragment = self._fragment(view, system, player)
+            if fragment is not None:
+                fragments.append(fragment)
+        return "[" + ", ".join(fragments) + "]"
+
+    def system_json(self, galaxy, player, system):
+        """
+        Returns:
+            The JSON of `system` (in `galaxy`) as `player` sees it, or `None`
+            if `player` cannot see `system`.
+        """
+
+        view = self._view(galaxy.game_unique, player.unique)
+        return self._fragment(view, system, player)
+
+    def _fragment(self, view, system, player):
+        """
+        PRIVATE METHOD
+
+        Returns the JSON of `system` as `player` sees it, reusing the JSON in
+        `view` if `system` has not changed since it was made. Returns `None`
+        if `player` cannot see `system`.
+        """
+
+        if not system.discovered(player):
+            return None
+
+        hide_planets = not system.planets_discovered(player)
+        cached = view.fragments.get(system.unique)
+        if cached is not None and cached[:2] == (system.version, hide_planets):
+            return cached[2]
+
+        fragment = json.dumps(system.as_dict(
+            hide_planets=hide_planets,
+            include_discoveries=False
+        ))
+        cached = (system.version, hide_planets, fragment)
+        view.fragments[system.unique] = cached
+        return fragment
+
+    def _view(self, game_unique, player_unique):
+        """
+        PRIVATE METHOD
+
+        Returns the `GalaxyView` for the given game and player, making a new
+        one if there is no such view.
+        """
+
+        key = (game_unique, player_unique)
+        view = self._views.pop(key, None)
+        if view is None:
+            view = GalaxyView()
+        self._views[key] = view
+
+        # Throw away the least recently used views.
+        while len(self._views) > self._max_entries:
+            self._views.popitem(last=False)
+        return view
+
+
+
+# The cache used by the web pages.
+_cache = GalaxyViewCache()
+
+def galaxy_json(galaxy, player):
+    """
+    Returns the visible part of `galaxy` for `player` as a JSON `str` from the
+    shared view cache. See `GalaxyViewCache.galaxy_json`.
+    """
+
+    return _cache.galaxy_json(galaxy, player)
+
+
+
+def changes_json(galaxy, player, since):
+    """
+    Returns the `System`s in `galaxy` that `player` can see and that changed
+    since `since` as a JSON `str` from the shared view cache. See
+    `GalaxyViewCache.changes_json`.
+    """
+
+    return _cache.changes_json(galaxy, player, since)
+
+
+
+def system_json(galaxy, player, system):
+    """
+    Returns `system` as `player` sees it as a JSON `str` from the shared view
+    cache. See `GalaxyViewCache.system_json`.
+    """
+
+    return _cache.system_json(galaxy, player, system)
+
+
+
+def systems_json(galaxy, player, systems):
+    """
+    Returns the `System`s in `systems` that `player` can see as a JSON `str`
+    from the shared view cache. See `GalaxyViewCache.systems_json`.
+    """
+
+    return _cache.systems_json(galaxy, player, systems)